@@ -0,0 +1,35 @@
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+CACHE_ALIAS = 'tokens'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def token_cache_key(key: str) -> str:
+    return f'token:{key}'
+
+
+def evict(*keys):
+    get_cache().delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication keeping token to account lookups in the tokens cache,
+    so repeated requests with the same token skip the Token and Account query.
+    Entries expire after the cache TIMEOUT and are evicted when the token is deleted or the account saved.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        credentials = cache.get(token_cache_key(key))
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            cache.set(token_cache_key(key), credentials)
+        elif not credentials[0].is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return credentials
@@ -0,0 +1,16 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+from .authentication import CACHE_ALIAS
+
+
+@register(Tags.security, Tags.caches, deploy=True)
+def check_token_cache(app_configs, **kwargs):
+    """
+    Token evictions on logout and password change only reach other workers through a shared cache.
+    """
+    if isinstance(caches[CACHE_ALIAS], LocMemCache):
+        return [Warning(
+            f'The {CACHE_ALIAS!r} cache is local to the process, other workers accept revoked tokens until '
+            f'TOKEN_CACHE_TIMEOUT.', hint='Set TOKEN_CACHE_BACKEND to file or redis.', id='accounts.W001')]
+    return []
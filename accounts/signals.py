@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import evict
+from .models import Account
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    evict(instance.key)
+
+
+@receiver(post_save, sender=Account)
+def evict_account_tokens(sender, instance, **kwargs):
+    # cached credentials hold a copy of the account, deleted accounts take their tokens along
+    evict(*Token.objects.filter(user_id=instance.id).values_list('key', flat=True))
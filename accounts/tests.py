@@ -1,3 +1,105 @@
-from django.test import TestCase
+import tempfile
+from django.conf import settings as django_settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from .authentication import CachedTokenAuthentication, get_cache, token_cache_key
+from .checks import check_token_cache
+from .models import Account
 
-# Create your tests here.
+
+@override_settings(QUERY_BUDGETS='raise')
+class QueryBudgetTest(TestCase):
+
+    def client_of(self, username: str) -> APIClient:
+        account = Account.objects.create_user(username, f'{username}@example.com', 'Password-123')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=account).key)
+        return client
+
+    def test_register(self):
+        response = APIClient().post('/accounts/register/', {'username': 'new', 'email': 'new@example.com',
+                                                            'password': 'Password-123'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_password_change(self):
+        response = self.client_of('user').post('/accounts/password_change/', {
+            'old_password': 'Password-123', 'new_password': 'Password-456'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_logout(self):
+        self.assertEqual(self.client_of('user').get('/accounts/logout/').status_code, 200)
+
+
+class TokenCacheTest(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.account = Account.objects.create_user('user', 'user@example.com', 'Password-123')
+        self.token = Token.objects.create(user=self.account)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def authenticate(self, key: str):
+        return CachedTokenAuthentication().authenticate_credentials(key)
+
+    def test_repeated_lookups_are_cached(self):
+        self.authenticate(self.token.key)
+        with self.assertNumQueries(0):
+            account, token = self.authenticate(self.token.key)
+        self.assertEqual((account.id, token.key), (self.account.id, self.token.key))
+
+    def test_logout_evicts_the_token(self):
+        self.authenticate(self.token.key)
+        self.assertEqual(self.client.get('/accounts/logout/').status_code, 200)
+        self.assertIsNone(get_cache().get(token_cache_key(self.token.key)))
+        self.assertEqual(self.client.get('/accounts/logout/').status_code, 401)
+
+    def test_password_change_evicts_the_old_token(self):
+        self.authenticate(self.token.key)
+        response = self.client.post('/accounts/password_change/', {
+            'old_password': 'Password-123', 'new_password': 'Password-456'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIsNone(get_cache().get(token_cache_key(self.token.key)))
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.token.key)
+        account, _ = self.authenticate(response.data['token'])
+        self.assertTrue(account.check_password('Password-456'))
+
+    def test_deactivated_account_is_rejected(self):
+        self.authenticate(self.token.key)
+        self.account.is_active = False
+        self.account.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.token.key)
+
+
+class SharedTokenCacheTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = directory.name
+        shared = override_settings(CACHES={**django_settings.CACHES, 'tokens': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': self.location}})
+        shared.enable()
+        self.addCleanup(shared.disable)
+
+    def test_logout_reaches_other_workers(self):
+        account = Account.objects.create_user('user', 'user@example.com', 'Password-123')
+        token = Token.objects.create(user=account)
+        CachedTokenAuthentication().authenticate_credentials(token.key)
+        other_worker = FileBasedCache(self.location, {})
+        self.assertIsNotNone(other_worker.get(token_cache_key(token.key)))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.assertEqual(client.get('/accounts/logout/').status_code, 200)
+        self.assertIsNone(other_worker.get(token_cache_key(token.key)))
+
+    def test_deploy_check(self):
+        self.assertEqual(check_token_cache(None), [])
+        local = {**django_settings.CACHES, 'tokens': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local):
+            self.assertEqual([warning.id for warning in check_token_cache(None)], ['accounts.W001'])
@@ -1,5 +1,4 @@
 from rest_framework.generics import CreateAPIView
-from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
@@ -8,21 +7,24 @@ from .serializers import AccountSerializer, AccountChangePasswordSerializer
 
 class Register(CreateAPIView):
     serializer_class = AccountSerializer
+    query_budgets = {'POST': 5}
 
 
 class Logout(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'GET': 2}
 
     def get(self, request, format=None):
-        request.user.auth_token.delete()
+        request.auth.delete()
         return Response(status=status.HTTP_200_OK)
 
 
 class PasswordChange(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'POST': 7}
 
     def post(self, request, format=None):
-        request.data['account_id'] = Token.objects.get(key=request.auth.key).user_id
+        request.data['account_id'] = request.user.id
         serializer = AccountChangePasswordSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
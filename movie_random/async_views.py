@@ -0,0 +1,51 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_READ_THREADS, thread_name_prefix='async-read')
+    return _executor
+
+
+def _run_read(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_reads(view):
+    """
+    Wrap a synchronous view for ASGI when settings.ASYNC_READS is on, return it unchanged otherwise.
+
+    Under ASGI Django runs every synchronous view on one shared thread, so a worker serves one request
+    at a time while it waits on the database. Reads of the wrapped view run and render on a pool of
+    ASYNC_READ_THREADS threads, each with its own database connection, so a worker serves that many reads
+    concurrently. Writes keep running on the shared thread, as they would without the wrapper.
+    """
+    if not settings.ASYNC_READS:
+        return view
+    write = sync_to_async(view, thread_sensitive=True)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in READ_METHODS:
+            return await write(request, *args, **kwargs)
+        call = partial(contextvars.copy_context().run, _run_read, view, request, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+    return wrapper
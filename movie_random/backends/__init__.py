@@ -0,0 +1,33 @@
+class HealthCheckMixin:
+    """
+    Database wrapper mixin checking a persistent connection with a ping before its first use in a request,
+    a connection dropped by the server while idle is reopened instead of failing the request.
+    Enabled with CONN_HEALTH_CHECKS in the database settings.
+    """
+
+    def __init__(self, settings_dict, *args, **kwargs):
+        super().__init__(settings_dict, *args, **kwargs)
+        self.health_check_enabled = settings_dict.get('CONN_HEALTH_CHECKS', False)
+        self.health_check_done = False
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_health_check_failed(self):
+        if self.connection is None or not self.health_check_enabled or self.health_check_done \
+                or self.in_atomic_block:
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        # checked on cursor creation only, ensure_connection also runs for get_autocommit() at request end
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def close_if_unusable_or_obsolete(self):
+        # runs at request start and end, the next request checks the connection again
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
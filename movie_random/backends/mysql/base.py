@@ -0,0 +1,6 @@
+from django.db.backends.mysql import base
+from movie_random.backends import HealthCheckMixin
+
+
+class DatabaseWrapper(HealthCheckMixin, base.DatabaseWrapper):
+    pass
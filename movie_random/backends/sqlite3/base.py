@@ -0,0 +1,6 @@
+from django.db.backends.sqlite3 import base
+from movie_random.backends import HealthCheckMixin
+
+
+class DatabaseWrapper(HealthCheckMixin, base.DatabaseWrapper):
+    pass
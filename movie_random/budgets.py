@@ -0,0 +1,132 @@
+import logging
+import re
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('movie_random.query_budgets')
+
+SHAPE_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b|%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),
+)
+# transaction control differs between requests and tests, which run inside a transaction, it is not budgeted
+TRANSACTION_RE = re.compile(r'\s*(?:BEGIN|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Budget:
+    """
+    At most queries queries per request, None for no limit, and at most repeats queries of one shape,
+    settings.QUERY_BUDGET_REPEATS by default.
+    """
+
+    def __init__(self, queries: int = None, repeats: int = None):
+        self.queries = queries
+        self.repeats = repeats
+
+    def __repr__(self):
+        return f'Budget({self.queries}, repeats={self.repeats})'
+
+
+def shape(sql: str) -> str:
+    """
+    SQL with literals and placeholders replaced and IN or VALUES lists collapsed, queries that differ only
+    in their parameters share a shape.
+    """
+    for pattern, replacement in SHAPE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def violations(statements: list, queries: int = None, repeats: int = None, executed: int = None) -> list:
+    """
+    Describe how statements exceed the budget, empty when they fit. Transaction control statements are not counted.
+
+    :param statements: executed SQL
+    :param queries: maximum number of queries, None for no limit
+    :param repeats: maximum number of queries of one shape, defaults to settings.QUERY_BUDGET_REPEATS
+    :param executed: number of executed queries when statements holds only a part of them
+    """
+    repeats = settings.QUERY_BUDGET_REPEATS if repeats is None else repeats
+    executed = len(statements) if executed is None else executed
+    queried = [sql for sql in statements if not TRANSACTION_RE.match(sql)]
+    executed -= len(statements) - len(queried)
+    found = []
+    if queries is not None and executed > queries:
+        found.append(f'{executed} queries, budget is {queries}')
+    for sql, count in Counter(map(shape, queried)).most_common():
+        if count <= repeats:
+            break
+        found.append(f'{count} queries of one shape, at most {repeats} allowed: {sql}')
+    return found
+
+
+def view_budget(view_func, method: str):
+    """
+    Return the Budget declared for method by the view class behind view_func, None when there is none.
+    Views declare a query_budgets mapping of HTTP method to Budget or maximum number of queries,
+    None marks a method whose queries grow with the data on purpose.
+    """
+    view_class = getattr(view_func, 'view_class', None)
+    budget = getattr(view_class, 'query_budgets', {}).get(method)
+    return Budget(budget) if isinstance(budget, int) else budget
+
+
+def check_request(request, request_metrics):
+    """
+    Enforce the budget of the view that served request in the settings.QUERY_BUDGETS mode,
+    'log' logs a warning, 'raise' raises QueryBudgetExceeded.
+    """
+    if settings.QUERY_BUDGETS not in ('log', 'raise') or request.resolver_match is None:
+        return
+    budget = view_budget(request.resolver_match.func, request.method)
+    if budget is None:
+        return
+    statements = [sql for sql, _ in request_metrics.query_log]
+    found = violations(statements, budget.queries, budget.repeats, executed=request_metrics.queries)
+    if not found:
+        return
+    message = f'{request.method} {request.resolver_match.route} exceeded its query budget: ' + '; '.join(found)
+    if settings.QUERY_BUDGETS == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class query_budget(ContextDecorator):
+    """
+    Fail with QueryBudgetExceeded when the block or decorated function runs more than queries
+    queries, or more than repeats queries of one shape, on any database.
+
+        with query_budget(5):
+            client.get('/movies/genres/1/')
+    """
+
+    def __init__(self, queries: int = None, repeats: int = None):
+        self.queries = queries
+        self.repeats = repeats
+
+    def _record(self, execute, sql, params, many, context):
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.statements = []
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+        if exc_type is None:
+            found = violations(self.statements, self.queries, self.repeats)
+            if found:
+                raise QueryBudgetExceeded('; '.join(found) + '\n' + '\n'.join(self.statements))
+        return False
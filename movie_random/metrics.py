@@ -0,0 +1,179 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+current = ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+PHASES = ('db', 'serialize', 'render')
+
+
+class RequestMetrics:
+    """
+    Query count and time spent per phase of one request. Queries run in any thread that inherits the
+    request context are counted, their SQL is kept up to settings.SLOW_REQUEST_MAX_QUERIES for the slow log.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.query_log = []
+        self._depth = dict.fromkeys(PHASES, 0)
+
+    def record_query(self, sql: str, seconds: float):
+        self.queries += 1
+        self.seconds['db'] += seconds
+        if len(self.query_log) < settings.SLOW_REQUEST_MAX_QUERIES:
+            self.query_log.append((sql, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Add the time of the block to phase name, minus queries it runs, nested blocks of a phase count once.
+        """
+        self._depth[name] += 1
+        if self._depth[name] > 1:
+            try:
+                yield
+            finally:
+                self._depth[name] -= 1
+            return
+        start, db = time.perf_counter(), self.seconds['db']
+        try:
+            yield
+        finally:
+            self._depth[name] -= 1
+            self.seconds[name] += time.perf_counter() - start - (self.seconds['db'] - db)
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total: float) -> str:
+        ms = {name: seconds * 1000 for name, seconds in self.seconds.items()}
+        return f'db;dur={ms["db"]:.1f};desc="{self.queries} queries", serialize;dur={ms["serialize"]:.1f}, ' \
+               f'render;dur={ms["render"]:.1f}, total;dur={total * 1000:.1f}'
+
+
+def timed(name: str):
+    """
+    Count the decorated function as phase name of the current request, a no-op outside of requests.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = current.get()
+            if metrics is None:
+                return func(*args, **kwargs)
+            with metrics.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - start)
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    instrument(connection)
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    Process wide request metrics, exported in the Prometheus text format.
+    """
+    namespace = 'movie_random'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests, self.durations, self.queries, self.phases, self.slow = {}, {}, {}, {}, {}
+
+    def observe(self, method: str, route: str, status: int, metrics: RequestMetrics, total: float, slow: bool):
+        labels = (method, route)
+        with self.lock:
+            key = (method, route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.durations.setdefault(labels, Histogram(DURATION_BUCKETS)).observe(total)
+            self.queries.setdefault(labels, Histogram(QUERY_BUCKETS)).observe(metrics.queries)
+            for phase, seconds in metrics.seconds.items():
+                key = labels + (phase,)
+                self.phases[key] = self.phases.get(key, 0.0) + seconds
+            if slow:
+                self.slow[labels] = self.slow.get(labels, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            for counters in (self.requests, self.durations, self.queries, self.phases, self.slow):
+                counters.clear()
+
+    @staticmethod
+    def _labels(names: tuple, values: tuple) -> str:
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+        return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+    def _histogram(self, lines: list, name: str, help_text: str, histograms: dict):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for labels, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(("method", "route", "le"), labels + (str(bound),))} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{self._labels(("method", "route"), labels)} {histogram.sum}')
+            lines.append(f'{name}_count{self._labels(("method", "route"), labels)} {cumulative}')
+
+    def export(self) -> str:
+        ns = self.namespace
+        with self.lock:
+            lines = [f'# HELP {ns}_requests_total Requests by method, route and status.',
+                     f'# TYPE {ns}_requests_total counter']
+            lines += [f'{ns}_requests_total{self._labels(("method", "route", "status"), k)} {v}'
+                      for k, v in sorted(self.requests.items())]
+            self._histogram(lines, f'{ns}_request_duration_seconds', 'Request duration.', self.durations)
+            self._histogram(lines, f'{ns}_request_queries', 'SQL queries per request.', self.queries)
+            lines += [f'# HELP {ns}_request_phase_seconds_total Time spent in db, serialize and render.',
+                      f'# TYPE {ns}_request_phase_seconds_total counter']
+            lines += [f'{ns}_request_phase_seconds_total{self._labels(("method", "route", "phase"), k)} {v}'
+                      for k, v in sorted(self.phases.items())]
+            lines += [f'# HELP {ns}_slow_requests_total Requests slower than SLOW_REQUEST_MS.',
+                      f'# TYPE {ns}_slow_requests_total counter']
+            lines += [f'{ns}_slow_requests_total{self._labels(("method", "route"), k)} {v}'
+                      for k, v in sorted(self.slow.items())]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import random
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from . import budgets, metrics
+from .routers import use_replicas
+
+slow_logger = logging.getLogger('movie_random.slow_requests')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class AsyncCapableMiddleware:
+    """
+    Middleware running in the mode of the handler it wraps, so under ASGI requests reach async views without
+    holding the thread Django runs synchronous code on. Subclasses implement __call__ and __acall__.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # mark the instance as a coroutine function, as django.utils.deprecation.MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """
+    Let safe requests under settings.REPLICA_READ_PATHS read from replicas. A client that made a successful
+    write reads from the primary for the next REPLICA_STICKY_SECONDS, so it sees its own writes
+    despite replication lag. Clients are told apart by user, or by session when anonymous, and the window is
+    kept in REPLICA_STICKY_CACHE, which has to be shared by all worker processes.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if settings.REPLICA_DATABASES and \
+                isinstance(caches[settings.REPLICA_STICKY_CACHE], (LocMemCache, DummyCache)):
+            raise ImproperlyConfigured(
+                f'REPLICA_STICKY_CACHE {settings.REPLICA_STICKY_CACHE!r} is local to the process, clients would read '
+                f'stale replicas after writes served by another worker. Use a shared cache with DB_REPLICAS.')
+
+    @staticmethod
+    def client(request):
+        """
+        Return the user of the request, authenticated by the API authentication classes when no session user
+        is logged in, else the session key, or None for anonymous clients without a session.
+        """
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            authenticators = [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+            try:
+                user = Request(request, authenticators=authenticators).user
+            except APIException:
+                user = None
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key:
+            return f'session:{session.session_key}'
+        return None
+
+    def sticky_key(self, request):
+        client = self.client(request)
+        return client and f'primary:{client}'
+
+    def reads_replicas(self, request) -> bool:
+        if not (settings.REPLICA_DATABASES and request.method in SAFE_METHODS and
+                request.path.startswith(tuple(settings.REPLICA_READ_PATHS))):
+            return False
+        key = self.sticky_key(request)
+        return key is None or caches[settings.REPLICA_STICKY_CACHE].get(key) is None
+
+    def stick(self, request, response):
+        if settings.REPLICA_DATABASES and request.method not in SAFE_METHODS and response.status_code < 400:
+            key = self.sticky_key(request)
+            if key is not None:
+                caches[settings.REPLICA_STICKY_CACHE].set(key, True, settings.REPLICA_STICKY_SECONDS)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = use_replicas.set(self.reads_replicas(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replicas.reset(token)
+        self.stick(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = use_replicas.set(await sync_to_async(self.reads_replicas)(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replicas.reset(token)
+        await sync_to_async(self.stick)(request, response)
+        return response
+
+
+class InstrumentationMiddleware(AsyncCapableMiddleware):
+    """
+    Record query count and database, serialization and render time of every request, report them in a
+    Server-Timing header and the metrics registry, and log requests slower than settings.SLOW_REQUEST_MS
+    with their queries, a SLOW_REQUEST_SAMPLE_RATE fraction of them. Query budgets declared by views
+    are enforced here in the settings.QUERY_BUDGETS mode.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS:
+            return self.get_response(request)
+        request_metrics, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS:
+            return await self.get_response(request)
+        request_metrics, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    @staticmethod
+    def start() -> tuple:
+        for alias in connections:
+            metrics.instrument(connections[alias])
+        request_metrics = metrics.RequestMetrics()
+        return request_metrics, metrics.current.set(request_metrics)
+
+    def finish(self, request, response, request_metrics):
+        total = request_metrics.total
+        slow = total * 1000 >= settings.SLOW_REQUEST_MS
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        metrics.registry.observe(request.method, route, response.status_code, request_metrics, total, slow)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = request_metrics.server_timing(total)
+        if slow and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE:
+            self.log_slow(request, response, request_metrics, total)
+        budgets.check_request(request, request_metrics)
+        return response
+
+    @staticmethod
+    def log_slow(request, response, request_metrics, total: float):
+        queries = '\n'.join(f'  {seconds * 1000:8.2f} ms  {sql}' for sql, seconds in request_metrics.query_log)
+        slow_logger.warning('%s %s %s in %.1f ms, %s, %d queries:\n%s', request.method, request.get_full_path(),
+                            response.status_code, total * 1000, request_metrics.server_timing(total),
+                            request_metrics.queries, queries)
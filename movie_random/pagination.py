@@ -1,7 +1,149 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 
 
 class LargeSetPagination(PageNumberPagination):
     page_size = 100
     page_query_param = 'page'
     max_page_size = 1000
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique ordering, pages are fetched with a range condition on the last seen row
+    instead of OFFSET, so every page costs the same. Ordering is taken from the queryset, defaults to
+    the model Meta.ordering, and is followed by id.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = LargeSetPagination.max_page_size
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = None
+
+    def get_ordering(self, queryset) -> tuple:
+        ordering = tuple(self.ordering or queryset.query.order_by or queryset.model._meta.ordering)
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering += ('pk',)
+        return ordering
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def include_count(self, request) -> bool:
+        return request.query_params.get(self.count_query_param, 'true').lower() not in ('false', '0')
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        values = [getattr(instance, field.lstrip('-')) for field in self.ordering]
+        cursor = json.dumps({'r': reverse, 'v': values}, cls=JSONEncoder, separators=(',', ':'))
+        return urlsafe_b64encode(cursor.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            reverse, values = bool(cursor['r']), list(cursor['v'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, values
+
+    def seek_q(self, values: list, reverse: bool) -> Q:
+        """
+        Lexicographic "comes after values" condition over the ordering, "comes before" when reverse.
+        """
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            after = field.startswith('-') == reverse
+            equal = {f.lstrip('-'): v for f, v in zip(self.ordering[:i], values)}
+            conditions.append(Q(**equal, **{f'{name}__{"gt" if after else "lt"}': values[i]}))
+        return reduce(or_, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.ordering = self.get_ordering(queryset)
+        self.count = queryset.count() if self.include_count(request) else None
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor[0])
+        if cursor:
+            queryset = queryset.filter(self.seek_q(cursor[1], reverse))
+        if reverse:
+            ordering = [f[1:] if f.startswith('-') else '-' + f for f in self.ordering]
+        else:
+            ordering = self.ordering
+        page = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[0], reverse=True))
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+
+class RelationPagination(KeysetPagination):
+    """
+    Keyset pagination of one nested relation of a detail response, the cursor and page size
+    query parameters are prefixed with the relation name so every relation pages on its own.
+    """
+    page_size = 20
+    max_page_size = 100
+    ordering = ('id',)
+
+    def __init__(self, relation: str):
+        self.relation = relation
+        self.cursor_query_param = f'{relation}_cursor'
+        self.page_size_query_param = f'{relation}_page_size'
+
+    @classmethod
+    def query_params(cls, relation: str) -> set:
+        return {f'{relation}_cursor', f'{relation}_page_size', cls.count_query_param}
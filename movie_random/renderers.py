@@ -0,0 +1,80 @@
+import json
+import re
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FRAGMENT_MARK = '\x00fragment:'
+FRAGMENT_RE = re.compile(rb'"\\u0000fragment:(\d+)\\u0000"')
+JS_ESCAPES = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+_encoder = JSONEncoder()
+loads = orjson.loads if orjson is not None else json.loads
+
+
+class Fragment(bytes):
+    """
+    Pre-encoded JSON value, written into the output of FastJSONRenderer and dumps as is.
+    """
+
+
+def _expand(data):
+    """
+    Return data with fragments decoded, for encoders that cannot splice them.
+    """
+    if isinstance(data, Fragment):
+        return loads(bytes(data))
+    if isinstance(data, dict):
+        return {k: _expand(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_expand(v) for v in data]
+    return data
+
+
+def dumps(data) -> bytes:
+    """
+    Encode data to compact UTF-8 JSON with orjson when installed, the standard library otherwise.
+    Output is the same as of the compact rest_framework JSONRenderer, types unknown to the encoder
+    go through the rest_framework JSONEncoder and fragments are spliced in without decoding.
+    """
+    fragments = []
+
+    def default(obj):
+        if isinstance(obj, Fragment):
+            fragments.append(obj)
+            return f'{FRAGMENT_MARK}{len(fragments) - 1}\x00'
+        return _encoder.default(obj)
+
+    if orjson is not None:
+        ret = orjson.dumps(data, default=default,
+                           option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    else:
+        ret = json.dumps(data, default=default, ensure_ascii=False, allow_nan=False,
+                         separators=(',', ':')).encode()
+    if fragments:
+        ret = FRAGMENT_RE.sub(lambda m: fragments[int(m.group(1))], ret)
+    for char, escape in JS_ESCAPES:
+        if char in ret:
+            ret = ret.replace(char, escape)
+    return ret
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding compact responses with dumps, indented ones (browsable API, ?indent=)
+    fall back to the rest_framework encoder.
+    """
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.compact and not self.ensure_ascii and \
+                self.get_indent(accepted_media_type, renderer_context or {}) is None:
+            return dumps(data)
+        return super().render(_expand(data), accepted_media_type, renderer_context)
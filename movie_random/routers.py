@@ -0,0 +1,35 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+
+# set by ReplicaRoutingMiddleware for the duration of a request whose reads may go to a replica
+use_replicas = ContextVar('use_replicas', default=False)
+
+
+def reading_replicas() -> bool:
+    """
+    Whether reads of the current request go to a replica, which may not have applied the latest writes yet.
+    """
+    return use_replicas.get() and bool(settings.REPLICA_DATABASES)
+
+
+class ReplicaRouter:
+    """
+    Send reads to a random replica of settings.REPLICA_DATABASES while use_replicas is set,
+    everything else goes to the primary default database. Replicas are expected to mirror the primary,
+    so migrations run on the primary only.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reading_replicas():
+            return random.choice(settings.REPLICA_DATABASES)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -42,23 +42,31 @@ INSTALLED_APPS = [
     'accounts.apps.AccountsConfig',
     'movies.apps.MoviesConfig',
     'randomizer.apps.RandomizerConfig',
+    'stats.apps.StatsConfig',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_RENDERER_CLASSES': [
+        'movie_random.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'movie_random.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
 }
 
 
 MIDDLEWARE = [
+    'movie_random.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # after sessions and authentication, clients are told apart by user or session
+    'movie_random.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -89,17 +97,141 @@ WSGI_APPLICATION = 'movie_random.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DB_PROFILE picks MySQL or a local SQLite file. Connections are kept open for DB_CONN_MAX_AGE seconds
+# (0 closes them after every request) and pinged before reuse when DB_CONN_HEALTH_CHECKS is on.
+# Every thread keeps its own connection, a process holds at most ASYNC_READ_THREADS + 1 of them.
+
+DATABASE_PROFILES = {
+    'mysql': {
+        'ENGINE': 'movie_random.backends.mysql',
+        'NAME': os.environ.get('DB_NAME', 'movie_random'),
+        'USER': os.environ.get('DB_USER', 'root'),
+        'PASSWORD': os.environ.get('DB_PASSWORD'),
+        'HOST': os.environ.get('DB_HOST', '127.0.0.1'),
+        'PORT': os.environ.get('DB_PORT', '3307'),
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        },
+    },
+    'sqlite': {
+        'ENGINE': 'movie_random.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'movie_random',
-        'USER': 'root',
-        'PASSWORD': os.environ.get('DB_PASSWORD'),
-        'HOST': '127.0.0.1',
-        'PORT': '3307',
+        **DATABASE_PROFILES[os.environ.get('DB_PROFILE', 'mysql')],
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1').lower() in ('1', 'true', 'yes'),
+    },
+}
+
+# Read replicas, comma separated host[:port] for MySQL or file paths for SQLite. Safe requests under
+# REPLICA_READ_PATHS read from a random replica unless the client wrote within REPLICA_STICKY_SECONDS.
+# REPLICA_STICKY_CACHE must name a cache shared by all workers (file or redis) when replicas are set.
+
+REPLICA_DATABASES = []
+for number, replica in enumerate(r for r in os.environ.get('DB_REPLICAS', '').split(',') if r):
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        replica_settings = {'NAME': replica}
+    else:
+        host, _, port = replica.partition(':')
+        replica_settings = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    DATABASES[f'replica_{number}'] = {**DATABASES['default'], **replica_settings, 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['movie_random.routers.ReplicaRouter']
+REPLICA_READ_PATHS = ['/movies/', '/random/']
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+REPLICA_STICKY_CACHE = os.environ.get('REPLICA_STICKY_CACHE', 'default')
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The responses cache holds serialized movies, genres and personas and is evicted by model signals.
+# Local memory is per process, use file or redis (requires django-redis) when running several workers.
+
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', '/var/tmp/movie_random_cache'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
     },
 }
 
+# The tokens cache holds token to account lookups, logout and password change evict them. A process local cache
+# keeps accepting a token revoked in another worker until TOKEN_CACHE_TIMEOUT, it follows the responses backend
+# unless TOKEN_CACHE_BACKEND is set, `manage.py check --deploy` warns when it is local.
+TOKEN_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('TOKEN_CACHE_LOCATION', '/var/tmp/movie_random_tokens'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('TOKEN_CACHE_LOCATION', 'redis://127.0.0.1:6379/2'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        **RESPONSE_CACHE_BACKENDS[os.environ.get('RESPONSE_CACHE_BACKEND', 'locmem')],
+        'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    'tokens': {
+        **TOKEN_CACHE_BACKENDS[os.environ.get('TOKEN_CACHE_BACKEND',
+                                              os.environ.get('RESPONSE_CACHE_BACKEND', 'locmem'))],
+        'TIMEOUT': int(os.environ.get('TOKEN_CACHE_TIMEOUT', 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+# Serve hot read endpoints off the shared sync thread under ASGI, set by asgi.py, and the number of
+# threads (and database connections) per worker process they run on
+ASYNC_READS = os.environ.get('ASYNC_READS', '0').lower() in ('1', 'true', 'yes')
+ASYNC_READ_THREADS = int(os.environ.get('ASYNC_READ_THREADS', 16))
+
+# Seconds between re-syncs of the in-process search indexes with the database, and seconds search changes
+# are kept for them by prune_search_changes, an index not synced for that long is reloaded
+SEARCH_INDEX_REFRESH = int(os.environ.get('SEARCH_INDEX_REFRESH', 60))
+SEARCH_CHANGE_RETENTION = int(os.environ.get('SEARCH_CHANGE_RETENTION', 86400))
+
+# Per request query count and db, serialize and render time, reported in a Server-Timing header and
+# in the Prometheus text format at /metrics for METRICS_ALLOWED_IPS and staff. Requests slower than
+# SLOW_REQUEST_MS are logged to movie_random.slow_requests with up to SLOW_REQUEST_MAX_QUERIES queries,
+# a SLOW_REQUEST_SAMPLE_RATE fraction of them
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', '1').lower() in ('1', 'true', 'yes')
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1').lower() in ('1', 'true', 'yes')
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 1))
+SLOW_REQUEST_MAX_QUERIES = int(os.environ.get('SLOW_REQUEST_MAX_QUERIES', 500))
+
+# Query budgets declared by views (query_budgets), checked when REQUEST_METRICS is on: 'off', 'log' a
+# warning to movie_random.query_budgets or 'raise' QueryBudgetExceeded. A request also exceeds its budget
+# with more than QUERY_BUDGET_REPEATS queries of one shape, the signature of an N+1 query
+QUERY_BUDGETS = os.environ.get('QUERY_BUDGETS', 'log')
+QUERY_BUDGET_REPEATS = int(os.environ.get('QUERY_BUDGET_REPEATS', 3))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
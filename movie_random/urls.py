@@ -16,6 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
+from .views import metrics
 
 urlpatterns = [
     path('', TemplateView.as_view(
@@ -24,4 +25,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('movies/', include('movies.urls'), name='movies'),
     path('accounts/', include('accounts.urls'), name='accounts'),
+    path('random/', include('randomizer.urls'), name='random'),
+    path('stats/', include('stats.urls'), name='stats'),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -1 +1,13 @@
-from django.views.generic import TemplateView
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from .metrics import registry
+
+
+def metrics(request):
+    """
+    Request metrics of this process in the Prometheus text format, for settings.METRICS_ALLOWED_IPS and staff.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
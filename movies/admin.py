@@ -32,6 +32,9 @@ class MovieAdmin(admin.ModelAdmin):
     ]
     list_display = ('title', 'year', 'rating', 'genre')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('genres')
+
     def genre(self, obj):
         return [g.name for g in obj.genres.all()]
 
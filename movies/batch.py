@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import transaction
+
+# state collected in the outermost deferred() block by flush function, None outside of one
+_batch = ContextVar('pending_batch', default=None)
+
+
+def pending(flush, factory):
+    """
+    Return the state flush(state) is called with once when the enclosing deferred() block ends,
+    created by factory on first use, or None outside of a deferred() block.
+    Signal receivers add what a row change implies to it instead of writing it at once.
+    """
+    batch = _batch.get()
+    if batch is None:
+        return None
+    if flush not in batch:
+        batch[flush] = factory()
+    return batch[flush]
+
+
+@contextmanager
+def deferred():
+    """
+    Run the block in a transaction and flush the state receivers collected in it once, before the transaction
+    commits, so a write touching many rows does its derived writes once instead of once per row.
+    Nested blocks join the outermost one, flushes run in the order their state was created.
+    """
+    if _batch.get() is not None:
+        yield
+        return
+    batch = {}
+    token = _batch.set(batch)
+    try:
+        with transaction.atomic():
+            yield
+            _batch.reset(token)
+            token = None
+            for flush, state in batch.items():
+                flush(state)
+    finally:
+        if token is not None:
+            _batch.reset(token)
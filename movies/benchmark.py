@@ -0,0 +1,205 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from accounts.models import Account
+from . import importer
+from .models import Movie, Genre, Persona, Review
+
+SEED = 0
+WORDS = ('dark', 'night', 'return', 'last', 'city', 'love', 'war', 'star', 'river', 'ghost', 'king', 'road',
+         'silent', 'golden', 'lost', 'winter', 'secret', 'broken', 'wild', 'empire')
+
+
+def movie_data(number: int, rng, genres: list, personas: list) -> dict:
+    def people(count):
+        return [{'first_name': p[0], 'last_name': p[1], 'birthdate': p[2]} for p in rng.sample(personas, count)]
+    return {
+        'title': ' '.join(rng.choice(WORDS) for _ in range(3)).capitalize() + f' {number}',
+        'year': rng.randint(1920, 2023),
+        'length': rng.randint(70, 200),
+        'rating': f'{rng.randint(10, 99) / 10:.1f}',
+        'trailer': f'https://example.com/trailers/{number}',
+        'description': ' '.join(rng.choice(WORDS) for _ in range(40)),
+        'genres': rng.sample(genres, rng.randint(1, min(3, len(genres)))),
+        'photos': [f'https://example.com/photos/{number}/{i}.jpg' for i in range(rng.randint(0, 4))],
+        'directors': people(1),
+        'writers': people(rng.randint(1, 2)),
+        'stars': people(rng.randint(2, 6)),
+    }
+
+
+def seed(movies: int, personas: int, genres: int, accounts: int, reviews: int, random_seed: int = SEED):
+    """
+    Fill the database with a synthetic catalogue, the same arguments always produce the same catalogue.
+    Movies go through the bulk importer, so derived tables and indexes are filled the way production fills them.
+    """
+    rng = random.Random(random_seed)
+    genre_names = [f'Genre {i}' for i in range(genres)]
+    people = [(f'First{i}', f'Last{i % max(personas // 3, 1)}', f'19{40 + i % 60:02d}-01-{1 + i % 28:02d}')
+              for i in range(personas)]
+    lines = (json.dumps(movie_data(i, rng, genre_names, people)) for i in range(movies))
+    for _ in importer.import_lines(lines):
+        pass
+
+    password = make_password('benchmark')
+    Account.objects.bulk_create([Account(username=f'user{i}', email=f'user{i}@example.com', password=password)
+                                 for i in range(accounts)], batch_size=1000)
+    movie_ids = list(Movie.objects.values_list('id', flat=True))
+    account_ids = list(Account.objects.values_list('id', flat=True))
+    pairs = set()
+    while len(pairs) < min(reviews, len(movie_ids) * len(account_ids)):
+        pairs.add((rng.choice(account_ids), rng.choice(movie_ids)))
+    Review.objects.bulk_create([Review(account_id=a, movie_id=m, title=f'Review {i}', review=' '.join(
+        rng.choice(WORDS) for _ in range(30))) for i, (a, m) in enumerate(sorted(pairs))], batch_size=1000)
+
+
+class Context:
+    """
+    Clients and object ids shared by scenarios, picked deterministically from the seeded catalogue.
+    """
+
+    def __init__(self, page_size: int, random_seed: int = SEED):
+        self.rng = random.Random(random_seed)
+        self.page_size = page_size
+        self.movie_ids = list(Movie.objects.values_list('id', flat=True))
+        self.genre_ids = list(Genre.objects.values_list('id', flat=True))
+        self.persona_ids = list(Persona.objects.values_list('id', flat=True))
+        admin = Account.objects.filter(username='benchmark-admin').first() or \
+            Account.objects.create_superuser('benchmark-admin', 'benchmark-admin@example.com', 'benchmark')
+        user = Account.objects.create_user(f'benchmark-{time.monotonic_ns()}', f'{time.monotonic_ns()}@example.com',
+                                           'benchmark')
+        self.anonymous = APIClient()
+        self.admin = APIClient()
+        self.admin.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=admin)[0].key)
+        self.user = APIClient()
+        self.user.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        reviewed = set(Review.objects.filter(account=user).values_list('movie_id', flat=True))
+        self.unreviewed = iter([i for i in self.movie_ids if i not in reviewed])
+        self.genres = list(Genre.objects.values_list('name', flat=True)[:3])
+        self.counter = 0
+        self.review_id = None
+
+    def next_number(self) -> int:
+        self.counter += 1
+        return self.counter
+
+
+def clear_response_cache():
+    caches['responses'].clear()
+
+
+def movie_list(ctx):
+    clear_response_cache()
+    return ctx.anonymous.get('/movies/', {'page_size': ctx.page_size})
+
+
+def movie_list_cached(ctx):
+    return ctx.anonymous.get('/movies/', {'page_size': ctx.page_size})
+
+
+def movie_detail(ctx):
+    clear_response_cache()
+    return ctx.anonymous.get(f'/movies/{ctx.rng.choice(ctx.movie_ids)}/')
+
+
+def genre_detail(ctx):
+    clear_response_cache()
+    return ctx.anonymous.get(f'/movies/genres/{ctx.rng.choice(ctx.genre_ids)}/')
+
+
+def persona_detail(ctx):
+    clear_response_cache()
+    return ctx.anonymous.get(f'/movies/personas/{ctx.rng.choice(ctx.persona_ids)}/')
+
+
+def movie_create(ctx):
+    data = movie_data(10 ** 9 + ctx.next_number(), ctx.rng, ctx.genres,
+                      [('Bench', f'Person{i}', '1970-01-01') for i in range(10)])
+    data['title'] = f'Benchmark {time.monotonic_ns()}'
+    return ctx.admin.post('/movies/', data, format='json')
+
+
+def review_create(ctx):
+    response = ctx.user.post('/movies/reviews/', {'movie_id': next(ctx.unreviewed), 'title': 'Benchmark',
+                                                  'review': 'benchmark review'}, format='json')
+    ctx.review_id = response.data.get('id', ctx.review_id)
+    return response
+
+
+def review_update(ctx):
+    if ctx.review_id is None:
+        review_create(ctx)
+    return ctx.user.put(f'/movies/reviews/{ctx.review_id}/', {'title': f'Benchmark {ctx.next_number()}',
+                                                               'review': 'updated review'}, format='json')
+
+
+SCENARIOS = {
+    'movie_list': movie_list,
+    'movie_list_cached': movie_list_cached,
+    'movie_detail': movie_detail,
+    'genre_detail': genre_detail,
+    'persona_detail': persona_detail,
+    'movie_create': movie_create,
+    'review_create': review_create,
+    'review_update': review_update,
+}
+
+
+def measure(scenario, ctx, repeat: int) -> dict:
+    """
+    Run a scenario repeat times for latency and query count, then once more under tracemalloc for allocations.
+
+    :return: {'median_ms', 'p95_ms', 'queries', 'alloc_kb'}
+    """
+    scenario(ctx)  # warm up imports, lazy indexes and connections
+    timings, queries = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = scenario(ctx)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{scenario.__name__} failed with {response.status_code}: {response.content[:200]}')
+        queries.append(len(captured.captured_queries))
+    tracemalloc.start()
+    scenario(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'queries': max(queries),
+        'alloc_kb': round(peak / 1024, 1),
+    }
+
+
+def run(names, repeat: int, page_size: int) -> dict:
+    ctx = Context(page_size)
+    return {name: measure(SCENARIOS[name], ctx, repeat) for name in names}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Return (scenario, metric, baseline, current, regressed) rows for metrics present in both.
+    Latency and allocations regress when they grow by more than tolerance, query counts on any growth.
+    """
+    rows = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            if before is None:
+                continue
+            limit = before if metric == 'queries' else before * (1 + tolerance)
+            rows.append((name, metric, before, value, value > limit))
+    return rows
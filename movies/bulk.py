@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import Signal
+
+SELECT_BATCH_SIZE = 500
+
+# Sent with the instances bulk_get_or_create_map inserted, bulk inserts skip post_save.
+rows_created = Signal()
+
+
+def _select(model, columns: list, keys: list, lock: bool = False) -> dict:
+    """
+    Retrieve instances matching keys, return them mapped by the tuple of their column values.
+    """
+    found = {}
+    queryset = model.objects.select_for_update() if lock else model.objects.all()
+    for start in range(0, len(keys), SELECT_BATCH_SIZE):
+        batch = keys[start:start + SELECT_BATCH_SIZE]
+        if len(columns) == 1:
+            instances = queryset.filter(**{columns[0] + '__in': [key[0] for key in batch]})
+        else:
+            keys_q = Q()
+            for key in batch:
+                keys_q |= Q(**dict(zip(columns, key)))
+            instances = queryset.filter(keys_q)
+        for instance in instances:
+            found[tuple(getattr(instance, c) for c in columns)] = instance
+    return found
+
+
+def bulk_get_or_create_map(model, columns: list, validated_obj: list) -> dict:
+    """
+    Retrieve instances of model matching the unique columns of validated objects, create the missing ones.
+    Return instances mapped by the tuple of column values of validated objects.
+
+    Missing rows are inserted with ignore_conflicts and re-selected with a locking read, so a row inserted
+    by a concurrent writer in between is picked up instead of failing on the unique constraint.
+
+    :param model: class
+    :param columns: list of unique together column names
+    :param validated_obj: list of validated data of related model
+    :return: {key: instance}
+    """
+    wanted = {}
+    for data in validated_obj:
+        wanted.setdefault(tuple(data[c] for c in columns), data)
+    if not wanted:
+        return {}
+
+    with transaction.atomic():
+        instances = _select(model, columns, list(wanted))
+        missing = [key for key in wanted if key not in instances]
+        if missing:
+            model.objects.bulk_create([model(**wanted[key]) for key in missing], ignore_conflicts=True)
+            instances.update(_select(model, columns, missing, lock=True))
+            for key in missing:
+                if key not in instances:
+                    # the database collation considered it equal to a row with different spelling
+                    instances[key] = model.objects.get(**dict(zip(columns, key)))
+            rows_created.send(sender=model, instances=[instances[key] for key in missing])
+    return {key: instances[key] for key in wanted}
+
+
+def bulk_get_or_create(model, columns: list, validated_obj: list) -> list:
+    """
+    Same as bulk_get_or_create_map, return one instance per distinct key in the order of validated objects.
+    """
+    return list(bulk_get_or_create_map(model, columns, validated_obj).values())
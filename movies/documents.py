@@ -0,0 +1,55 @@
+from functools import partial
+from django.db import transaction
+from movie_random.renderers import dumps
+from . import batch, fastpath
+from .models import MovieDocument
+
+
+# movies serialized and written per statement, renaming a genre or persona rebuilds the documents of all its movies
+CHUNK_SIZE = 500
+
+
+def rebuild(movie_ids):
+    """
+    Write documents of movie_ids from the movie tables, CHUNK_SIZE movies at a time, documents of movies that no
+    longer exist are removed.
+    """
+    movie_ids = sorted(movie_ids)
+    for start in range(0, len(movie_ids), CHUNK_SIZE):
+        chunk = movie_ids[start:start + CHUNK_SIZE]
+        encoded = {movie_id: dumps(data) for movie_id, data in fastpath.serialize_movies(chunk).items()}
+        with transaction.atomic():
+            MovieDocument.objects.filter(movie_id__in=chunk).delete()
+            MovieDocument.objects.bulk_create([MovieDocument(movie_id=i, data=data) for i, data in encoded.items()],
+                                              ignore_conflicts=True)
+
+
+def mark(movie_ids):
+    """
+    Rebuild documents of movies whose representation changed, once at the end of the enclosing
+    batch.deferred() block or once the current transaction commits outside of one, so through rows deleted
+    ahead of their movie cannot bring the document of a deleted movie back.
+    """
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return
+    pending = batch.pending(rebuild, set)
+    if pending is not None:
+        pending.update(movie_ids)
+    else:
+        transaction.on_commit(partial(rebuild, movie_ids))
+
+
+def get_many(movie_ids) -> dict:
+    """
+    Return {movie id: encoded JSON} of existing movies in one query. Movies without a document, written
+    outside of a batch and not committed yet or from before the backfill, are serialized from the movie
+    tables without writing, reads stay read only and may run on a replica.
+    """
+    movie_ids = list(movie_ids)
+    found = {movie_id: bytes(data) for movie_id, data in
+             MovieDocument.objects.filter(movie_id__in=movie_ids).values_list('movie_id', 'data')}
+    missing = [i for i in movie_ids if i not in found]
+    if missing:
+        found.update({movie_id: dumps(data) for movie_id, data in fastpath.serialize_movies(missing).items()})
+    return found
@@ -0,0 +1,55 @@
+import csv
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Movie
+from .fastpath import serialize_movies
+from .serializers import MovieSerializer
+
+CHUNK_SIZE = 500
+NESTED_FIELDS = ('genres', 'photos', 'directors', 'writers', 'stars')
+
+
+def iter_chunks(queryset, chunk_size: int = CHUNK_SIZE):
+    """
+    Iterate queryset in primary key order by keyset chunks of at most chunk_size instances, one query per chunk.
+    Memory stays bounded by the chunk size and no OFFSET is scanned.
+    """
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def movie_chunks(chunk_size: int = CHUNK_SIZE):
+    """
+    Yield movie representations chunk by chunk, ids are read by keyset chunks and every chunk is
+    serialized with the fixed set of queries of fastpath.serialize_movies.
+    """
+    for chunk in iter_chunks(Movie.objects.only('id'), chunk_size):
+        movies = serialize_movies([movie.id for movie in chunk])
+        yield [movies[movie.id] for movie in chunk if movie.id in movies]
+
+
+def ndjson_lines(chunk_size: int = CHUNK_SIZE):
+    encoder = JSONEncoder(ensure_ascii=False)
+    for movies in movie_chunks(chunk_size):
+        yield ''.join(encoder.encode(movie) + '\n' for movie in movies)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(chunk_size: int = CHUNK_SIZE):
+    """
+    Nested relations are written as JSON encoded cells.
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    writer = csv.writer(_Echo())
+    yield writer.writerow(MovieSerializer.Meta.fields)
+    for movies in movie_chunks(chunk_size):
+        yield ''.join(writer.writerow([encoder.encode(movie[f]) if f in NESTED_FIELDS else movie[f]
+                                       for f in MovieSerializer.Meta.fields]) for movie in movies)
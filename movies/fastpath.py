@@ -0,0 +1,99 @@
+from decimal import Decimal
+from django.db.models import IntegerField, Value
+from rest_framework.settings import api_settings
+from movie_random.metrics import timed
+from .models import Movie, GenreMovieMap, Photo, Director, Writer, Star
+from . import serializers
+
+MOVIE_COLUMNS = ('id', 'title', 'year', 'length', 'rating', 'trailer', 'description')
+PERSONA_COLUMNS = ('id', 'first_name', 'last_name', 'birthdate')
+ROLES = (('directors', Director), ('writers', Writer), ('stars', Star))
+RATING_QUANTUM = Decimal('0.1')
+
+
+def _rating(value):
+    if value is None:
+        return None
+    value = value.quantize(RATING_QUANTUM)
+    return '{:f}'.format(value) if api_settings.COERCE_DECIMAL_TO_STRING else value
+
+
+def _date(value):
+    return value.isoformat() if value is not None else None
+
+
+def _genres(movie_ids) -> dict:
+    genres = {}
+    for movie_id, genre_id, name in GenreMovieMap.objects.filter(movie_id__in=movie_ids) \
+            .order_by('genre__name').values_list('movie_id', 'genre_id', 'genre__name'):
+        genres.setdefault(movie_id, []).append({'id': genre_id, 'name': name})
+    return genres
+
+
+def _photos(movie_ids) -> dict:
+    photos = {}
+    for movie_id, photo_id, photo in Photo.objects.filter(movie_id__in=movie_ids) \
+            .order_by('id').values_list('movie_id', 'id', 'photo'):
+        photos.setdefault(movie_id, []).append({'id': photo_id, 'photo': photo})
+    return photos
+
+
+def _personas(movie_ids, roles) -> dict:
+    """
+    Return {(role, movie id): [persona data]} read with one UNION query over the role tables.
+    """
+    querysets = [model.objects.filter(movie_id__in=movie_ids)
+                 .annotate(role=Value(i, output_field=IntegerField()))
+                 .values_list('role', 'movie_id', *(f'persona__{c}' for c in PERSONA_COLUMNS))
+                 .order_by()
+                 for i, (role, model) in enumerate(roles)]
+    rows = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+    personas = {}
+    for role, movie_id, persona_id, first_name, last_name, birthdate in rows:
+        personas.setdefault((roles[role][0], movie_id), []).append(
+            (last_name, persona_id, {'id': persona_id, 'first_name': first_name, 'last_name': last_name,
+                                     'birthdate': _date(birthdate)}))
+    # same order as the persona prefetch, Persona.Meta.ordering followed by id
+    return {key: [data for _, _, data in sorted(rows, key=lambda r: r[:2])] for key, rows in personas.items()}
+
+
+@timed('serialize')
+def serialize_movies(movie_ids, fields=None) -> dict:
+    """
+    Read only equivalent of MovieSerializer built from value rows, JSON encoding of the result is identical.
+    Each requested relation costs one query, persona relations share one.
+
+    :param movie_ids: iterable of movie ids, missing ids are left out
+    :param fields: list of requested fields or None for every field of MovieSerializer
+    :return: {movie id: serialized data}
+    """
+    order = serializers.MovieSerializer.Meta.fields
+    fields = list(order) if fields is None else [f for f in order if f in fields]
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return {}
+    columns = [c for c in MOVIE_COLUMNS if c in fields or c == 'id']
+    rows = Movie.objects.filter(id__in=movie_ids).order_by().values_list(*columns)
+    genres = _genres(movie_ids) if 'genres' in fields else {}
+    photos = _photos(movie_ids) if 'photos' in fields else {}
+    roles = tuple((role, model) for role, model in ROLES if role in fields)
+    personas = _personas(movie_ids, roles) if roles else {}
+
+    movies = {}
+    for row in rows:
+        values = dict(zip(columns, row))
+        movie_id = values['id']
+        if 'rating' in values:
+            values['rating'] = _rating(values['rating'])
+        data = {}
+        for field in fields:
+            if field == 'genres':
+                data[field] = genres.get(movie_id, [])
+            elif field == 'photos':
+                data[field] = photos.get(movie_id, [])
+            elif field in ('directors', 'writers', 'stars'):
+                data[field] = personas.get((field, movie_id), [])
+            else:
+                data[field] = values[field]
+        movies[movie_id] = data
+    return movies
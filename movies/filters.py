@@ -0,0 +1,35 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from .serializers import MovieListFilterSerializer
+
+# query param: queryset lookup
+MOVIE_LOOKUPS = {
+    'genre': 'genres',
+    'year_min': 'year__gte',
+    'year_max': 'year__lte',
+    'rating_min': 'rating__gte',
+    'rating_max': 'rating__lte',
+    'length_min': 'length__gte',
+    'length_max': 'length__lte',
+    'director': 'directors',
+    'writer': 'writers',
+    'star': 'stars',
+}
+
+
+class MovieFilterBackend(BaseFilterBackend):
+    """
+    Filter movies by genre, year, rating, length and persona ids, order by one of the sort fields.
+    Every filter and sort key is backed by an index, ordering is completed by id in the same direction for keyset
+    pagination, so a descending sort walks the (key, id) index backwards.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = MovieListFilterSerializer(data=request.query_params)
+        if not params.is_valid():
+            raise ValidationError(params.errors)
+        params = params.validated_data
+        queryset = queryset.filter(**{lookup: params[param] for param, lookup in MOVIE_LOOKUPS.items()
+                                      if param in params})
+        ordering = params['ordering']
+        return queryset.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
@@ -0,0 +1,101 @@
+import json
+from django.db import transaction
+from .bulk import bulk_get_or_create_map
+from .models import Movie, Photo, Genre, Persona, GenreMovieMap, Director, Writer, Star
+from .serializers import MovieImportSerializer
+from .signals import movies_imported
+
+CHUNK_SIZE = 1000
+PERSONA_COLUMNS = ['first_name', 'last_name', 'birthdate']
+ROLES = (('directors', Director), ('writers', Writer), ('stars', Star))
+
+
+def read_chunks(lines, chunk_size: int = CHUNK_SIZE):
+    """
+    Split an iterable of NDJSON lines into chunks of (line number, decoded object or error) pairs.
+    """
+    chunk = []
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode()
+        if not line.strip():
+            continue
+        try:
+            chunk.append((number, json.loads(line)))
+        except ValueError as e:
+            chunk.append((number, e))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _persona_key(data) -> tuple:
+    return tuple(data[c] for c in PERSONA_COLUMNS)
+
+
+def import_chunk(chunk: list) -> dict:
+    """
+    Validate and write a chunk of movies with a fixed number of queries regardless of its size.
+    Genres and personas are deduplicated across the whole chunk, movies already present by title and year are skipped.
+
+    :param chunk: list of (line number, decoded object) pairs
+    :return: {'created': int, 'skipped': int, 'errors': [{'line': int, 'errors': ...}]}
+    """
+    errors = []
+    movies = {}
+    for number, data in chunk:
+        serializer = MovieImportSerializer(data=data) if isinstance(data, dict) else None
+        if serializer is None or not serializer.is_valid():
+            errors.append({'line': number, 'errors': serializer.errors if serializer else str(data)})
+            continue
+        movies.setdefault((serializer.validated_data['title'], serializer.validated_data['year']),
+                          serializer.validated_data)
+    result = {'created': 0, 'skipped': len(chunk) - len(errors), 'errors': errors}
+    if not movies:
+        return result
+
+    with transaction.atomic():
+        existing = set(Movie.objects.filter(title__in={title for title, _ in movies})
+                       .values_list('title', 'year'))
+        movies = {key: data for key, data in movies.items() if key not in existing}
+        if not movies:
+            return result
+
+        genres = bulk_get_or_create_map(
+            Genre, ['name'], [g for data in movies.values() for g in data.get('genres', [])])
+        personas = bulk_get_or_create_map(
+            Persona, PERSONA_COLUMNS,
+            [p for data in movies.values() for role, _ in ROLES for p in data.get(role, [])])
+        instances = bulk_get_or_create_map(Movie, ['title', 'year'], [
+            {k: v for k, v in data.items() if k not in ('genres', 'photos', 'directors', 'writers', 'stars')}
+            for data in movies.values()])
+
+        photos, genre_links, role_links = [], [], {model: [] for _, model in ROLES}
+        for key, data in movies.items():
+            movie = instances[key]
+            photos += [Photo(movie=movie, **p) for p in data.get('photos', [])]
+            genre_links += [GenreMovieMap(movie=movie, genre=genres[(g['name'],)])
+                            for g in {g['name']: g for g in data.get('genres', [])}.values()]
+            for role, model in ROLES:
+                role_links[model] += [model(movie=movie, persona=persona)
+                                      for persona in {personas[_persona_key(p)] for p in data.get(role, [])}]
+        Photo.objects.bulk_create(photos)
+        GenreMovieMap.objects.bulk_create(genre_links, ignore_conflicts=True)
+        for model, links in role_links.items():
+            model.objects.bulk_create(links)
+
+        movies_imported.send(sender=Movie, movie_ids=[instances[key].id for key in movies])
+
+    result['created'] = len(movies)
+    result['skipped'] -= len(movies)
+    return result
+
+
+def import_lines(lines, chunk_size: int = CHUNK_SIZE):
+    """
+    Import NDJSON lines chunk by chunk, yield the result of every chunk.
+    """
+    for chunk in read_chunks(lines, chunk_size):
+        yield import_chunk(chunk)
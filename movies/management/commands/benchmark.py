@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from movies import benchmark
+from movies.models import Movie
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+SIZES = (('movies', 2000), ('personas', 1500), ('genres', 20), ('accounts', 200), ('reviews', 5000))
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic catalogue into a test database, benchmark API endpoints and compare with a baseline'
+
+    def add_arguments(self, parser):
+        for name, default in SIZES:
+            parser.add_argument(f'--{name}', type=int, default=default, help=f'number of seeded {name}')
+        parser.add_argument('--repeat', type=int, default=20, help='measured runs per scenario')
+        parser.add_argument('--page-size', type=int, default=50, help='page size of list scenarios')
+        parser.add_argument('--scenario', action='append', choices=list(benchmark.SCENARIOS),
+                            help='scenario to run, repeatable, all by default')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='baseline JSON file')
+        parser.add_argument('--save-baseline', action='store_true', help='write results to the baseline file')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='relative latency and allocation growth reported as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--keepdb', action='store_true', help='keep and reuse the seeded test database')
+
+    def handle(self, *args, **options):
+        config = {name: options[name] for name, _ in SIZES}
+        config.update(repeat=options['repeat'], page_size=options['page_size'], vendor=connection.vendor)
+        names = options['scenario'] or list(benchmark.SCENARIOS)
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with override_settings(REPLICA_DATABASES=[]):
+                for cache in ('default', 'responses', 'tokens'):
+                    caches[cache].clear()
+                if not (options['keepdb'] and Movie.objects.exists()):
+                    self.stdout.write(f'seeding {config}')
+                    benchmark.seed(*(options[name] for name, _ in SIZES))
+                results = benchmark.run(names, options['repeat'], options['page_size'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write(f'{"scenario":<20}{"median ms":>12}{"p95 ms":>12}{"queries":>10}{"alloc KiB":>12}')
+        for name, metrics in results.items():
+            self.stdout.write(f'{name:<20}{metrics["median_ms"]:>12.2f}{metrics["p95_ms"]:>12.2f}'
+                              f'{metrics["queries"]:>10}{metrics["alloc_kb"]:>12.1f}')
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({'config': config, 'results': results}, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'baseline written to {baseline_path}'))
+            return
+        if not baseline_path.exists():
+            return
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get('config') != config:
+            self.stdout.write(self.style.WARNING(f'baseline was recorded with {baseline.get("config")}'))
+        regressions = 0
+        for name, metric, before, after, regressed in benchmark.compare(results, baseline['results'],
+                                                                          options['tolerance']):
+            change = (after - before) / before * 100 if before else 0
+            line = f'{name:<20}{metric:<10}{before:>12}{after:>12}{change:>+9.1f}%'
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line + '  regression'))
+            else:
+                self.stdout.write(line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{regressions} regressions against {baseline_path}')
@@ -0,0 +1,24 @@
+import sys
+from django.core.management.base import BaseCommand
+from movies import importer
+
+
+class Command(BaseCommand):
+    help = 'Import movies from an NDJSON file, one MovieSerializer shaped object per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file, "-" reads standard input')
+        parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        created = skipped = failed = 0
+        with source:
+            for number, result in enumerate(importer.import_lines(source, options['chunk_size']), start=1):
+                created += result['created']
+                skipped += result['skipped']
+                failed += len(result['errors'])
+                for error in result['errors']:
+                    self.stderr.write(f"line {error['line']}: {error['errors']}")
+                self.stdout.write(f'chunk {number}: {created} created, {skipped} skipped, {failed} failed')
+        self.stdout.write(self.style.SUCCESS(f'{created} created, {skipped} skipped, {failed} failed'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from movies import search
+
+
+class Command(BaseCommand):
+    help = 'Delete search changes older than SEARCH_CHANGE_RETENTION, run it periodically'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'{search.prune_changes()} search changes deleted'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from movies import documents
+from movies.models import Movie, MovieDocument
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized JSON documents of all movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=documents.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        movie_ids = list(Movie.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(movie_ids), options['chunk_size']):
+            documents.rebuild(movie_ids[start:start + options['chunk_size']])
+            self.stdout.write(f'{min(start + options["chunk_size"], len(movie_ids))} of {len(movie_ids)} movies')
+        self.stdout.write(self.style.SUCCESS(f'{MovieDocument.objects.count()} documents'))
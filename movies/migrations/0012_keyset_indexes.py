@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0011_alter_persona_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['title', 'id'], name='movies_movi_title_5260dc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='persona',
+            index=models.Index(fields=['last_name', 'id'], name='movies_pers_last_na_6b3b5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'title', 'id'], name='movies_revi_movie_i_a8c884_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['account', 'title', 'id'], name='movies_revi_account_fd40ae_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0014_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='director',
+            index=models.Index(fields=['persona', 'movie'], name='movies_dire_persona_5d672a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='genremoviemap',
+            index=models.Index(fields=['genre', 'movie'], name='movies_genr_genre_i_9486cf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['year', 'id'], name='movies_movi_year_59138e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['rating', 'id'], name='movies_movi_rating_345343_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['length', 'id'], name='movies_movi_length_dd9e9f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(fields=['persona', 'movie'], name='movies_star_persona_c7d6c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='writer',
+            index=models.Index(fields=['persona', 'movie'], name='movies_writ_persona_26e9a5_idx'),
+        ),
+    ]
@@ -2,8 +2,25 @@ from django.db import models
 from accounts.models import Account
 
 
-class Genre(models.Model):
+class VersionedModel(models.Model):
+    """
+    Model with a version bumped by movies.versions.touch. Saves of existing rows leave version out,
+    so a stale value held in memory never overwrites a concurrent bump.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if update_fields is None and not force_insert and not self._state.adding:
+            update_fields = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'version']
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class Genre(VersionedModel):
     name = models.CharField(max_length=40, unique=True)
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
@@ -12,21 +29,24 @@ class Genre(models.Model):
         return self.name
 
 
-class Persona(models.Model):
+class Persona(VersionedModel):
     first_name = models.CharField(max_length=40)
     last_name = models.CharField(max_length=40)
     birthdate = models.DateField()
     biography = models.CharField(max_length=4000, blank=True)
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ['first_name', 'last_name', 'birthdate']
         ordering = ['last_name']
+        indexes = [models.Index(fields=['last_name', 'id'])]
 
     def __str__(self):
         return f'{self.first_name} {self.last_name} {self.birthdate.strftime("%Y-%m-%d")}'
 
 
-class Movie(models.Model):
+class Movie(VersionedModel):
     title = models.CharField(max_length=200)
     year = models.PositiveSmallIntegerField()
     length = models.PositiveSmallIntegerField()
@@ -37,10 +57,18 @@ class Movie(models.Model):
     directors = models.ManyToManyField(Persona, through='Director', related_name='directors')
     writers = models.ManyToManyField(Persona, through='Writer', related_name='writers')
     stars = models.ManyToManyField(Persona, through='Star', related_name='stars')
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ['title', 'year']
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['year', 'id']),
+            models.Index(fields=['rating', 'id']),
+            models.Index(fields=['length', 'id']),
+        ]
 
     def __str__(self):
         return f'{self.title}, {self.year}'
@@ -52,6 +80,7 @@ class GenreMovieMap(models.Model):
 
     class Meta:
         unique_together = ['movie', 'genre']
+        indexes = [models.Index(fields=['genre', 'movie'])]
 
     def __str__(self):
         return f'{self.genre} {self.movie}'
@@ -71,10 +100,15 @@ class Review(models.Model):
     title = models.CharField(max_length=200)
     review = models.CharField(max_length=4000)
     posted_at = models.DateField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['account', 'movie']
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['movie', 'title', 'id']),
+            models.Index(fields=['account', 'title', 'id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -84,6 +118,9 @@ class Director(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     persona = models.ForeignKey(Persona, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [models.Index(fields=['persona', 'movie'])]
+
     def __str__(self):
         return f'{self.persona} in {self.movie}'
 
@@ -92,6 +129,9 @@ class Writer(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     persona = models.ForeignKey(Persona, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [models.Index(fields=['persona', 'movie'])]
+
     def __str__(self):
         return f'{self.persona} in {self.movie}'
 
@@ -100,5 +140,35 @@ class Star(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     persona = models.ForeignKey(Persona, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [models.Index(fields=['persona', 'movie'])]
+
     def __str__(self):
         return f'{self.persona} in {self.movie}'
+
+
+class MovieDocument(models.Model):
+    """
+    JSON of the full MovieSerializer representation of a movie, kept in step with the movie tables by movies.documents.
+    """
+    movie = models.OneToOneField(Movie, primary_key=True, related_name='document', on_delete=models.CASCADE)
+    data = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'document of movie {self.movie_id}'
+
+
+class SearchChange(models.Model):
+    """
+    A movie or persona whose searchable text changed or that was deleted, logged in the transaction of the change.
+    The search indexes of every process re-read the documents of the changes past the last id they applied.
+    """
+    MOVIE, PERSONA = 'm', 'p'
+
+    kind = models.CharField(max_length=1, choices=[(MOVIE, 'movie'), (PERSONA, 'persona')])
+    object_id = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.object_id} changed'
@@ -0,0 +1,123 @@
+from collections import Counter
+from django.core.cache import caches
+from movie_random.renderers import Fragment, dumps, loads
+from movie_random.routers import reading_replicas
+from .models import GenreMovieMap, Director, Writer, Star
+
+CACHE_ALIAS = 'responses'
+ROLE_MODELS = (Director, Writer, Star)
+DELETE_BATCH_SIZE = 500
+
+stats = Counter(hits=0, misses=0, invalidations=0)
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def movie_key(movie_id) -> str:
+    return f'movie:{movie_id}'
+
+
+def genre_key(genre_id) -> str:
+    return f'genre:{genre_id}'
+
+
+def persona_key(persona_id) -> str:
+    return f'persona:{persona_id}'
+
+
+def project(encoded: bytes, fields):
+    """
+    Return cached JSON as a fragment spliced into the response as is, or decoded and restricted to fields.
+    """
+    if fields is None:
+        return Fragment(encoded)
+    data = loads(encoded)
+    return {f: data[f] for f in fields if f in data}
+
+
+def get_or_build(key: str, build, fields=None):
+    """
+    Return cached data for key, build it on a miss.
+    Full representations are stored encoded and returned as fragments,
+    sparse ones are projected from cached data and not stored.
+    Data built from a replica is not stored either, it may predate a write whose eviction already ran
+    and would be served to the writer until the next write.
+
+    :param key: cache key
+    :param build: callable returning serialized data, or a Fragment of encoded JSON
+    :param fields: list of requested fields or None for the full representation
+    """
+    cache = get_cache()
+    encoded = cache.get(key)
+    if encoded is not None:
+        stats['hits'] += 1
+        return project(encoded, fields)
+    stats['misses'] += 1
+    data = build()
+    if fields is None:
+        encoded = bytes(data) if isinstance(data, Fragment) else dumps(data)
+        if not reading_replicas():
+            cache.set(key, encoded)
+        return Fragment(encoded)
+    return data
+
+
+def get_or_build_movies(movie_ids: list, build, fields=None) -> list:
+    """
+    Return data of movies in the order of movie_ids, misses are built in one go and stored like in get_or_build.
+
+    :param movie_ids: list of movie ids
+    :param build: callable taking the list of missing ids and returning {movie id: serialized data}
+    :param fields: list of requested fields or None for the full representation
+    """
+    cache = get_cache()
+    cached = cache.get_many([movie_key(i) for i in movie_ids])
+    found = {i: project(cached[movie_key(i)], fields) for i in movie_ids if movie_key(i) in cached}
+    missing = [i for i in movie_ids if i not in found]
+    stats['hits'] += len(found)
+    stats['misses'] += len(missing)
+    if missing:
+        built = build(missing)
+        if fields is None:
+            built = {i: data if isinstance(data, Fragment) else Fragment(dumps(data)) for i, data in built.items()}
+            if not reading_replicas():
+                cache.set_many({movie_key(i): bytes(data) for i, data in built.items()})
+        found.update(built)
+    return [found[i] for i in movie_ids if i in found]
+
+
+def invalidate(movie_ids=(), genre_ids=(), persona_ids=()):
+    """
+    Evict cached responses of the objects, DELETE_BATCH_SIZE keys per call to the cache.
+    """
+    keys = [movie_key(i) for i in movie_ids] + [genre_key(i) for i in genre_ids] + [persona_key(i) for i in persona_ids]
+    stats['invalidations'] += len(keys)
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        get_cache().delete_many(keys[start:start + DELETE_BATCH_SIZE])
+
+
+def movies_of_genre(genre_id) -> list:
+    return list(GenreMovieMap.objects.filter(genre_id=genre_id).values_list('movie_id', flat=True))
+
+
+def movies_of_persona(persona_id) -> set:
+    movie_ids = set()
+    for model in ROLE_MODELS:
+        movie_ids.update(model.objects.filter(persona_id=persona_id).values_list('movie_id', flat=True))
+    return movie_ids
+
+
+def relations_of_movies(movie_ids):
+    """
+    Return genre ids and persona ids whose detail responses list any of the movies.
+    """
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return set(), set()
+    genre_ids = set(GenreMovieMap.objects.filter(movie_id__in=movie_ids).values_list('genre_id', flat=True))
+    persona_ids = set()
+    for model in ROLE_MODELS:
+        persona_ids.update(model.objects.filter(movie_id__in=movie_ids).values_list('persona_id', flat=True))
+    return genre_ids, persona_ids
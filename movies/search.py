@@ -0,0 +1,286 @@
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import batch
+from .models import Movie, Persona, SearchChange
+
+TOKEN_RE = re.compile(r'\w+')
+EXACT, PREFIX, FUZZY = 3.0, 2.0, 1.0
+MIN_PREFIX_LENGTH = 2
+MIN_SIMILARITY = 0.4
+LOAD_CHUNK_SIZE = 2000
+# change ids below the last applied one that were not visible yet, transactions that allocated them and commit
+# later are picked up for this long, up to MAX_GAPS of them
+GAP_SECONDS = 300
+MAX_GAPS = 1000
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(term: str) -> set:
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    In-process inverted index over text fields of a model.
+
+    Posting lists are sorted arrays of ids, terms are kept in a sorted list for prefix lookups
+    and in a trigram to terms map for typo tolerant matches. The index is loaded on first search, updated when
+    writes of this process commit and every SEARCH_INDEX_REFRESH seconds re-reads the documents of SearchChange
+    rows past the last applied id, which covers writes, deletes and bulk inserts of other processes. Change ids
+    are allocated before their transaction commits, ids skipped by a sync are looked up again for GAP_SECONDS.
+    """
+
+    def __init__(self, model, kind: str, fields: tuple, rank_field: str = None):
+        self.model = model
+        self.kind = kind
+        self.fields = fields
+        self.rank_field = rank_field
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.synced_at = 0.0
+        self.change_id = 0
+        self.gaps = {}
+        self._reset()
+
+    def _reset(self):
+        self.postings = {}
+        self.sorted_terms = []
+        self.trigram_terms = {}
+        self.doc_terms = {}
+        self.ranks = {}
+
+    def _columns(self):
+        return ('id', *self.fields, *((self.rank_field,) if self.rank_field else ()))
+
+    def _index_row(self, row):
+        doc_id, *values = row
+        texts = values[:len(self.fields)]
+        self.add(doc_id, ' '.join(t for t in texts if t), float(values[-1]) if self.rank_field else 0.0)
+
+    def _track_gaps(self, low: int, high: int, seen: set, now: float):
+        for change_id in range(max(low, high - MAX_GAPS) + 1, high):
+            if change_id not in seen:
+                self.gaps[change_id] = now
+
+    def _load(self):
+        self._reset()
+        # changes are read before the documents, a document changed meanwhile is applied again by the next sync
+        recent = list(SearchChange.objects.order_by('-id').values_list('id', flat=True)[:MAX_GAPS])
+        self.change_id, self.gaps = (recent[0] if recent else 0), {}
+        if recent:
+            self._track_gaps(recent[-1], self.change_id, set(recent), time.monotonic())
+        last_id = 0
+        while True:
+            rows = list(self.model.objects.filter(id__gt=last_id).order_by('id')
+                        .values_list(*self._columns())[:LOAD_CHUNK_SIZE])
+            for row in rows:
+                self._index_row(row)
+            if len(rows) < LOAD_CHUNK_SIZE:
+                break
+            last_id = rows[-1][0]
+        self.loaded = True
+
+    def _sync(self):
+        now = time.monotonic()
+        changes = list(SearchChange.objects.filter(Q(id__gt=self.change_id) | Q(id__in=list(self.gaps)))
+                       .values_list('id', 'kind', 'object_id'))
+        seen = {change_id for change_id, _, _ in changes}
+        high = max(seen, default=self.change_id)
+        self._track_gaps(self.change_id, high, seen, now)
+        self.change_id = max(self.change_id, high)
+        self.gaps = {change_id: at for change_id, at in self.gaps.items()
+                     if change_id not in seen and now - at < GAP_SECONDS}
+        self.refresh({object_id for _, kind, object_id in changes if kind == self.kind})
+
+    def refresh(self, doc_ids: set):
+        """
+        Re-read documents of doc_ids from the database, removing the deleted ones.
+        """
+        doc_ids = list(doc_ids)
+        for start in range(0, len(doc_ids), LOAD_CHUNK_SIZE):
+            chunk = doc_ids[start:start + LOAD_CHUNK_SIZE]
+            found = set()
+            for row in self.model.objects.filter(id__in=chunk).values_list(*self._columns()):
+                self._index_row(row)
+                found.add(row[0])
+            for doc_id in set(chunk) - found:
+                self.remove(doc_id)
+
+    def ensure_fresh(self):
+        with self.lock:
+            now = time.monotonic()
+            if not self.loaded or now - self.synced_at >= settings.SEARCH_CHANGE_RETENTION:
+                # changes older than the retention may be gone already
+                self._load()
+            elif now - self.synced_at >= settings.SEARCH_INDEX_REFRESH:
+                self._sync()
+            else:
+                return
+            self.synced_at = now
+
+    def add(self, doc_id: int, text: str, rank: float = 0.0):
+        with self.lock:
+            self.remove(doc_id)
+            terms = tuple(set(tokenize(text)))
+            for term in terms:
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = array('q')
+                    insort(self.sorted_terms, term)
+                    for trigram in trigrams(term):
+                        self.trigram_terms.setdefault(trigram, set()).add(term)
+                position = bisect_left(postings, doc_id)
+                postings.insert(position, doc_id)
+            self.doc_terms[doc_id] = terms
+            self.ranks[doc_id] = rank
+
+    def remove(self, doc_id: int):
+        with self.lock:
+            for term in self.doc_terms.pop(doc_id, ()):
+                postings = self.postings[term]
+                position = bisect_left(postings, doc_id)
+                if position < len(postings) and postings[position] == doc_id:
+                    del postings[position]
+                if not postings:
+                    del self.postings[term]
+                    del self.sorted_terms[bisect_left(self.sorted_terms, term)]
+                    for trigram in trigrams(term):
+                        terms = self.trigram_terms[trigram]
+                        terms.discard(term)
+                        if not terms:
+                            del self.trigram_terms[trigram]
+            self.ranks.pop(doc_id, None)
+
+    def document(self, instance) -> tuple:
+        text = ' '.join(getattr(instance, f) or '' for f in self.fields)
+        return text, float(getattr(instance, self.rank_field)) if self.rank_field else 0.0
+
+    def apply(self, documents: dict):
+        """
+        :param documents: {doc id: (text, rank), or None when deleted}, ignored until the index is loaded
+        """
+        with self.lock:
+            if not self.loaded:
+                return
+            for doc_id, document in documents.items():
+                if document is None:
+                    self.remove(doc_id)
+                else:
+                    self.add(doc_id, *document)
+
+    def _matching_terms(self, token: str) -> dict:
+        """
+        Return {term: weight} of index terms matching query token exactly, by prefix or by trigram similarity.
+        """
+        matches = {}
+        if len(token) >= MIN_PREFIX_LENGTH:
+            position = bisect_left(self.sorted_terms, token)
+            while position < len(self.sorted_terms) and self.sorted_terms[position].startswith(token):
+                matches[self.sorted_terms[position]] = PREFIX
+                position += 1
+        if token in self.postings:
+            matches[token] = EXACT
+        if len(token) > MIN_PREFIX_LENGTH:
+            token_trigrams = trigrams(token)
+            shared = Counter()
+            for trigram in token_trigrams:
+                shared.update(self.trigram_terms.get(trigram, ()))
+            for term, common in shared.items():
+                similarity = common / (len(token_trigrams) + len(term) + 1 - common)
+                if similarity >= MIN_SIMILARITY and term not in matches:
+                    matches[term] = FUZZY * similarity
+        return matches
+
+    def search(self, query: str, limit: int) -> list:
+        """
+        Return ids of documents matching every query token, best matches first, ties broken by rank.
+        """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        self.ensure_fresh()
+        with self.lock:
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term, weight in self._matching_terms(token).items():
+                    for doc_id in self.postings[term]:
+                        if token_scores.get(doc_id, 0) < weight:
+                            token_scores[doc_id] = weight
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: score + token_scores[doc_id] for doc_id, score in scores.items()
+                              if doc_id in token_scores}
+                if not scores:
+                    return []
+            ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], -self.ranks[doc_id], doc_id))
+        return ranked[:limit]
+
+
+movie_index = SearchIndex(Movie, SearchChange.MOVIE, ('title', 'description'), rank_field='rating')
+persona_index = SearchIndex(Persona, SearchChange.PERSONA, ('first_name', 'last_name'))
+
+
+def prune_changes() -> int:
+    """
+    Drop changes older than SEARCH_CHANGE_RETENTION, indexes not synced for that long reload instead of
+    reading them. Run periodically by the prune_search_changes command, writes only log their changes.
+    """
+    deleted, _ = SearchChange.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=settings.SEARCH_CHANGE_RETENTION)).delete()
+    return deleted
+
+
+class SearchChanges:
+    """
+    Documents changed in a batch.deferred() block, {index: {doc id: (text, rank), or None when deleted}}.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+
+def flush_search_changes(changes: SearchChanges):
+    """
+    Log the changes for the indexes of all processes in the transaction and apply them to the indexes of this
+    process once it commits, old changes are dropped by prune_changes.
+    """
+    SearchChange.objects.bulk_create([SearchChange(kind=index.kind, object_id=doc_id)
+                                      for index, documents in changes.documents.items() for doc_id in documents],
+                                     batch_size=LOAD_CHUNK_SIZE)
+    for index, documents in changes.documents.items():
+        transaction.on_commit(partial(index.apply, documents))
+
+
+def changed(index: SearchIndex, saved=(), deleted=()):
+    """
+    Record saved instances and deleted ids of the model of index, once per batch.deferred() block.
+    """
+    pending = batch.pending(flush_search_changes, SearchChanges)
+    changes = SearchChanges() if pending is None else pending
+    documents = changes.documents.setdefault(index, {})
+    documents.update({instance.id: index.document(instance) for instance in saved})
+    documents.update(dict.fromkeys(deleted))
+    if pending is None:
+        flush_search_changes(changes)
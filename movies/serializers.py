@@ -1,7 +1,8 @@
-from django.db import transaction
-from django.db.models import Q
 from rest_framework import serializers
-from .models import Movie, Photo, Review, Genre, Persona
+from movie_random.metrics import timed
+from . import batch, signals
+from .bulk import bulk_get_or_create, bulk_get_or_create_map
+from .models import Movie, Photo, Review, Genre, Persona, GenreMovieMap, Director, Writer, Star
 from accounts.models import Account
 
 
@@ -19,6 +20,10 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
             for field_name in existing - allowed:
                 self.fields.pop(field_name)
 
+    @timed('serialize')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
 
 class GenreListSerializer(serializers.ListSerializer):
     def to_internal_value(self, data):
@@ -54,9 +59,11 @@ class NestedPersonaSerializer(DynamicFieldsModelSerializer):
         fields = ['id', 'first_name', 'last_name', 'birthdate', 'biography']
 
 
-class MovieSerializer(serializers.ModelSerializer):
+class MovieSerializer(DynamicFieldsModelSerializer):
     persona_fields = 'id', 'first_name', 'last_name', 'birthdate'
     persona_columns = ['first_name', 'last_name', 'birthdate']
+    relation_fields = ('genres', 'photos', 'directors', 'writers', 'stars')
+    role_models = {'directors': Director, 'writers': Writer, 'stars': Star}
 
     genres = NestedGenreSerializer(many=True, required=False)
     photos = PhotoSerializer(many=True, required=False)
@@ -69,99 +76,125 @@ class MovieSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'year', 'length', 'rating', 'trailer',
                   'description', 'genres', 'photos', 'directors', 'writers', 'stars']
 
-    @staticmethod
-    def bulk_get_or_create__in(model, column: str, validated_obj: list):
-        """
-        Filter model column against the list of validated objects to either retrieve existing instances or create new.
-        Return the list of both new and old instances.
-
-        :param model: class
-        :param column: string
-        :param validated_obj: list of validated data of related model
-        :return: [*new_instances, *old_instances]
+    def get_or_create_personas(self, *groups):
         """
-        old_instances = model.objects.filter(**{column + "__in": [obj[column] for obj in validated_obj]})
-        new_instances = [model(**obj) for obj in validated_obj if
-                         not obj[column] in [getattr(obj, column) for obj in old_instances]]
+        Get or create personas of all groups in a single pass, so a persona that is both director and writer
+        is looked up once.
 
-        last_id = model.objects.order_by('id').last().id if model.objects.last() else 0
-        for i in range(len(new_instances)):
-            new_instances[i].id = last_id + 1
-            last_id += 1
-        new_instances = model.objects.bulk_create(new_instances)
-        return [*new_instances, *old_instances]
-
-    @staticmethod
-    def bulk_get_or_create_unique_together(model, columns: list, validated_obj: list):
-        """
-        Filter list of unique together columns in model against the list of validated objects
-        to either retrieve existing instances or create new.
-        Return the list of both new and old instances
-
-        :param model: class
-        :param columns: list of strings
-        :param validated_obj: list of validated data of related model
-        :return: [*new_instances, *old_instances]
+        :param groups: lists of validated persona data
+        :return: list of persona instances per group
         """
-        if validated_obj:
-            obj_q = Q()
-            for obj in validated_obj:
-                obj_q |= Q(**{col: obj[col] for col in columns})
-            old_instances = model.objects.filter(obj_q)
-        else:
-            old_instances = []
-        new_instances = [model(**data) for data in validated_obj if
-                         not {c: data[c] for c in columns} in [{c: getattr(data, c) for c in columns} for data in
-                                                               old_instances]]
-
-        last_id = model.objects.order_by('id').last().id if model.objects.last() else 0
-        for i in range(len(new_instances)):
-            new_instances[i].id = last_id + 1
-            last_id += 1
-        new_instances = model.objects.bulk_create(new_instances)
-        return [*new_instances, *old_instances]
+        personas = bulk_get_or_create_map(Persona, self.persona_columns, [p for group in groups for p in group])
+        return [[personas[tuple(p[c] for c in self.persona_columns)] for p in group] for group in groups]
 
     def create(self, validated_data):
-        with transaction.atomic():
-            genres = validated_data.pop('genres')
-            photos = validated_data.pop('photos')
-            directors = validated_data.pop('directors')
-            writers = validated_data.pop('writers')
-            stars = validated_data.pop('stars')
+        with batch.deferred():
+            genres = validated_data.pop('genres', [])
+            photos = validated_data.pop('photos', [])
+            directors = validated_data.pop('directors', [])
+            writers = validated_data.pop('writers', [])
+            stars = validated_data.pop('stars', [])
 
             instance = Movie.objects.create(**validated_data)
 
             Photo.objects.bulk_create([Photo(**p, movie=instance) for p in photos])
 
-            instance.genres.set(self.bulk_get_or_create__in(Genre, 'name', genres))
+            # a new movie has no links to clear, add() skips the read of the current ones set() does
+            instance.genres.add(*bulk_get_or_create(Genre, ['name'], genres))
 
-            instance.directors.set(self.bulk_get_or_create_unique_together(Persona, self.persona_columns, directors))
-            instance.writers.set(self.bulk_get_or_create_unique_together(Persona, self.persona_columns, writers))
-            instance.stars.set(self.bulk_get_or_create_unique_together(Persona, self.persona_columns, stars))
+            directors, writers, stars = self.get_or_create_personas(directors, writers, stars)
+            instance.directors.add(*directors)
+            instance.writers.add(*writers)
+            instance.stars.add(*stars)
 
         return instance
 
     def update(self, instance, validated_data):
-        with transaction.atomic():
-            genres = validated_data.pop('genres')
-            photos = validated_data.pop('photos')
-            directors = validated_data.pop('directors')
-            writers = validated_data.pop('writers')
-            stars = validated_data.pop('stars')
+        """
+        Update the plain fields and relations present in validated_data, omitted relations are left alone,
+        so PATCH may send any subset of them. The movie is saved only when a plain field changed, relations are
+        compared with the current rows by id and only removed and added links are written, related rows are
+        get or created only when not linked yet. Bulk inserted photos send no signals, the movie is marked
+        changed once when any relation changed.
+        """
+        relations = {f: validated_data.pop(f) for f in self.relation_fields if f in validated_data}
+        changed = {f: value for f, value in validated_data.items() if getattr(instance, f) != value}
+        relinked = False
+        with batch.deferred():
+            if changed:
+                instance = serializers.ModelSerializer.update(self, instance, changed)
+            if 'photos' in relations:
+                relinked |= self.update_photos(instance, relations['photos'])
+            if 'genres' in relations:
+                linked = dict(GenreMovieMap.objects.filter(movie_id=instance.id)
+                              .values_list('genre__name', 'genre_id'))
+                wanted, = self.link_ids({(name,): i for name, i in linked.items()}, Genre, ['name'],
+                                        [relations['genres']])
+                relinked |= self.update_links(instance.genres, set(linked.values()), wanted)
+            roles = [role for role in self.role_models if role in relations]
+            if roles:
+                relinked |= self.update_personas(instance, {role: relations[role] for role in roles})
+            if relinked:
+                signals.changed(movie_ids=[instance.id])
+        return instance
+
+    @staticmethod
+    def update_links(manager, current: set, wanted: set) -> bool:
+        removed, added = current - wanted, wanted - current
+        if removed:
+            manager.remove(*removed)
+        if added:
+            manager.add(*added)
+        return bool(removed or added)
+
+    @staticmethod
+    def link_ids(known: dict, model, columns: list, groups: list) -> list:
+        """
+        Resolve groups of validated related data to ids, rows missing from known are get or created in one pass.
 
-            instance = serializers.ModelSerializer.update(self, instance, validated_data)
+        :param known: {tuple of column values: id} of rows already linked to the movie
+        :param groups: lists of validated data of model
+        :return: set of ids per group
+        """
+        unknown = [data for group in groups for data in group if tuple(data[c] for c in columns) not in known]
+        ids = {**known, **{key: obj.id for key, obj in bulk_get_or_create_map(model, columns, unknown).items()}}
+        return [{ids[tuple(data[c] for c in columns)] for data in group} for group in groups]
+
+    def update_photos(self, instance, photos: list) -> bool:
+        current = {}
+        for photo_id, url in Photo.objects.filter(movie_id=instance.id).values_list('id', 'photo'):
+            current.setdefault(url, []).append(photo_id)
+        wanted = dict.fromkeys(p['photo'] for p in photos)
+        stale = [photo_id for url, ids in current.items() if url not in wanted for photo_id in ids]
+        if stale:
+            Photo.objects.filter(id__in=stale).delete()
+        added = Photo.objects.bulk_create([Photo(movie=instance, photo=url) for url in wanted if url not in current])
+        return bool(stale or added)
+
+    def update_personas(self, instance, roles: dict) -> bool:
+        """
+        :param roles: {role field: list of validated persona data} of the roles to update
+        :return: whether any link was removed or added
+        """
+        lookups = ['persona_id'] + ['persona__' + c for c in self.persona_columns]
+        known, current = {}, {}
+        for role in roles:
+            rows = self.role_models[role].objects.filter(movie_id=instance.id).values_list(*lookups)
+            current[role] = {row[0] for row in rows}
+            known.update({row[1:]: row[0] for row in rows})
+        relinked = False
+        for role, wanted in zip(roles, self.link_ids(known, Persona, self.persona_columns, list(roles.values()))):
+            relinked |= self.update_links(getattr(instance, role), current[role], wanted)
+        return relinked
 
-            related_photos = Photo.objects.filter(movie_id=instance.id)
-            related_photos.exclude(photo__in=[p['photo'] for p in photos]).delete()
-            new_photos = [Photo(**p, movie=instance) for p in photos if not p['photo'] in [photo.photo for photo in related_photos]]
-            Photo.objects.bulk_create(new_photos)
 
-            instance.genres.set(self.bulk_get_or_create__in(Genre, 'name', genres))
+class MovieImportSerializer(MovieSerializer):
+    """
+    Validates rows of bulk imports, uniqueness is resolved by the importer for the whole chunk at once.
+    """
 
-            instance.directors.set(self.bulk_get_or_create_unique_together(Persona, self.persona_columns, directors))
-            instance.writers.set(self.bulk_get_or_create_unique_together(Persona, self.persona_columns, writers))
-            instance.stars.set(self.bulk_get_or_create_unique_together(Persona, self.persona_columns, stars))
-        return instance
+    class Meta(MovieSerializer.Meta):
+        validators = []
 
 
 class ReviewSerializer(DynamicFieldsModelSerializer):
@@ -197,3 +230,28 @@ class PersonaSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Persona
         fields = ['id', 'first_name', 'last_name', 'birthdate', 'biography', 'directors', 'writers', 'stars']
+
+
+class MovieFilterSerializer(serializers.Serializer):
+    genre = serializers.IntegerField(required=False)
+    year_min = serializers.IntegerField(required=False)
+    year_max = serializers.IntegerField(required=False)
+    rating_min = serializers.DecimalField(max_digits=3, decimal_places=1, required=False)
+    length_min = serializers.IntegerField(required=False)
+    length_max = serializers.IntegerField(required=False)
+    director = serializers.IntegerField(required=False)
+    writer = serializers.IntegerField(required=False)
+    star = serializers.IntegerField(required=False)
+
+
+class MovieListFilterSerializer(MovieFilterSerializer):
+    sort_fields = ['title', 'year', 'rating', 'length']
+
+    rating_max = serializers.DecimalField(max_digits=3, decimal_places=1, required=False)
+    ordering = serializers.ChoiceField(required=False, default='title',
+                                       choices=sort_fields + ['-' + f for f in sort_fields])
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField()
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
@@ -0,0 +1,173 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+from . import batch, documents, response_cache, search, versions
+from .bulk import rows_created
+from .models import Movie, Photo, Genre, Persona, GenreMovieMap, Director, Writer, Star
+
+# Sent with movie_ids once bulk imported movies and their relations are written, bulk inserts skip post_save.
+movies_imported = Signal()
+
+
+class Changes:
+    """
+    Ids of objects whose representation changed in a batch.deferred() block, of saved movies whose
+    genres and personas are looked up once when the block ends and of deleted movies.
+    """
+
+    def __init__(self):
+        self.movie_ids, self.genre_ids, self.persona_ids = set(), set(), set()
+        self.saved_movie_ids, self.deleted_movie_ids = set(), set()
+
+    def add(self, movie_ids=(), genre_ids=(), persona_ids=()):
+        self.movie_ids.update(movie_ids)
+        self.genre_ids.update(genre_ids)
+        self.persona_ids.update(persona_ids)
+
+
+def changed(movie_ids=(), genre_ids=(), persona_ids=()):
+    """
+    Bump versions, rebuild movie documents and evict cached responses of objects whose representation changed,
+    once per batch.deferred() block. Cached responses are evicted once the transaction commits, so a concurrent
+    read cannot cache the state before the write again.
+    """
+    pending = batch.pending(flush_changes, Changes)
+    if pending is not None:
+        pending.add(movie_ids, genre_ids, persona_ids)
+        return
+    versions.touch(movie_ids, genre_ids, persona_ids)
+    documents.mark(movie_ids)
+    evict_on_commit(movie_ids, genre_ids, persona_ids)
+
+
+def flush_changes(changes: Changes):
+    genre_ids, persona_ids = response_cache.relations_of_movies(changes.saved_movie_ids)
+    changes.add(changes.saved_movie_ids, genre_ids, persona_ids)
+    movie_ids = changes.movie_ids - changes.deleted_movie_ids
+    versions.touch(movie_ids, changes.genre_ids, changes.persona_ids)
+    documents.rebuild(movie_ids)
+    evict_on_commit(changes.movie_ids, changes.genre_ids, changes.persona_ids)
+
+
+def evict_on_commit(movie_ids=(), genre_ids=(), persona_ids=()):
+    if movie_ids or genre_ids or persona_ids:
+        transaction.on_commit(partial(response_cache.invalidate, set(movie_ids), set(genre_ids), set(persona_ids)))
+
+
+@receiver(post_save, sender=Movie)
+def evict_saved_movie(sender, instance, created, **kwargs):
+    # a new movie has no links yet, links added later evict their genres and personas on their own
+    pending = batch.pending(flush_changes, Changes)
+    if pending is not None:
+        (pending.movie_ids if created else pending.saved_movie_ids).add(instance.id)
+        return
+    if created:
+        changed(movie_ids=[instance.id])
+        return
+    genre_ids, persona_ids = response_cache.relations_of_movies([instance.id])
+    changed(movie_ids=[instance.id], genre_ids=genre_ids, persona_ids=persona_ids)
+
+
+@receiver(post_delete, sender=Movie)
+def evict_deleted_movie(sender, instance, **kwargs):
+    # deleted through rows evict genres and personas on their own, the document is deleted in cascade
+    pending = batch.pending(flush_changes, Changes)
+    if pending is not None:
+        pending.add(movie_ids=[instance.id])
+        pending.deleted_movie_ids.add(instance.id)
+    else:
+        evict_on_commit(movie_ids=[instance.id])
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def evict_photo_movie(sender, instance, **kwargs):
+    changed(movie_ids=[instance.movie_id])
+
+
+@receiver(post_save, sender=Genre)
+def evict_saved_genre(sender, instance, **kwargs):
+    changed(movie_ids=response_cache.movies_of_genre(instance.id), genre_ids=[instance.id])
+
+
+@receiver(post_save, sender=Persona)
+def evict_saved_persona(sender, instance, **kwargs):
+    changed(movie_ids=response_cache.movies_of_persona(instance.id), persona_ids=[instance.id])
+
+
+@receiver(post_delete, sender=Genre)
+def evict_deleted_genre(sender, instance, **kwargs):
+    changed(genre_ids=[instance.id])
+
+
+@receiver(post_delete, sender=Persona)
+def evict_deleted_persona(sender, instance, **kwargs):
+    changed(persona_ids=[instance.id])
+
+
+@receiver(post_save, sender=GenreMovieMap)
+@receiver(post_delete, sender=GenreMovieMap)
+def evict_genre_link(sender, instance, **kwargs):
+    changed(movie_ids=[instance.movie_id], genre_ids=[instance.genre_id])
+
+
+@receiver(post_save, sender=Director)
+@receiver(post_save, sender=Writer)
+@receiver(post_save, sender=Star)
+@receiver(post_delete, sender=Director)
+@receiver(post_delete, sender=Writer)
+@receiver(post_delete, sender=Star)
+def evict_persona_link(sender, instance, **kwargs):
+    changed(movie_ids=[instance.movie_id], persona_ids=[instance.persona_id])
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+@receiver(m2m_changed, sender=Movie.directors.through)
+@receiver(m2m_changed, sender=Movie.writers.through)
+@receiver(m2m_changed, sender=Movie.stars.through)
+def evict_added_links(sender, instance, action, reverse, pk_set, **kwargs):
+    # bulk adds through the related manager skip post_save, removals go through post_delete
+    if action != 'post_add':
+        return
+    movie_ids, related_ids = (pk_set, [instance.id]) if reverse else ([instance.id], pk_set)
+    if sender is GenreMovieMap:
+        changed(movie_ids=movie_ids, genre_ids=related_ids)
+    else:
+        changed(movie_ids=movie_ids, persona_ids=related_ids)
+
+
+@receiver(movies_imported, sender=Movie)
+def evict_imported_relations(sender, movie_ids, **kwargs):
+    genre_ids = GenreMovieMap.objects.filter(movie_id__in=movie_ids).values_list('genre_id', flat=True)
+    persona_ids = set()
+    for model in response_cache.ROLE_MODELS:
+        persona_ids.update(model.objects.filter(movie_id__in=movie_ids).values_list('persona_id', flat=True))
+    changed(genre_ids=set(genre_ids), persona_ids=persona_ids)
+    documents.mark(movie_ids)
+
+
+@receiver(post_save, sender=Movie)
+def index_saved_movie(sender, instance, **kwargs):
+    search.changed(search.movie_index, saved=[instance])
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_deleted_movie(sender, instance, **kwargs):
+    search.changed(search.movie_index, deleted=[instance.id])
+
+
+@receiver(post_save, sender=Persona)
+def index_saved_persona(sender, instance, **kwargs):
+    search.changed(search.persona_index, saved=[instance])
+
+
+@receiver(post_delete, sender=Persona)
+def unindex_deleted_persona(sender, instance, **kwargs):
+    search.changed(search.persona_index, deleted=[instance.id])
+
+
+@receiver(rows_created, sender=Movie)
+@receiver(rows_created, sender=Persona)
+def index_created_rows(sender, instances, **kwargs):
+    search.changed(search.movie_index if sender is Movie else search.persona_index, saved=instances)
@@ -1,3 +1,1277 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import json
+import os
+import random
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.apps import apps
+from django.db import connection, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from accounts.models import Account
+from movie_random import budgets, metrics
+from movie_random.middleware import ReplicaRoutingMiddleware
+from movie_random.pagination import KeysetPagination, RelationPagination
+from movie_random.renderers import Fragment, FastJSONRenderer, dumps
+from movie_random.routers import ReplicaRouter, use_replicas
+from . import batch, benchmark, bulk, documents, importer, response_cache, search, versions
+from .bulk import bulk_get_or_create_map
+from .fastpath import serialize_movies
+from .models import Movie, Genre, Persona, Photo, GenreMovieMap, Director, Writer, Star, Review, \
+    MovieDocument, SearchChange
+from .serializers import MovieSerializer
+from .response_cache import CACHE_ALIAS
 
-# Create your tests here.
+NESTED_FIELDS = ('genres', 'photos', 'directors', 'writers', 'stars')
+
+# requests inside overlap_view and the most seen at once
+overlap = {'inside': 0, 'peak': 0}
+
+
+async def overlap_view(request):
+    overlap['inside'] += 1
+    overlap['peak'] = max(overlap['peak'], overlap['inside'])
+    await asyncio.sleep(0.05)
+    overlap['inside'] -= 1
+    return HttpResponse()
+
+
+# URLconf of AsyncMiddlewareTest
+urlpatterns = [path('movies/overlap/', overlap_view)]
+
+
+class FastPathParityTest(TestCase):
+    """
+    serialize_movies must render to the same bytes as MovieSerializer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=name) for name in ('Drama', 'Comedy', 'Ação', 'Sci-Fi')]
+        personas = [Persona.objects.create(first_name=f'First{i}', last_name=last, birthdate=datetime.date(1950 + i, 1, 2))
+                    for i, last in enumerate(('Smith', 'Smith', 'Ødegaard', 'Lee', 'Abe', '"Quoted"'))]
+        ratings = (Decimal('0.5'), Decimal('10'), Decimal('7.3'), Decimal('9.9'), Decimal('1.0'))
+        cls.movies = []
+        for i, rating in enumerate(ratings):
+            movie = Movie.objects.create(title=f'Movie {i} — «{i}»', year=1990 + i, length=80 + i, rating=rating,
+                                         trailer=f'http://example.com/{i}', description='multi\nline\t"text"')
+            cls.movies.append(movie)
+            for genre in genres[i % 3:i % 3 + 2]:
+                GenreMovieMap.objects.create(movie=movie, genre=genre)
+            for k in range(i % 3):
+                Photo.objects.create(movie=movie, photo=f'http://example.com/{i}/{k}.jpg')
+            Director.objects.create(movie=movie, persona=personas[i % 6])
+            for persona in personas[i:i + 2]:
+                Writer.objects.create(movie=movie, persona=persona)
+            for persona in personas[:4]:
+                Star.objects.create(movie=movie, persona=persona)
+        # a movie without any relation
+        cls.movies.append(Movie.objects.create(title='Bare', year=2000, length=1, rating=Decimal('5.5'),
+                                               trailer='http://example.com/bare', description=''))
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+
+    def expected(self, movies, fields=None):
+        queryset = Movie.objects.filter(id__in=[m.id for m in movies]).order_by('id')
+        queryset = queryset.prefetch_related(*(f for f in NESTED_FIELDS if fields is None or f in fields))
+        return JSONRenderer().render(MovieSerializer(queryset, many=True, fields=fields).data)
+
+    def actual(self, movies, fields=None):
+        data = serialize_movies([m.id for m in movies], fields)
+        return JSONRenderer().render([data[m.id] for m in sorted(movies, key=lambda m: m.id)])
+
+    def test_full_representation(self):
+        self.assertEqual(self.expected(self.movies), self.actual(self.movies))
+
+    def test_single_movie(self):
+        for movie in self.movies:
+            self.assertEqual(self.expected([movie]), self.actual([movie]))
+
+    def test_sparse_fields(self):
+        for fields in (['id'], ['title', 'rating'], ['stars'], ['genres', 'photos'], ['directors', 'writers', 'year']):
+            self.assertEqual(self.expected(self.movies, fields), self.actual(self.movies, fields))
+
+    def test_missing_ids_are_left_out(self):
+        self.assertEqual(serialize_movies([]), {})
+        self.assertEqual(list(serialize_movies([self.movies[0].id, 0])), [self.movies[0].id])
+
+    def test_endpoints(self):
+        client = APIClient()
+        for movie in self.movies * 2:
+            response = client.get(f'/movies/{movie.id}/')
+            self.assertEqual(response.content, self.expected([movie])[1:-1])
+        for _ in range(2):  # cache miss, then cached fragments
+            response = client.get('/movies/', {'ordering': 'year', 'page_size': 100, 'count': 'false'})
+            self.assertEqual(response.content, b'{"next":null,"previous":null,"results":%s}' % self.expected(self.movies))
+
+
+class MovieOrderingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        with batch.deferred():
+            cls.movies = [Movie.objects.create(title=f'Movie {i}', year=2000, length=90, rating=Decimal('5.0'),
+                                               trailer='http://example.com/t', description='Plot') for i in range(5)]
+
+    def walk(self, ordering: str) -> list:
+        client, pages = APIClient(), []
+        page = client.get('/movies/', {'ordering': ordering, 'page_size': 2, 'count': 'false'}).json()
+        while True:
+            pages.append([movie['id'] for movie in page['results']])
+            if not page['next']:
+                return pages
+            page = client.get(page['next']).json()
+            previous = client.get(page['previous']).json()
+            self.assertEqual([movie['id'] for movie in previous['results']], pages[-1])
+
+    def test_ties_follow_the_sort_direction(self):
+        ids = [movie.id for movie in self.movies]
+        for ordering, expected in (('rating', ids), ('-rating', ids[::-1]), ('-year', ids[::-1])):
+            pages = self.walk(ordering)
+            self.assertEqual([movie_id for page in pages for movie_id in page], expected)
+            self.assertEqual(len(pages), 3)
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        with batch.deferred():
+            cls.personas = [Persona.objects.create(first_name=f'P{i}', last_name=last,
+                                                   birthdate=datetime.date(1970, 1, 1))
+                            for i, last in enumerate(['Doe', 'Abe', 'Doe', 'Cox', 'Doe', 'Abe', 'Zed'])]
+        cls.ordered = [p.id for p in sorted(cls.personas, key=lambda p: (p.last_name, p.id))]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def ids(self, page: dict) -> list:
+        return [persona['id'] for persona in page['results']]
+
+    def test_pages_follow_the_ordering_both_ways(self):
+        page = self.client.get('/movies/personas/', {'page_size': 3}).json()
+        self.assertEqual((page['count'], page['previous']), (7, None))
+        pages = [self.ids(page)]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            pages.append(self.ids(page))
+        self.assertEqual([len(ids) for ids in pages], [3, 3, 1])
+        self.assertEqual([persona_id for ids in pages for persona_id in ids], self.ordered)
+        for expected in pages[-2::-1]:
+            page = self.client.get(page['previous']).json()
+            self.assertEqual(self.ids(page), expected)
+        self.assertIsNone(page['previous'])
+
+    def test_rows_inserted_before_the_cursor_do_not_shift_pages(self):
+        first = self.client.get('/movies/personas/', {'page_size': 3}).json()
+        Persona.objects.create(first_name='New', last_name='Aaa', birthdate=datetime.date(1970, 1, 1))
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.ids(second), self.ordered[3:6])
+        self.assertEqual(second['count'], 8)
+
+    def test_deep_pages_cost_the_same(self):
+        url, queries = '/movies/personas/?page_size=2&count=false', []
+        while url:
+            with CaptureQueriesContext(connection) as captured:
+                page = self.client.get(url).json()
+            queries.append([q['sql'] for q in captured])
+            url = page['next']
+        self.assertNotIn('count', page)
+        self.assertEqual({len(sqls) for sqls in queries}, {1})
+        self.assertFalse(any('OFFSET' in sql for sqls in queries for sql in sqls))
+
+    def test_invalid_cursors_and_page_sizes(self):
+        for cursor in ('nope', 'eyJyIjpmYWxzZSwidiI6WzFdfQ=='):
+            self.assertEqual(self.client.get('/movies/personas/', {'cursor': cursor}).status_code, 404)
+        page = self.client.get('/movies/personas/', {'page_size': 'many'}).json()
+        self.assertEqual(len(page['results']), 7)
+        with mock.patch.object(KeysetPagination, 'max_page_size', 2):
+            self.assertEqual(len(self.client.get('/movies/personas/', {'page_size': 5}).json()['results']), 2)
+
+
+class UnionPrefetchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        personas = [Persona.objects.create(first_name=f'P{i}', last_name=last, birthdate=datetime.date(1970, 1, 1))
+                    for i, last in enumerate(['Doe', 'Abe', 'Doe', 'Cox'])]
+        with batch.deferred():
+            for i in range(3):
+                movie = Movie.objects.create(title=f'Movie {i}', year=2000, length=90, rating=Decimal('5.0'),
+                                             trailer='http://example.com/t', description='Plot')
+                movie.directors.add(*personas[i:i + 2])
+                movie.stars.add(*personas[::i + 1])
+                if i:
+                    movie.writers.add(personas[0])
+
+    def relations(self, *roles) -> list:
+        ids = list(Movie.objects.order_by('id').values_list('id', flat=True))
+        data = serialize_movies(ids, fields=list(roles))
+        return [(movie_id, role, [(p['id'], p['last_name']) for p in data[movie_id][role]])
+                for movie_id in ids for role in roles]
+
+    def test_matches_regular_prefetch(self):
+        for roles in (('directors', 'writers', 'stars'), ('stars', 'directors'), ('writers',)):
+            expected = [(movie.id, role, [(p.id, p.last_name) for p in getattr(movie, role).all()])
+                        for movie in Movie.objects.prefetch_related(*roles).order_by('id') for role in roles]
+            self.assertEqual(self.relations(*roles), expected)
+
+    def test_persona_relations_take_one_query(self):
+        ids = list(Movie.objects.values_list('id', flat=True))
+        with self.assertNumQueries(4):
+            serialize_movies(ids)
+        with CaptureQueriesContext(connection) as queries:
+            serialize_movies(ids, fields=['directors', 'writers', 'stars'])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(sum('UNION' in q['sql'] for q in queries), 1)
+
+
+class FastJSONRendererTest(TestCase):
+
+    data = {
+        'text': 'ascii, «unicode», "quotes", \\ \n\t \u2028\u2029 \x00',
+        'numbers': [0, -1, 2 ** 40, 1.5, True, False, None],
+        'decimal': Decimal('7.3'),
+        'date': datetime.date(1960, 1, 2),
+        'datetime': datetime.datetime(2020, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+        'nested': {'tuple': (1, 2), 'empty': {}, 1: 'int key'},
+    }
+
+    def test_same_output_as_rest_framework(self):
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_fragments_are_spliced(self):
+        fragment = Fragment(dumps(self.data['nested']))
+        self.assertEqual(dumps({'a': [fragment, fragment], 'b': 1}),
+                         JSONRenderer().render({'a': [self.data['nested']] * 2, 'b': 1}))
+
+    def test_indented_output_expands_fragments(self):
+        context = {'indent': 4}
+        self.assertEqual(FastJSONRenderer().render({'a': Fragment(dumps(self.data))}, renderer_context=context),
+                         JSONRenderer().render({'a': self.data}, renderer_context=context))
+
+
+# a cache shared by processes, replica routing refuses local memory caches
+STICKY_CACHES = {**settings.CACHES, 'sticky': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'movie_random_test_sticky'),
+}}
+
+
+@override_settings(REPLICA_DATABASES=['replica_0'], REPLICA_STICKY_SECONDS=60, CACHES=STICKY_CACHES,
+                   REPLICA_STICKY_CACHE='sticky')
+class ReplicaRoutingTest(TestCase):
+
+    def setUp(self):
+        caches[settings.REPLICA_STICKY_CACHE].clear()
+        self.seen = []
+
+        def get_response(request):
+            self.seen.append(use_replicas.get())
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+        self.middleware = ReplicaRoutingMiddleware(get_response)
+        self.factory = RequestFactory()
+        self.accounts = [Account.objects.create_user(f'user{i}', f'user{i}@example.com', 'password') for i in range(2)]
+
+    def request(self, method: str, user=None, session_key=None, **extra):
+        request = getattr(self.factory, method)('/movies/', REMOTE_ADDR='10.0.0.1', **extra)
+        request.user = user or AnonymousUser()
+        request.session = SessionStore(session_key)
+        return request
+
+    def test_safe_reads_of_movie_and_random_endpoints_use_replicas(self):
+        for request in (self.factory.get('/movies/'), self.factory.get('/random/batch/'),
+                        self.factory.get('/accounts/logout/'), self.factory.post('/movies/')):
+            self.middleware(request)
+        self.assertEqual(self.seen, [True, True, False, False])
+        self.assertFalse(use_replicas.get())
+
+    def test_reads_stick_to_primary_after_write_of_the_same_user(self):
+        writer, other = self.accounts
+        self.middleware(self.request('get', writer))
+        self.middleware(self.request('post', writer))
+        self.middleware(self.request('get', writer))
+        self.middleware(self.request('get', other))
+        self.middleware(self.request('get'))
+        self.assertEqual(self.seen, [True, False, False, True, True])
+
+    def test_token_clients_are_told_apart_before_the_view(self):
+        writer, other = self.accounts
+        self.middleware(self.request('post', writer))
+        for account in (writer, other):
+            self.middleware(self.request('get', HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=account).key}'))
+        self.middleware(self.request('get', HTTP_AUTHORIZATION='Token invalid'))
+        self.assertEqual(self.seen, [False, False, True, True])
+
+    def test_anonymous_clients_are_told_apart_by_session(self):
+        session = SessionStore()
+        session.create()
+        self.middleware(self.request('post', session_key=session.session_key))
+        self.middleware(self.request('get', session_key=session.session_key))
+        self.middleware(self.request('get'))
+        self.assertEqual(self.seen, [False, False, True])
+
+    @override_settings(REPLICA_STICKY_CACHE='default')
+    def test_local_sticky_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Movie), 'default')
+        token = use_replicas.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Movie), 'replica_0')
+            self.assertEqual(router.db_for_write(Movie), 'default')
+        finally:
+            use_replicas.reset(token)
+
+
+@override_settings(REPLICA_DATABASES=['replica_0'], REPLICA_STICKY_SECONDS=60, CACHES=STICKY_CACHES,
+                   REPLICA_STICKY_CACHE='sticky')
+class ReplicaDatabaseTest(TestCase):
+    """
+    Requests against a second SQLite database standing in for a replica, it holds the state of the primary
+    at the last replicate() call.
+    """
+
+    def setUp(self):
+        caches['sticky'].clear()
+        caches[CACHE_ALIAS].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.replica_path = os.path.join(directory.name, 'replica.sqlite3')
+        connections.settings['replica_0'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.replica_path}
+        self.addCleanup(self.drop_replica)
+        writer = Account.objects.create_superuser('writer', 'writer@example.com', 'password')
+        self.writer = APIClient()
+        self.writer.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=writer).key}')
+        self.reader = APIClient()
+        with batch.deferred():
+            self.movie = Movie.objects.create(title='Original', year=2000, length=90, rating=Decimal('5.0'),
+                                              trailer='http://example.com/t', description='Plot')
+        self.replicate()
+
+    @staticmethod
+    def drop_replica():
+        connections['replica_0'].close()
+        del connections['replica_0']
+        del connections.settings['replica_0']
+
+    def replicate(self):
+        """
+        Copy every table of the primary to the replica, a fresh file each time.
+        """
+        replica = connections['replica_0']
+        replica.close()
+        if os.path.exists(self.replica_path):
+            os.remove(self.replica_path)
+        models = [model for model in apps.get_models(include_auto_created=True)
+                  if model._meta.managed and not model._meta.proxy and not model._meta.swapped]
+        with replica.schema_editor() as editor:
+            for model in models:
+                if not model._meta.auto_created:  # created with the model of their many to many field
+                    editor.create_model(model)
+        with transaction.atomic(using='replica_0'):
+            for model in models:
+                model._base_manager.using('replica_0').bulk_create(model._base_manager.using('default').all())
+
+    def read(self, client, url: str = None):
+        """
+        Return the title of the movie in the response and the aliases of the databases the request queried.
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica_0']) as replica:
+            response = client.get(url or f'/movies/{self.movie.id}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        title = (data['results'][0] if 'results' in data else data).get('title')
+        return title, [alias for alias, queries in (('default', primary), ('replica_0', replica)) if queries]
+
+    def rename(self, title: str):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.writer.patch(f'/movies/{self.movie.id}/', {'title': title}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_reads_lag_until_replicated(self):
+        self.rename('Sequel')
+        self.assertEqual(self.read(self.reader), ('Original', ['replica_0']))
+        self.replicate()
+        self.assertEqual(self.read(self.reader), ('Sequel', ['replica_0']))
+
+    def test_writer_reads_its_write_after_replica_reads_of_others(self):
+        self.rename('Sequel')
+        for url in (None, '/movies/'):
+            self.assertEqual(self.read(self.reader, url), ('Original', ['replica_0']))
+        for url in (None, '/movies/'):
+            self.assertEqual(self.read(self.writer, url), ('Sequel', ['default']))
+
+    def test_writer_returns_to_replicas_after_the_sticky_window(self):
+        self.rename('Sequel')
+        self.assertEqual(self.read(self.writer), ('Sequel', ['default']))
+        caches['sticky'].clear()
+        self.assertEqual(self.read(self.writer)[1], ['replica_0'])
+
+    def test_other_paths_and_no_replicas_read_the_primary(self):
+        self.assertEqual(self.read(self.reader, '/stats/years/')[1], ['default'])
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(self.read(self.reader), ('Original', ['default']))
+
+
+class ConnectionHealthCheckTest(SimpleTestCase):
+    """
+    Persistent connections of the SQLite profile backend, the ping is SQLite's is_usable().
+    """
+
+    def connection(self, health_checks: bool = True):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        handler = ConnectionHandler({'default': {
+            'ENGINE': 'movie_random.backends.sqlite3', 'NAME': os.path.join(directory.name, 'db.sqlite3'),
+            'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': health_checks}})
+        self.addCleanup(handler.close_all)
+        return handler['default']
+
+    def request(self, conn, queries: int = 1):
+        conn.close_if_unusable_or_obsolete()  # request_started
+        for _ in range(queries):
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        conn.close_if_unusable_or_obsolete()  # request_finished
+
+    def test_unusable_connection_is_reopened_before_first_use(self):
+        conn = self.connection()
+        self.request(conn)
+        dropped = conn.connection
+        with mock.patch.object(conn, 'is_usable', return_value=False):
+            self.request(conn)
+        self.assertIsNot(conn.connection, dropped)
+        reopened = conn.connection
+        self.request(conn)
+        self.assertIs(conn.connection, reopened)
+
+    def test_ping_runs_once_per_request(self):
+        conn = self.connection()
+        self.request(conn)
+        with mock.patch.object(conn, 'is_usable', return_value=True) as ping:
+            self.request(conn, queries=3)
+            self.assertEqual(ping.call_count, 1)
+            self.request(conn, queries=2)
+            self.assertEqual(ping.call_count, 2)
+
+    def test_ping_is_skipped_when_disabled(self):
+        conn = self.connection(health_checks=False)
+        self.request(conn)
+        with mock.patch.object(conn, 'is_usable', return_value=False) as ping:
+            self.request(conn, queries=2)
+        self.assertFalse(ping.called)
+
+
+class InstrumentationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            Movie.objects.create(title=f'Movie {i}', year=2000, length=90, rating=Decimal('5.0'),
+                                 trailer=f'http://example.com/{i}', description='')
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        metrics.registry.reset()
+        self.client = APIClient()
+
+    def test_server_timing(self):
+        response = self.client.get('/movies/')
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'db', 'serialize', 'render', 'total'})
+        self.assertRegex(timing['db'], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+
+    def test_metrics_endpoint(self):
+        self.client.get('/movies/')
+        self.client.get('/movies/')
+        exported = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').content.decode()
+        self.assertIn('movie_random_requests_total{method="GET",route="movies/",status="200"} 2', exported)
+        self.assertIn('movie_random_request_queries_count{method="GET",route="movies/"} 2', exported)
+        self.assertIn('phase="serialize"', exported)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_queries(self):
+        with self.assertLogs('movie_random.slow_requests', 'WARNING') as logs:
+            self.client.get('/movies/')
+        self.assertIn('GET /movies/ 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+@override_settings(ROOT_URLCONF='movies.tests', REPLICA_DATABASES=['replica_0'], CACHES=STICKY_CACHES,
+                   REPLICA_STICKY_CACHE='sticky')
+class AsyncMiddlewareTest(SimpleTestCase):
+
+    async def test_concurrent_asgi_reads_overlap(self):
+        overlap['peak'] = 0
+        client = AsyncClient()
+        responses = await asyncio.gather(*(client.get('/movies/overlap/') for _ in range(3)))
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        self.assertIn('Server-Timing', responses[0])
+        self.assertEqual(overlap['peak'], 3)
+
+
+class QueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_account = Account.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.user_account = Account.objects.create_user('user', 'user@example.com', 'password')
+        cls.genre = Genre.objects.create(name='Drama')
+        cls.persona = Persona.objects.create(first_name='Jane', last_name='Doe', birthdate=datetime.date(1970, 1, 1))
+        cls.movies = []
+        with batch.deferred():
+            cls.create_movies()
+
+    @classmethod
+    def create_movies(cls):
+        for i in range(8):
+            movie = Movie.objects.create(title=f'Movie {i}', year=2000 + i, length=90, rating=Decimal('5.0'),
+                                         trailer=f'http://example.com/{i}', description='')
+            GenreMovieMap.objects.create(movie=movie, genre=cls.genre)
+            Star.objects.create(movie=movie, persona=cls.persona)
+            Review.objects.create(movie=movie, account=cls.admin_account, title='Review', review='text')
+            cls.movies.append(movie)
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.anonymous = APIClient()
+        self.admin = APIClient()
+        self.admin.force_authenticate(self.admin_account)
+        self.user = APIClient()
+        self.user.force_authenticate(self.user_account)
+
+    def test_shape(self):
+        self.assertEqual(budgets.shape('SELECT "a" FROM "t" WHERE "id" IN (%s, %s, %s) AND "b" = 12 LIMIT 21'),
+                         'SELECT "a" FROM "t" WHERE "id" IN (...) AND "b" = ? LIMIT ?')
+        self.assertEqual(budgets.shape("INSERT INTO \"t\" VALUES (%s, 'x'), (%s, 'it''s')"),
+                         'INSERT INTO "t" VALUES (...)')
+
+    def test_query_count(self):
+        with budgets.query_budget(2):
+            list(Movie.objects.all())
+            list(Genre.objects.all())
+        with self.assertRaises(budgets.QueryBudgetExceeded):
+            with budgets.query_budget(1):
+                list(Movie.objects.all())
+                list(Genre.objects.all())
+
+    def test_repeated_shape(self):
+        with self.assertRaises(budgets.QueryBudgetExceeded):
+            with budgets.query_budget(repeats=3):
+                for movie in Movie.objects.all():
+                    list(movie.genres.all())
+        with budgets.query_budget(2, repeats=1):
+            for movie in Movie.objects.prefetch_related('genres'):
+                list(movie.genres.all())
+
+    @override_settings(QUERY_BUDGETS='raise')
+    def test_views_stay_within_budgets(self):
+        movie, genre, persona = self.movies[0], self.genre, self.persona
+        responses = [
+            self.anonymous.get('/movies/'),
+            self.anonymous.get(f'/movies/{movie.id}/'),
+            self.anonymous.get(f'/movies/{movie.id}/', {'fields': 'id,title', 'expand': 'stars'}),
+            self.anonymous.get(f'/movies/genres/{genre.id}/'),
+            self.anonymous.get(f'/movies/genres/{genre.id}/', {'nested': 'counts'}),
+            self.anonymous.get(f'/movies/personas/{persona.id}/'),
+            self.anonymous.get(f'/movies/reviews/movie/{movie.id}/'),
+            self.anonymous.get(f'/movies/reviews/account/{self.admin_account.id}/'),
+            self.anonymous.get('/movies/genres/'),
+            self.anonymous.get('/movies/personas/'),
+            self.anonymous.get('/movies/search/', {'q': 'movie'}),
+            self.admin.patch(f'/movies/genres/{genre.id}/', {'name': 'Drama'}, format='json'),
+            self.admin.patch(f'/movies/personas/{persona.id}/', {'biography': 'Actor'}, format='json'),
+            self.user.post('/movies/reviews/', {'movie_id': movie.id, 'title': 'Mine', 'review': 'text'},
+                           format='json'),
+        ]
+        review = Review.objects.get(account=self.user_account)
+        responses.append(self.user.put(f'/movies/reviews/{review.id}/', {'title': 'Edited', 'review': 'text'},
+                                       format='json'))
+        for response in responses:
+            self.assertLess(response.status_code, 400, response.content)
+
+    @override_settings(QUERY_BUDGETS='raise')
+    def test_movie_writes_do_not_grow_with_relations(self):
+        counts = []
+        for size in (2, 12):
+            payload = {
+                'title': f'Cast {size}', 'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t',
+                'description': 'Plot', 'genres': [f'Genre {size} {i}' for i in range(size)], 'photos': [],
+                'directors': [], 'writers': [],
+                'stars': [{'first_name': f'Star{i}', 'last_name': str(size), 'birthdate': '1980-01-01'}
+                          for i in range(size)],
+            }
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                response = self.admin.post('/movies/', payload, format='json')
+                self.assertEqual(response.status_code, 201, response.content)
+                movie_id = response.data['id']
+                payload['stars'] = payload['stars'][1:]
+                self.assertEqual(self.admin.put(f'/movies/{movie_id}/', payload, format='json').status_code, 200)
+                self.assertEqual(self.admin.delete(f'/movies/{movie_id}/').status_code, 204)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class MovieDocumentTest(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.payload = {
+            'title': 'Movie', 'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t',
+            'description': 'Plot', 'genres': ['Drama'], 'photos': ['http://example.com/1.jpg'],
+            'directors': [{'first_name': 'Jane', 'last_name': 'Doe', 'birthdate': '1970-01-01'}],
+            'writers': [], 'stars': [{'first_name': 'John', 'last_name': 'Roe', 'birthdate': '1980-01-01'}],
+        }
+        response = self.client.post('/movies/', self.payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.movie = Movie.objects.get(pk=response.data['id'])
+
+    def assertDocumentCurrent(self):
+        expected = dumps(serialize_movies([self.movie.id])[self.movie.id])
+        self.assertEqual(bytes(MovieDocument.objects.get(pk=self.movie.id).data), expected)
+
+    def test_written_on_create_and_update(self):
+        self.assertDocumentCurrent()
+        response = self.client.put(f'/movies/{self.movie.id}/', {**self.payload, 'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertDocumentCurrent()
+        self.assertIn(b'"Renamed"', MovieDocument.objects.get(pk=self.movie.id).data)
+
+    def test_rebuilt_on_related_changes(self):
+        genre = self.movie.genres.get()
+        self.client.patch(f'/movies/genres/{genre.id}/', {'name': 'Thriller'}, format='json')
+        self.assertDocumentCurrent()
+        persona = self.movie.stars.get()
+        self.client.patch(f'/movies/personas/{persona.id}/', {'first_name': 'Johnny'}, format='json')
+        self.assertDocumentCurrent()
+        with self.captureOnCommitCallbacks(execute=True):
+            Star.objects.filter(movie=self.movie).delete()
+            Photo.objects.create(movie=self.movie, photo='http://example.com/2.jpg')
+        self.assertDocumentCurrent()
+        self.assertIn(b'"Thriller"', MovieDocument.objects.get(pk=self.movie.id).data)
+
+    @override_settings(QUERY_BUDGETS='off')
+    def test_rename_rebuilds_in_chunks(self):
+        genre = self.movie.genres.get()
+        with batch.deferred():
+            for i in range(4):
+                movie = Movie.objects.create(title=f'Movie {i}', year=2001, length=90, rating=Decimal('5.0'),
+                                             trailer='http://example.com/t', description='Plot')
+                movie.genres.add(genre)
+        movie_ids = sorted(GenreMovieMap.objects.filter(genre=genre).values_list('movie_id', flat=True))
+        for movie_id in movie_ids:
+            self.client.get(f'/movies/{movie_id}/')
+        before = dict(Movie.objects.values_list('id', 'version'))
+        with mock.patch.object(documents, 'CHUNK_SIZE', 2), mock.patch.object(versions, 'UPDATE_BATCH_SIZE', 2), \
+                mock.patch.object(response_cache, 'DELETE_BATCH_SIZE', 2), \
+                CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/movies/genres/{genre.id}/', {'name': 'Thriller'}, format='json')
+        statements = [q['sql'] for q in queries]
+        self.assertEqual(sum(s.startswith('DELETE FROM "movies_moviedocument"') for s in statements), 3)
+        self.assertEqual(sum(s.startswith('UPDATE "movies_movie" SET "version"') for s in statements), 3)
+        for movie_id in movie_ids:
+            self.assertIn(b'"Thriller"', MovieDocument.objects.get(pk=movie_id).data)
+            self.assertIsNone(caches[CACHE_ALIAS].get(response_cache.movie_key(movie_id)))
+            self.assertEqual(Movie.objects.get(pk=movie_id).version, before[movie_id] + 1)
+
+    def test_reads_come_from_documents(self):
+        MovieDocument.objects.filter(pk=self.movie.id).update(data=b'{"id":0}')
+        self.assertEqual(self.client.get(f'/movies/{self.movie.id}/').content, b'{"id":0}')
+
+    @override_settings(QUERY_BUDGETS='raise')
+    def test_missing_documents_are_served_without_writing(self):
+        MovieDocument.objects.all().delete()
+        expected = dumps(serialize_movies([self.movie.id])[self.movie.id])
+        self.assertEqual(self.client.get(f'/movies/{self.movie.id}/').content, expected)
+        response = self.client.get('/movies/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(expected, response.content)
+        self.assertFalse(MovieDocument.objects.exists())
+
+    def test_deleted_with_movie(self):
+        self.assertEqual(self.client.delete(f'/movies/{self.movie.id}/').status_code, 204)
+        self.assertFalse(MovieDocument.objects.exists())
+        self.assertEqual(self.client.get(f'/movies/{self.movie.id}/').status_code, 404)
+
+    def test_rebuild_command(self):
+        MovieDocument.objects.all().delete()
+        call_command('rebuild_movie_documents', stdout=StringIO())
+        self.assertDocumentCurrent()
+
+
+class SparseFieldsTest(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post('/movies/', {
+            'title': 'Movie', 'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t',
+            'description': 'Plot', 'genres': ['Drama'], 'photos': ['http://example.com/1.jpg'],
+            'directors': [{'first_name': 'Jane', 'last_name': 'Doe', 'birthdate': '1970-01-01'}],
+            'writers': [], 'stars': [{'first_name': 'John', 'last_name': 'Roe', 'birthdate': '1980-01-01'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.movie = Movie.objects.get(pk=response.data['id'])
+        self.plain_fields = [f for f in MovieSerializer.Meta.fields if f not in NESTED_FIELDS]
+
+    def keys(self, url: str, **params) -> list:
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        return list(data['results'][0] if 'results' in data else data)
+
+    def test_fields_and_expand_on_movies(self):
+        for url in ('/movies/', f'/movies/{self.movie.id}/'):
+            self.assertEqual(self.keys(url), list(MovieSerializer.Meta.fields))
+            self.assertEqual(self.keys(url, fields='rating,id,title'), ['id', 'title', 'rating'])
+            self.assertEqual(self.keys(url, expand='genres'), self.plain_fields + ['genres'])
+            self.assertEqual(self.keys(url, fields='id', expand='stars,genres'), ['id', 'genres', 'stars'])
+            self.assertEqual(self.keys(url), list(MovieSerializer.Meta.fields))
+        data = self.client.get(f'/movies/{self.movie.id}/', {'fields': 'id', 'expand': 'directors'}).json()
+        self.assertEqual(data['directors'][0]['last_name'], 'Doe')
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/movies/', {'fields': 'id,budget', 'expand': 'crew'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['fields'], ['Unknown field: budget', 'Unknown field: crew'])
+
+    def test_genre_and_persona_details(self):
+        genre, persona = self.movie.genres.get(), self.movie.directors.get()
+        with CaptureQueriesContext(connection) as sparse:
+            self.assertEqual(self.keys(f'/movies/genres/{genre.id}/', fields='id,name'), ['id', 'name'])
+        with CaptureQueriesContext(connection) as full:
+            self.assertIn('movies', self.keys(f'/movies/genres/{genre.id}/'))
+        self.assertLess(len(sparse), len(full))
+        self.assertEqual(self.keys(f'/movies/personas/{persona.id}/', fields='last_name', expand='directors'),
+                         ['last_name', 'directors', 'directors_count', 'directors_next'])
+
+
+class NestedPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre, cls.small_genre = Genre.objects.create(name='Drama'), Genre.objects.create(name='Short')
+        cls.persona = Persona.objects.create(first_name='Jane', last_name='Doe', birthdate=datetime.date(1970, 1, 1))
+        with batch.deferred():
+            cls.movies = [Movie.objects.create(title=f'Movie {i}', year=2000, length=90, rating=Decimal('5.0'),
+                                               trailer='http://example.com/t', description='Plot') for i in range(25)]
+            for movie in cls.movies:
+                movie.genres.add(cls.genre)
+                movie.stars.add(cls.persona)
+            cls.movies[0].genres.add(cls.small_genre)
+            for movie in cls.movies[:3]:
+                movie.directors.add(cls.persona)
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.client = APIClient()
+
+    def get(self, url: str, **params) -> dict:
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_relations_are_paged_by_cursor(self):
+        url = f'/movies/genres/{self.genre.id}/'
+        data = self.get(url)
+        self.assertEqual((len(data['movies']), data['movies_count']), (20, 25))
+        self.assertEqual(list(data['movies'][0]), ['id', 'title', 'year'])
+        second = self.client.get(data['movies_next']).json()
+        self.assertEqual((len(second['movies']), second['movies_next']), (5, None))
+        self.assertEqual([m['id'] for m in data['movies'] + second['movies']], [m.id for m in self.movies])
+        self.assertEqual(self.get(url)['movies'], data['movies'])
+        self.assertEqual(self.client.get(url, {'movies_cursor': 'nope'}).status_code, 404)
+
+    def test_every_relation_pages_on_its_own(self):
+        data = self.get(f'/movies/personas/{self.persona.id}/', stars_page_size=5, directors_page_size=2,
+                        count='false')
+        self.assertEqual([len(data[relation]) for relation in ('directors', 'writers', 'stars')], [2, 0, 5])
+        self.assertIsNone(data['writers_next'])
+        self.assertNotIn('stars_count', data)
+        following = self.client.get(data['directors_next']).json()
+        self.assertEqual([m['id'] for m in following['directors']], [self.movies[2].id])
+        self.assertEqual(len(following['stars']), 5)
+
+    def test_counts_only(self):
+        data = self.get(f'/movies/personas/{self.persona.id}/', nested='counts')
+        self.assertEqual([data.get(f'{relation}_count') for relation in ('directors', 'writers', 'stars')],
+                         [3, 0, 25])
+        self.assertFalse({'directors', 'writers', 'stars', 'stars_next'} & set(data))
+
+    def test_queries_do_not_grow_with_relations(self):
+        counts = []
+        for genre in (self.small_genre, self.genre):
+            with CaptureQueriesContext(connection) as queries:
+                self.get(f'/movies/genres/{genre.id}/')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        with mock.patch.object(RelationPagination, 'max_page_size', 3):
+            self.assertEqual(len(self.get(f'/movies/genres/{self.genre.id}/', movies_page_size=50)['movies']), 3)
+
+
+class MovieUpdateTest(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.stars = [{'first_name': f'Star{i}', 'last_name': 'Roe', 'birthdate': '1980-01-01'} for i in range(4)]
+        self.payload = {
+            'title': 'Movie', 'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t',
+            'description': 'Plot', 'genres': ['Drama', 'Comedy'],
+            'photos': ['http://example.com/1.jpg', 'http://example.com/2.jpg'],
+            'directors': [{'first_name': 'Jane', 'last_name': 'Doe', 'birthdate': '1970-01-01'}],
+            'writers': [], 'stars': self.stars,
+        }
+        response = self.client.post('/movies/', self.payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.movie = Movie.objects.get(pk=response.data['id'])
+        self.url = f'/movies/{self.movie.id}/'
+
+    def links(self) -> dict:
+        return {
+            'genres': set(GenreMovieMap.objects.filter(movie=self.movie).values_list('id', flat=True)),
+            'photos': set(Photo.objects.filter(movie=self.movie).values_list('id', flat=True)),
+            'directors': set(Director.objects.filter(movie=self.movie).values_list('id', flat=True)),
+            'stars': set(Star.objects.filter(movie=self.movie).values_list('id', flat=True)),
+        }
+
+    def test_unchanged_put_writes_nothing(self):
+        before = self.links()
+        with budgets.query_budget(20):
+            response = self.client.put(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.links(), before)
+
+    def test_patch_leaves_omitted_relations(self):
+        before = self.links()
+        response = self.client.patch(self.url, {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.links(), before)
+        self.assertEqual(Movie.objects.get(pk=self.movie.id).title, 'Renamed')
+
+    def test_only_changed_links_are_written(self):
+        before = self.links()
+        stars = self.stars[1:] + [{'first_name': 'New', 'last_name': 'Star', 'birthdate': '1990-01-01'}]
+        photos = ['http://example.com/2.jpg', 'http://example.com/3.jpg', 'http://example.com/3.jpg']
+        response = self.client.patch(self.url, {'stars': stars, 'photos': photos, 'genres': ['Drama']},
+                                     format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        after = self.links()
+        self.assertEqual(len(before['stars'] & after['stars']), 3)
+        self.assertEqual(len(after['stars']), 4)
+        self.assertEqual(len(before['photos'] & after['photos']), 1)
+        self.assertEqual(sorted(Photo.objects.filter(movie=self.movie).values_list('photo', flat=True)), photos[:2])
+        self.assertEqual(list(self.movie.genres.values_list('name', flat=True)), ['Drama'])
+        self.assertEqual(after['directors'], before['directors'])
+        self.assertEqual(bytes(MovieDocument.objects.get(pk=self.movie.id).data),
+                         dumps(serialize_movies([self.movie.id])[self.movie.id]))
+
+
+    def test_photo_only_patch_updates_version_document_and_cache(self):
+        etag = self.client.get(self.url)['ETag']
+        photos = self.payload['photos'] + ['http://example.com/3.jpg']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'photos': photos}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertGreater(Movie.objects.get(pk=self.movie.id).version, self.movie.version)
+        self.assertIn(b'http://example.com/3.jpg', MovieDocument.objects.get(pk=self.movie.id).data)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http://example.com/3.jpg', response.content)
+
+
+class ChangeBatchTest(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.payload = {
+            'title': 'Movie', 'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t',
+            'description': 'Plot', 'genres': ['Drama'], 'photos': [],
+            'directors': [], 'writers': [],
+            'stars': [{'first_name': f'Star{i}', 'last_name': 'Roe', 'birthdate': '1980-01-01'} for i in range(3)],
+        }
+        response = self.client.post('/movies/', self.payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.movie = Movie.objects.get(pk=response.data['id'])
+
+    def test_cache_evicted_on_commit(self):
+        key = response_cache.movie_key(self.movie.id)
+        caches[CACHE_ALIAS].set(key, b'{"id":0}')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.patch(f'/movies/{self.movie.id}/', {'title': 'Renamed'}, format='json')
+            self.assertEqual(caches[CACHE_ALIAS].get(key), b'{"id":0}')
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(caches[CACHE_ALIAS].get(key))
+
+    def test_versions_bumped_once_per_write(self):
+        stars = self.payload['stars'][1:] + [{'first_name': 'New', 'last_name': 'Star', 'birthdate': '1990-01-01'},
+                                             {'first_name': 'Other', 'last_name': 'Star', 'birthdate': '1990-01-01'}]
+        kept = Persona.objects.get(first_name='Star1')
+        response = self.client.patch(f'/movies/{self.movie.id}/', {'stars': stars}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Movie.objects.get(pk=self.movie.id).version, self.movie.version + 1)
+        self.assertEqual(Persona.objects.get(pk=kept.pk).version, kept.version)
+        self.assertEqual(Persona.objects.get(first_name='Star0').version, kept.version + 1)
+
+
+class VersionTest(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.movie = Movie.objects.create(title='Movie', year=2000, length=90, rating=Decimal('7.5'),
+                                          trailer='http://example.com/t', description='Plot')
+
+    def test_save_keeps_concurrent_bump(self):
+        stale = Movie.objects.get(pk=self.movie.pk)
+        versions.touch(movie_ids=[self.movie.pk])
+        bumped = Movie.objects.get(pk=self.movie.pk).version
+        stale.title = 'Renamed'
+        stale.save()
+        movie = Movie.objects.get(pk=self.movie.pk)
+        self.assertEqual(movie.title, 'Renamed')
+        self.assertGreater(movie.version, bumped)
+
+    def test_etag_changes_with_every_write(self):
+        etag = self.client.get(f'/movies/{self.movie.id}/')['ETag']
+        self.assertEqual(self.client.get(f'/movies/{self.movie.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/movies/{self.movie.id}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.client.get(f'/movies/{self.movie.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(b'"Renamed"', response.content)
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        for index in (search.movie_index, search.persona_index):
+            index.loaded = False
+            self.addCleanup(setattr, index, 'loaded', False)
+        self.client = APIClient()
+        with batch.deferred():
+            self.movies = {title: Movie.objects.create(title=title, year=2000, length=90, rating=Decimal(rating),
+                                                       trailer='http://example.com/t', description=description)
+                           for title, rating, description in (
+                               ('Matrix', '5.0', 'Hackers'), ('Matrixes', '9.0', 'Hackers'),
+                               ('Matrix Reloaded', '8.0', 'Sequel'), ('Amélie', '7.0', 'Paris'))}
+            Persona.objects.create(first_name='Jane', last_name='Doe', birthdate=datetime.date(1970, 1, 1))
+
+    def titles(self, query: str, url: str = '/movies/search/', **params) -> list:
+        response = self.client.get(url, {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row.get('title') or row['last_name'] for row in response.data['results']]
+
+    def test_exact_matches_rank_before_prefixes_then_by_rating(self):
+        self.assertEqual(self.titles('matrix'), ['Matrix Reloaded', 'Matrix', 'Matrixes'])
+        self.assertEqual(self.titles('matri'), ['Matrixes', 'Matrix Reloaded', 'Matrix'])
+        self.assertEqual(self.titles('matrix', limit=1), ['Matrix Reloaded'])
+
+    def test_every_token_must_match(self):
+        self.assertEqual(self.titles('matrix sequel'), ['Matrix Reloaded'])
+        self.assertEqual(self.titles('matrix paris'), [])
+
+    def test_typos_accents_and_case(self):
+        self.assertEqual(self.titles('matrx reloeded'), ['Matrix Reloaded'])
+        self.assertEqual(self.titles('AMELIE'), ['Amélie'])
+        self.assertEqual(self.titles('dooe', url='/movies/personas/search/'), ['Doe'])
+        self.assertEqual(self.titles('xyzzy'), [])
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.client.get('/movies/search/').status_code, 400)
+        self.assertEqual(self.client.get('/movies/search/', {'q': 'matrix', 'limit': 0}).status_code, 400)
+
+
+@override_settings(SEARCH_INDEX_REFRESH=0)
+class SearchSyncTest(TestCase):
+    """
+    Indexes of other processes follow writes through the SearchChange log.
+    """
+
+    def setUp(self):
+        self.index = search.SearchIndex(Movie, SearchChange.MOVIE, ('title', 'description'), rank_field='rating')
+        self.addCleanup(setattr, search.movie_index, 'loaded', False)
+
+    def create_movie(self, title: str) -> Movie:
+        return Movie.objects.create(title=title, year=2000, length=90, rating=Decimal('5.0'),
+                                    trailer='http://example.com/t', description='Plot')
+
+    def test_late_commit_is_picked_up(self):
+        self.index.ensure_fresh()
+        late, early = self.create_movie('Lateness'), self.create_movie('Earliness')
+        change = SearchChange.objects.get(object_id=late.id)
+        change.delete()  # allocated first, not committed yet
+        self.assertEqual(self.index.search('earliness', 10), [early.id])
+        self.assertEqual(self.index.search('lateness', 10), [])
+        SearchChange.objects.create(id=change.id, kind=change.kind, object_id=late.id)
+        self.assertEqual(self.index.search('lateness', 10), [late.id])
+        self.assertNotIn(change.id, self.index.gaps)
+
+    def test_deletes_and_bulk_inserts_of_other_processes(self):
+        movie = self.create_movie('Vanishing')
+        self.assertEqual(self.index.search('vanishing', 10), [movie.id])
+        movie.delete()
+        personas = bulk_get_or_create_map(Persona, ['first_name', 'last_name', 'birthdate'], [
+            {'first_name': 'Bulk', 'last_name': 'Inserted', 'birthdate': datetime.date(1970, 1, 1)}])
+        persona_index = search.SearchIndex(Persona, SearchChange.PERSONA, ('first_name', 'last_name'))
+        persona_index.ensure_fresh()
+        self.assertEqual(self.index.search('vanishing', 10), [])
+        self.assertEqual(persona_index.search('inserted', 10), [p.id for p in personas.values()])
+
+    def test_old_changes_are_pruned_by_command(self):
+        old, recent = self.create_movie('Old'), self.create_movie('Recent')
+        SearchChange.objects.filter(object_id=old.id).update(
+            created_at=timezone.now() - datetime.timedelta(seconds=settings.SEARCH_CHANGE_RETENTION + 1))
+        written = self.create_movie('Written')
+        self.assertEqual(SearchChange.objects.count(), 3)
+        call_command('prune_search_changes', stdout=StringIO())
+        self.assertEqual(sorted(SearchChange.objects.values_list('object_id', flat=True)), [recent.id, written.id])
+
+    @override_settings(SEARCH_INDEX_REFRESH=3600)
+    def test_own_writes_are_applied_on_commit(self):
+        search.movie_index.ensure_fresh()
+        with self.captureOnCommitCallbacks() as callbacks:
+            movie = self.create_movie('Committed')
+            self.assertEqual(search.movie_index.search('committed', 10), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(search.movie_index.search('committed', 10), [movie.id])
+
+
+class MovieExportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        genre = Genre.objects.create(name='Drama')
+        with batch.deferred():
+            self.movies = [Movie.objects.create(title=f'Movie {i}', year=2000, length=90, rating=Decimal('7.5'),
+                                                trailer='http://example.com/t', description='Plot')
+                           for i in range(3)]
+            for movie in self.movies:
+                movie.genres.add(genre)
+
+    def test_admin_only(self):
+        self.assertIn(self.client.get('/movies/export/').status_code, (401, 403))
+        self.client.force_authenticate(Account.objects.create_user('user', 'user@example.com', 'password'))
+        self.assertEqual(self.client.get('/movies/export/').status_code, 403)
+
+    def test_streams_every_movie(self):
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/movies/export/')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [movie.id for movie in self.movies])
+        self.assertEqual([genre['name'] for genre in json.loads(lines[0])['genres']], ['Drama'])
+        response = self.client.get('/movies/export/', {'output': 'csv'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], list(MovieSerializer.Meta.fields))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(self.client.get('/movies/export/', {'output': 'xml'}).status_code, 400)
+
+
+class BulkGetOrCreateTest(TestCase):
+    columns = ['first_name', 'last_name', 'birthdate']
+
+    def setUp(self):
+        self.existing = Persona.objects.create(first_name='Jane', last_name='Doe', birthdate=datetime.date(1970, 1, 1))
+
+    def persona(self, first_name: str) -> dict:
+        return {'first_name': first_name, 'last_name': 'Doe', 'birthdate': datetime.date(1970, 1, 1)}
+
+    def test_existing_rows_are_reused_and_duplicates_collapse(self):
+        objs = [self.persona('John'), self.persona('Jane'), self.persona('John'), self.persona('Jim')]
+        with CaptureQueriesContext(connection) as queries:
+            personas = bulk.bulk_get_or_create_map(Persona, self.columns, objs)
+        self.assertEqual(len([q for q in queries if '"movies_persona"' in q['sql']]), 3)
+        self.assertEqual([key[0] for key in personas], ['John', 'Jane', 'Jim'])
+        self.assertEqual(personas[('Jane', 'Doe', datetime.date(1970, 1, 1))].id, self.existing.id)
+        self.assertEqual(Persona.objects.count(), 3)
+        self.assertTrue(all(persona.id for persona in personas.values()))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk.bulk_get_or_create_map(Persona, self.columns, objs), personas)
+        self.assertEqual(len([q for q in queries if '"movies_persona"' in q['sql']]), 1)
+
+    def test_row_inserted_by_a_concurrent_writer(self):
+        select = bulk._select
+
+        def select_before_concurrent_insert(model, columns, keys, lock=False):
+            if not lock:
+                found = select(model, columns, keys)
+                Persona.objects.create(**self.persona('John'))
+                return found
+            return select(model, columns, keys, lock)
+
+        with mock.patch.object(bulk, '_select', select_before_concurrent_insert):
+            personas = bulk.bulk_get_or_create(Persona, self.columns, [self.persona('John'), self.persona('Jim')])
+        self.assertEqual([persona.first_name for persona in personas], ['John', 'Jim'])
+        self.assertEqual(personas[0].id, Persona.objects.get(first_name='John').id)
+        self.assertEqual(Persona.objects.count(), 3)
+
+    def test_concurrent_posts_share_new_related_rows(self):
+        client = APIClient()
+        client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        payload = {
+            'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t', 'description': 'Plot',
+            'genres': ['Drama'], 'photos': [], 'directors': [{**self.persona('Jim'), 'birthdate': '1970-01-01'}],
+            'writers': [], 'stars': [],
+        }
+        select = bulk._select
+        posted = {}
+
+        def select_before_concurrent_post(model, columns, keys, lock=False):
+            found = select(model, columns, keys, lock)
+            if model is Persona and not lock and not posted:
+                posted['response'] = None
+                posted['response'] = client.post('/movies/', {**payload, 'title': 'First'}, format='json')
+            return found
+
+        with mock.patch.object(bulk, '_select', select_before_concurrent_post):
+            response = client.post('/movies/', {**payload, 'title': 'Second'}, format='json')
+        self.assertEqual(posted['response'].status_code, 201, posted['response'].content)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Persona.objects.filter(first_name='Jim').count(), 1)
+        self.assertEqual(Genre.objects.filter(name='Drama').count(), 1)
+        self.assertEqual(posted['response'].data['directors'][0]['id'], response.data['directors'][0]['id'])
+
+
+class MovieImportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        Movie.objects.create(title='Existing', year=2000, length=90, rating=Decimal('7.5'),
+                             trailer='http://example.com/t', description='Plot')
+
+    def movie(self, title: str, **fields) -> dict:
+        return {
+            'title': title, 'year': 2000, 'length': 90, 'rating': '7.5', 'trailer': 'http://example.com/t',
+            'description': 'Plot', 'genres': ['Drama'], 'photos': ['http://example.com/1.jpg'],
+            'directors': [{'first_name': 'Jane', 'last_name': 'Doe', 'birthdate': '1970-01-01'}],
+            'writers': [{'first_name': 'Jane', 'last_name': 'Doe', 'birthdate': '1970-01-01'}], 'stars': [],
+            **fields,
+        }
+
+    def lines(self, *rows) -> str:
+        return ''.join((row if isinstance(row, str) else json.dumps(row)) + '\n' for row in rows)
+
+    def test_invalid_lines_are_reported_and_valid_ones_written(self):
+        body = self.lines(self.movie('First'), '{"title": ', '[]', self.movie('Second', rating='eleven'), '',
+                          self.movie('Existing'), self.movie('First'), self.movie('Third', genres=['Comedy']))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.generic('POST', '/movies/import/?chunk_size=3', body,
+                                           content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual({k: response.data[k] for k in ('created', 'skipped', 'failed')},
+                         {'created': 2, 'skipped': 2, 'failed': 3})
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3, 4])
+        self.assertIn('rating', response.data['errors'][2]['errors'])
+        self.assertCountEqual(Movie.objects.values_list('title', flat=True), ['Existing', 'First', 'Third'])
+        self.assertEqual(Persona.objects.count(), 1)
+        self.assertCountEqual(Genre.objects.values_list('name', flat=True), ['Drama', 'Comedy'])
+        first = Movie.objects.get(title='First')
+        self.assertEqual((first.directors.get(), first.photos.count()), (first.writers.get(), 1))
+        self.assertTrue(MovieDocument.objects.filter(pk=first.id).exists())
+
+    def test_queries_per_chunk_do_not_grow_with_rows(self):
+        list(importer.import_lines([json.dumps(self.movie('Warm-up'))]))
+        counts = []
+        for size in (2, 20):
+            rows = [self.movie(f'Movie {size} {i}', stars=[{'first_name': f'Star{i}', 'last_name': 'Roe',
+                                                            'birthdate': '1980-01-01'}]) for i in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                results = list(importer.import_lines(self.lines(*rows).splitlines(), chunk_size=size))
+            self.assertEqual(results[0]['created'], size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_admin_only(self):
+        self.client.force_authenticate(Account.objects.create_user('user', 'user@example.com', 'password'))
+        response = self.client.generic('POST', '/movies/import/', self.lines(self.movie('First')),
+                                       content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post('/movies/import/?chunk_size=many').status_code, 403)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as source:
+            source.write(self.lines(self.movie('First'), 'nope'))
+        self.addCleanup(os.remove, source.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_movies', source.name, stdout=stdout, stderr=stderr)
+        self.assertIn('1 created, 0 skipped, 1 failed', stdout.getvalue())
+        self.assertIn('line 2:', stderr.getvalue())
+        self.assertTrue(Movie.objects.filter(title='First').exists())
+
+
+class BenchmarkTest(TestCase):
+
+    def test_compare(self):
+        baseline = {'movie_list': {'median_ms': 10.0, 'queries': 3, 'alloc_kb': 100.0}, 'gone': {'queries': 1}}
+        results = {'movie_list': {'median_ms': 12.0, 'queries': 4, 'alloc_kb': 130.0, 'p95_ms': 20.0},
+                   'new': {'queries': 9}}
+        self.assertEqual(benchmark.compare(results, baseline, tolerance=0.25), [
+            ('movie_list', 'median_ms', 10.0, 12.0, False),
+            ('movie_list', 'queries', 3, 4, True),
+            ('movie_list', 'alloc_kb', 100.0, 130.0, True),
+        ])
+
+    def test_seed_is_deterministic(self):
+        people = [('First', f'Last{i}', '1970-01-01') for i in range(10)]
+        self.assertEqual(benchmark.movie_data(1, random.Random(0), ['Drama', 'Comedy'], people),
+                         benchmark.movie_data(1, random.Random(0), ['Drama', 'Comedy'], people))
+
+    def test_command_reports_regressions_against_the_baseline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            benchmark.seed(movies=6, personas=12, genres=3, accounts=3, reviews=6)
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(connection.creation, 'create_test_db'), \
+                mock.patch.object(connection.creation, 'destroy_test_db'), \
+                mock.patch('movies.management.commands.benchmark.setup_test_environment'), \
+                mock.patch('movies.management.commands.benchmark.teardown_test_environment'):
+            options = {'repeat': 2, 'page_size': 3, 'scenario': ['movie_list'], 'keepdb': True,
+                       'baseline': os.path.join(directory, 'baseline.json'), 'stdout': StringIO()}
+            call_command('benchmark', save_baseline=True, **options)
+            with open(options['baseline']) as f:
+                saved = json.load(f)
+            self.assertEqual(list(saved['results']), ['movie_list'])
+            self.assertEqual(saved['config']['page_size'], 3)
+            call_command('benchmark', fail_on_regression=True, tolerance=100, **options)
+            saved['results']['movie_list']['queries'] -= 1
+            with open(options['baseline'], 'w') as f:
+                json.dump(saved, f)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', fail_on_regression=True, tolerance=100, **options)
+        self.assertRegex(options['stdout'].getvalue(), r'movie_list +queries .*  regression')
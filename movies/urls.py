@@ -1,9 +1,13 @@
 from django.urls import path
+from movie_random.async_views import async_reads
 from . import views
 
 urlpatterns = [
-    path('', views.MovieList.as_view()),
-    path('<int:pk>/', views.MovieDetail.as_view()),
+    path('', async_reads(views.MovieList.as_view())),
+    path('<int:pk>/', async_reads(views.MovieDetail.as_view())),
+    path('import/', views.MovieImport.as_view()),
+    path('export/', views.MovieExport.as_view()),
+    path('search/', async_reads(views.MovieSearch.as_view())),
     path('genres/', views.GenreList.as_view()),
     path('genres/<int:pk>/', views.GenreDetail.as_view()),
     path('reviews/', views.ReviewCreate.as_view()),
@@ -12,4 +16,6 @@ urlpatterns = [
     path('reviews/account/<int:account_id>/', views.AccountReviewList.as_view()),
     path('personas/', views.PersonaList.as_view()),
     path('personas/<int:pk>/', views.PersonaDetail.as_view()),
+    path('personas/search/', async_reads(views.PersonaSearch.as_view())),
+    path('cache/stats/', views.ResponseCacheStats.as_view()),
 ]
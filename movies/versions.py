@@ -0,0 +1,31 @@
+import hashlib
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import quote_etag
+from .models import Movie, Genre, Persona
+
+UPDATE_BATCH_SIZE = 500
+
+
+def touch(movie_ids=(), genre_ids=(), persona_ids=()):
+    """
+    Bump version and updated_at of objects whose representation changed, UPDATE_BATCH_SIZE ids per update,
+    update() does not send signals.
+    """
+    now = timezone.now()
+    for model, ids in ((Movie, movie_ids), (Genre, genre_ids), (Persona, persona_ids)):
+        ids = sorted(ids)
+        for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+            model.objects.filter(id__in=ids[start:start + UPDATE_BATCH_SIZE]).update(
+                version=F('version') + 1, updated_at=now)
+
+
+def make_etag(request, *parts) -> str:
+    """
+    Strong ETag of the validator parts, the query string is part of it as it shapes the representation.
+    """
+    value = '-'.join(str(p) for p in parts)
+    query = request.META.get('QUERY_STRING', '')
+    if query:
+        value += '-' + hashlib.md5(query.encode()).hexdigest()[:8]
+    return quote_etag(value)
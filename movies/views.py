@@ -1,24 +1,306 @@
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.authtoken.models import Token
+from rest_framework.views import APIView
+from movie_random.pagination import RelationPagination
+from movie_random.renderers import loads
 from .models import Movie, Review, Genre, Persona
-from accounts.models import Account
-from .serializers import MovieSerializer, ReviewSerializer, GenreSerializer, PersonaSerializer
+from .serializers import MovieSerializer, ReviewSerializer, GenreSerializer, PersonaSerializer, \
+    NestedMovieSerializer, SearchQuerySerializer
+from . import batch, documents, importer, exporter, response_cache, search, versions
+from .filters import MovieFilterBackend
+
+
+class ConditionalGetMixin:
+    """
+    Answer conditional GET with 304 from cheap validators before the response is built,
+    set ETag and Last-Modified on full responses.
+    """
+
+    def get_validators(self):
+        """
+        Return (etag, last modified datetime) or None when the object does not exist.
+        """
+        model = self.get_queryset().model
+        row = model.objects.filter(pk=self.kwargs[self.lookup_field]).values_list('version', 'updated_at').first()
+        if row is None:
+            return None
+        version, updated_at = row
+        return versions.make_etag(self.request, model._meta.model_name, self.kwargs[self.lookup_field], version), updated_at
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        etag, updated_at = validators
+        last_modified = int(updated_at.timestamp()) if updated_at else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ConditionalReviewListMixin(ConditionalGetMixin):
+
+    def get_validators(self):
+        row = self.get_queryset().aggregate(count=Count('id'), updated_at=Max('updated_at'))
+        updated_at = row['updated_at']
+        stamp = updated_at.isoformat() if updated_at else ''
+        return versions.make_etag(self.request, 'reviews', row['count'], stamp), updated_at
+
+
+class SparseFieldsMixin:
+    """
+    Let GET requests pick top level fields with ?fields= and nested relations with ?expand=.
+    Only requested relations are prefetched and serialized, expand alone keeps every plain field.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    nested_fields = ()
+
+    def get_sparse_fields(self):
+        """
+        Return requested fields in serializer order or None for the full representation.
+        """
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = self._parse_sparse_fields()
+        return self._sparse_fields
+
+    def _parse_sparse_fields(self):
+        params = self.request.query_params
+        if self.request.method not in permissions.SAFE_METHODS or \
+                (self.fields_query_param not in params and self.expand_query_param not in params):
+            return None
+        available = self.get_serializer_class().Meta.fields
+        if self.fields_query_param in params:
+            requested = {f for f in params[self.fields_query_param].split(',') if f}
+        else:
+            requested = set(available) - set(self.nested_fields)
+        requested |= {f for f in params.get(self.expand_query_param, '').split(',') if f}
+        unknown = requested - set(available)
+        if unknown:
+            raise ValidationError({self.fields_query_param: [f'Unknown field: {f}' for f in sorted(unknown)]})
+        return [f for f in available if f in requested]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            queryset = queryset.prefetch_related(None).prefetch_related(
+                *(f for f in self.nested_fields if f in fields))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+
+class CachedRetrieveMixin:
+    """
+    Serve retrieve from the response cache, entries are evicted by model signals in movies.signals.
+    """
+    cache_key = None
+
+    def build_data(self):
+        return self.get_serializer(self.get_object()).data
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(response_cache.get_or_build(self.cache_key(self.kwargs[self.lookup_field]), self.build_data,
+                                                    fields=self.get_sparse_fields()))
+
+
+class DeferredChangesMixin:
+    """
+    Run writes in a batch.deferred() block, so versions, documents, counters and indexes they touch are
+    written once per write instead of once per changed row.
+    """
+
+    def perform_create(self, serializer):
+        with batch.deferred():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with batch.deferred():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with batch.deferred():
+            super().perform_destroy(instance)
+
+
+class WriteResponseMixin:
+    """
+    Answer creates and updates with response_data(instance) instead of the data of the write serializer,
+    which would read the relations of the written instance again.
+    """
+
+    def response_data(self, instance):
+        raise NotImplementedError
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        data = self.response_data(serializer.instance)
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    def update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=kwargs.pop('partial', False))
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(self.response_data(serializer.instance))
+
+
+class MovieDocumentResponseMixin(WriteResponseMixin):
+    """
+    Answer movie writes with the document the write rebuilt, one query instead of one per relation.
+    """
 
+    def response_data(self, instance):
+        return loads(documents.get_many([instance.pk])[instance.pk])
 
-class MovieList(generics.ListCreateAPIView):
-    queryset = Movie.objects.prefetch_related('genres', 'photos', 'directors', 'writers', 'stars')
+
+class NestedMoviesMixin(WriteResponseMixin):
+    """
+    Bound the nested movie lists of a detail response. Every relation returns one page with its own
+    <relation>_cursor and <relation>_page_size parameters, <relation>_count and <relation>_next link,
+    ?nested=counts returns the counts only. Only the default representation is cached.
+    """
+    nested_query_param = 'nested'
+    nested_movie_fields = ('id', 'title', 'year')
+    nested_lookups = {}
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(None)
+
+    def nested_movies(self, relation: str, pk):
+        return Movie.objects.filter(**{self.nested_lookups.get(relation, relation): pk})
+
+    def nested_params(self) -> set:
+        params = {self.nested_query_param}
+        for relation in self.nested_fields:
+            params |= RelationPagination.query_params(relation)
+        return params
+
+    def build_data(self):
+        instance = self.get_object()
+        fields = self.get_sparse_fields() or self.get_serializer_class().Meta.fields
+        data = self.get_serializer_class()(instance, fields=[f for f in fields if f not in self.nested_fields]).data
+        counts_only = self.request.query_params.get(self.nested_query_param) == 'counts'
+        for relation in self.nested_fields:
+            if relation not in fields:
+                continue
+            movies = self.nested_movies(relation, instance.pk)
+            if counts_only:
+                data[f'{relation}_count'] = movies.count()
+                continue
+            paginator = RelationPagination(relation)
+            page = paginator.paginate_queryset(movies.only(*self.nested_movie_fields), self.request, view=self)
+            data[relation] = NestedMovieSerializer(page, many=True, fields=self.nested_movie_fields).data
+            if paginator.count is not None:
+                data[f'{relation}_count'] = paginator.count
+            data[f'{relation}_next'] = paginator.get_next_link()
+        return data
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.get_sparse_fields() is None and not self.nested_params() & set(request.query_params):
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.build_data())
+
+    def response_data(self, instance):
+        return self.build_data()
+
+
+class MovieList(MovieDocumentResponseMixin, DeferredChangesMixin, SparseFieldsMixin, generics.ListCreateAPIView):
+    queryset = Movie.objects.all()
     serializer_class = MovieSerializer
+    filter_backends = [MovieFilterBackend]
+    nested_fields = ('genres', 'photos', 'directors', 'writers', 'stars')
+    # reads of movies without a document serialize them from the movie tables with 4 more queries
+    # receivers of a write collect their changes and flush them once, whatever the number of relations
+    query_budgets = {'GET': 7, 'POST': 45}
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(Movie.objects.all()))
 
-class MovieDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Movie.objects.prefetch_related('genres', 'photos', 'directors', 'writers', 'stars')
+        def build(movie_ids):
+            return {movie_id: response_cache.project(encoded, self.get_sparse_fields())
+                    for movie_id, encoded in documents.get_many(movie_ids).items()}
+        data = response_cache.get_or_build_movies([m.id for m in page], build, fields=self.get_sparse_fields())
+        return self.get_paginated_response(data)
+
+
+class MovieDetail(MovieDocumentResponseMixin, DeferredChangesMixin, ConditionalGetMixin, SparseFieldsMixin,
+                  CachedRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Movie.objects.all()
     serializer_class = MovieSerializer
+    nested_fields = ('genres', 'photos', 'directors', 'writers', 'stars')
+    cache_key = staticmethod(response_cache.movie_key)
+    # reads of movies without a document serialize them from the movie tables with 4 more queries
+    # receivers of a write collect their changes and flush them once, whatever the number of relations
+    query_budgets = {'GET': 6, 'PUT': 55, 'PATCH': 55, 'DELETE': 33}
+
+    def build_data(self):
+        movie_id = self.kwargs[self.lookup_field]
+        encoded = documents.get_many([movie_id]).get(movie_id)
+        if encoded is None:
+            raise NotFound()
+        return response_cache.project(encoded, self.get_sparse_fields())
+
+
+class MovieImport(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    max_reported_errors = 100
+    # the importer runs a fixed set of bulk queries per chunk
+    query_budgets = {'POST': None}
+
+    def post(self, request, format=None):
+        try:
+            chunk_size = max(int(request.query_params.get('chunk_size', importer.CHUNK_SIZE)), 1)
+        except ValueError:
+            return Response({"message": "chunk_size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        summary = {'created': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+        for result in importer.import_lines(request.stream or [], chunk_size):
+            summary['created'] += result['created']
+            summary['skipped'] += result['skipped']
+            summary['failed'] += len(result['errors'])
+            summary['errors'] += result['errors'][:self.max_reported_errors - len(summary['errors'])]
+        return Response(summary, status=status.HTTP_200_OK)
+
+
+class MovieExport(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    # exporter queries run chunk by chunk while the response streams, after the budget is checked
+    query_budgets = {'GET': None}
+    outputs = {
+        'ndjson': (exporter.ndjson_lines, 'application/x-ndjson'),
+        'csv': (exporter.csv_lines, 'text/csv'),
+    }
+
+    def get(self, request, format=None):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.outputs:
+            return Response({"message": f"output must be one of {', '.join(self.outputs)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        lines, content_type = self.outputs[output]
+        response = StreamingHttpResponse(lines(), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="movies.{output}"'
+        return response
 
 
 class GenreList(generics.ListCreateAPIView):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    query_budgets = {'GET': 2, 'POST': 5}
 
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
@@ -26,15 +308,21 @@ class GenreList(generics.ListCreateAPIView):
         return serializer_class(*args, **kwargs)
 
 
-class GenreDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Genre.objects.prefetch_related('movies')
+class GenreDetail(DeferredChangesMixin, NestedMoviesMixin, ConditionalGetMixin, SparseFieldsMixin,
+                  CachedRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    nested_fields = ('movies',)
+    nested_lookups = {'movies': 'genres'}
+    cache_key = staticmethod(response_cache.genre_key)
+    query_budgets = {'GET': 4, 'PUT': 15, 'PATCH': 15, 'DELETE': 21}
 
 
 class ReviewCreate(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    query_budgets = {'POST': 7}
 
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
@@ -42,8 +330,7 @@ class ReviewCreate(generics.CreateAPIView):
         return serializer_class(*args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        account_id = Token.objects.get(key=request.auth.key).user_id
-        request.data['account_id'] = account_id
+        request.data['account_id'] = request.user.id
         serializer = ReviewSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
@@ -55,11 +342,11 @@ class ReviewDetail(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    query_budgets = {'PUT': 6, 'DELETE': 5}
 
     def put(self, request, *args, **kwargs):
-        account_id = Token.objects.get(key=request.auth.key).user_id
         review = self.get_object()
-        if review.account_id != account_id:
+        if review.account_id != request.user.id:
             return Response({"message": "prohibited from changing other users review"}, status=status.HTTP_400_BAD_REQUEST)
         if 'movie_id' in request.data and review.movie_id != request.data['movie_id']:
             return Response({"message": "prohibited from changing movie"}, status=status.HTTP_400_BAD_REQUEST)
@@ -72,22 +359,21 @@ class ReviewDetail(generics.GenericAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, *args, **kwargs):
-        account_id = Token.objects.get(key=request.auth.key).user_id
-        is_staff = Account.objects.get(id=account_id).is_staff
         review = self.get_object()
-        if not is_staff and review.account_id != account_id:
+        if not request.user.is_staff and review.account_id != request.user.id:
             return Response({"message": "prohibited from deleting other users review"}, status=status.HTTP_400_BAD_REQUEST)
         review.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class MovieReviewList(generics.ListAPIView):
+class MovieReviewList(ConditionalReviewListMixin, generics.ListAPIView):
 
     def get_queryset(self):
         return super().get_queryset().filter(movie=self.kwargs['movie_id'])
 
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    query_budgets = {'GET': 3}
 
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
@@ -95,13 +381,14 @@ class MovieReviewList(generics.ListAPIView):
         return serializer_class(*args, **kwargs)
 
 
-class AccountReviewList(generics.ListAPIView):
+class AccountReviewList(ConditionalReviewListMixin, generics.ListAPIView):
 
     def get_queryset(self):
         return super().get_queryset().filter(account=self.kwargs['account_id'])
 
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    query_budgets = {'GET': 3}
 
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
@@ -112,6 +399,7 @@ class AccountReviewList(generics.ListAPIView):
 class PersonaList(generics.ListCreateAPIView):
     queryset = Persona.objects.all()
     serializer_class = PersonaSerializer
+    query_budgets = {'GET': 2, 'POST': 8}
 
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
@@ -122,6 +410,51 @@ class PersonaList(generics.ListCreateAPIView):
         return serializer_class(*args, **kwargs)
 
 
-class PersonaDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Persona.objects.prefetch_related('directors', 'writers', 'stars')
+class PersonaDetail(DeferredChangesMixin, NestedMoviesMixin, ConditionalGetMixin, SparseFieldsMixin,
+                    CachedRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Persona.objects.all()
+    serializer_class = PersonaSerializer
+    nested_fields = ('directors', 'writers', 'stars')
+    cache_key = staticmethod(response_cache.persona_key)
+    query_budgets = {'GET': 8, 'PUT': 22, 'PATCH': 22, 'DELETE': 18}
+
+
+class ResponseCacheStats(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    query_budgets = {'GET': 1}
+
+    def get(self, request, format=None):
+        return Response(dict(response_cache.stats), status=status.HTTP_200_OK)
+
+
+class SearchView(generics.GenericAPIView):
+    index = None
+    fields = None
+    query_budgets = {'GET': 3}
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = self.fields
+        return super().get_serializer(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        query = SearchQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        ids = self.index.search(query.validated_data['q'], query.validated_data['limit'])
+        objects = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([objects[i] for i in ids if i in objects], many=True)
+        return Response({"results": serializer.data}, status=status.HTTP_200_OK)
+
+
+class MovieSearch(SearchView):
+    queryset = Movie.objects.all()
+    serializer_class = NestedMovieSerializer
+    index = search.movie_index
+    fields = ['id', 'title', 'year', 'rating']
+
+
+class PersonaSearch(SearchView):
+    queryset = Persona.objects.all()
     serializer_class = PersonaSerializer
+    index = search.persona_index
+    fields = ['id', 'first_name', 'last_name', 'birthdate']
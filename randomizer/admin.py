@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import RandomBucket
 
-# Register your models here.
+
+class RandomBucketAdmin(admin.ModelAdmin):
+    list_display = ('key', 'size', 'generation')
+    search_fields = ('key',)
+
+
+admin.site.register(RandomBucket, RandomBucketAdmin)
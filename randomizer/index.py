@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Case, Count, Q, Value, When
+from movies.models import Movie, GenreMovieMap
+from .models import RandomBucket, RandomSlot
+
+ALL_KEY = 'all'
+GENRE_PREFIX = 'genre:'
+# buckets where fewer than this fraction of positions hold a movie are renumbered
+MIN_FILL = 0.5
+
+
+def genre_key(genre_id) -> str:
+    return f'{GENRE_PREFIX}{genre_id}'
+
+
+def members(movie_ids: set, keys) -> set:
+    """
+    Return (key, movie id) pairs of movie_ids that currently belong to the buckets of keys.
+    """
+    pairs = set()
+    if ALL_KEY in keys:
+        pairs.update((ALL_KEY, i) for i in Movie.objects.filter(pk__in=movie_ids).values_list('id', flat=True))
+    genre_ids = [key[len(GENRE_PREFIX):] for key in keys if key.startswith(GENRE_PREFIX)]
+    if genre_ids:
+        pairs.update((genre_key(g), m) for m, g in GenreMovieMap.objects.filter(
+            genre_id__in=genre_ids, movie_id__in=movie_ids).values_list('movie_id', 'genre_id'))
+    return pairs
+
+
+def _locked_buckets(keys) -> dict:
+    buckets = RandomBucket.objects.select_for_update().filter(key__in=keys).order_by('key')
+    found = {bucket.key: bucket for bucket in buckets}
+    if len(found) < len(keys):
+        RandomBucket.objects.bulk_create([RandomBucket(key=key) for key in keys if key not in found],
+                                         ignore_conflicts=True)
+        found = {bucket.key: bucket for bucket in buckets.all()}
+    return found
+
+
+def add_movies(additions: dict):
+    """
+    Append movies to the end of their buckets, movies already present or no longer in a bucket are skipped.
+
+    Positions are never moved or reused, so a draw cycle over the first positions of a bucket stays valid
+    while movies come and go. The buckets are locked for the append only, receivers run it after their commit.
+
+    :param additions: {bucket key: iterable of movie ids}
+    """
+    additions = {key: set(movie_ids) for key, movie_ids in additions.items() if movie_ids}
+    if not additions:
+        return
+    with transaction.atomic():
+        pairs = members(set().union(*additions.values()), additions.keys())
+        pairs = {(key, movie_id) for key, movie_id in pairs if movie_id in additions[key]}
+        if not pairs:
+            return
+        buckets = _locked_buckets({key for key, _ in pairs})
+        present = set(RandomSlot.objects.filter(bucket__in=buckets.values(), movie_id__in={m for _, m in pairs})
+                      .values_list('bucket__key', 'movie_id'))
+        slots = []
+        for key, movie_id in sorted(pairs - present):
+            bucket = buckets[key]
+            slots.append(RandomSlot(bucket=bucket, position=bucket.size, movie_id=movie_id))
+            bucket.size += 1
+        if not slots:
+            return
+        RandomSlot.objects.bulk_create(slots)
+        grown = {slot.bucket for slot in slots}
+        RandomBucket.objects.filter(pk__in=[b.pk for b in grown]).update(
+            size=Case(*(When(pk=b.pk, then=Value(b.size)) for b in grown)))
+
+
+def remove_movies(removals: dict):
+    """
+    Remove movies from their buckets, leaving their positions empty. Draws skip empty positions,
+    buckets that become sparse are renumbered by compact_sparse.
+
+    :param removals: {bucket key: iterable of movie ids}
+    """
+    q = Q()
+    for key, movie_ids in removals.items():
+        if movie_ids:
+            q |= Q(bucket__key=key, movie_id__in=set(movie_ids))
+    if q:
+        RandomSlot.objects.filter(q).delete()
+
+
+def compact(keys):
+    """
+    Renumber the movies of the buckets of keys densely, keeping their order, and start a new generation of each.
+    Draw sessions of an earlier generation start a new cycle.
+    """
+    with transaction.atomic():
+        buckets = {bucket.id: bucket for bucket in
+                   RandomBucket.objects.select_for_update().filter(key__in=set(keys)).order_by('key')}
+        if not buckets:
+            return
+        movie_ids = {bucket_id: [] for bucket_id in buckets}
+        for bucket_id, movie_id in RandomSlot.objects.filter(bucket_id__in=buckets).order_by(
+                'bucket_id', 'position').values_list('bucket_id', 'movie_id'):
+            movie_ids[bucket_id].append(movie_id)
+        RandomSlot.objects.filter(bucket_id__in=buckets).delete()
+        RandomSlot.objects.bulk_create([RandomSlot(bucket_id=bucket_id, position=i, movie_id=m)
+                                        for bucket_id, ids in movie_ids.items() for i, m in enumerate(ids)],
+                                       batch_size=1000)
+        for bucket in buckets.values():
+            bucket.size = len(movie_ids[bucket.id])
+            bucket.generation += 1
+        RandomBucket.objects.bulk_update(buckets.values(), ['size', 'generation'])
+
+
+def compact_sparse(keys):
+    """
+    Compact buckets of keys where fewer than MIN_FILL of the positions hold a movie.
+    """
+    buckets = RandomBucket.objects.filter(key__in=set(keys), size__gt=0).annotate(live=Count('slots'))
+    sparse = [key for key, size, live in buckets.values_list('key', 'size', 'live') if live < size * MIN_FILL]
+    if sparse:
+        compact(sparse)
+
+
+def rebuild():
+    """
+    Drop and recompute all buckets from the movies tables, every bucket starts a new generation.
+    """
+    with transaction.atomic():
+        generations = dict(RandomBucket.objects.values_list('key', 'generation'))
+        RandomBucket.objects.all().delete()
+        buckets = {ALL_KEY: list(Movie.objects.order_by('id').values_list('id', flat=True))}
+        for movie_id, genre_id in GenreMovieMap.objects.order_by('movie_id').values_list('movie_id', 'genre_id'):
+            buckets.setdefault(genre_key(genre_id), []).append(movie_id)
+        for key, movie_ids in buckets.items():
+            bucket = RandomBucket.objects.create(key=key, size=len(movie_ids),
+                                                 generation=generations.get(key, -1) + 1)
+            RandomSlot.objects.bulk_create(
+                [RandomSlot(bucket=bucket, position=i, movie_id=m) for i, m in enumerate(movie_ids)], batch_size=1000)
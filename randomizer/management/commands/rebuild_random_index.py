@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from randomizer import index
+from randomizer.models import RandomBucket
+
+
+class Command(BaseCommand):
+    help = 'Recompute the random movie id index from the movies tables'
+
+    def handle(self, *args, **options):
+        index.rebuild()
+        for bucket in RandomBucket.objects.order_by('key'):
+            self.stdout.write(f'{bucket.key}: {bucket.size}')
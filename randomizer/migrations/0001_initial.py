@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('movies', '0011_alter_persona_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RandomBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RandomSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('bucket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='randomizer.randombucket')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='random_slots', to='movies.movie')),
+            ],
+            options={
+                'unique_together': {('bucket', 'movie'), ('bucket', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+def backfill_buckets(apps, schema_editor):
+    """
+    Append movies missing from their buckets, movies created before the index existed are not indexed by signals.
+    """
+    RandomBucket = apps.get_model('randomizer', 'RandomBucket')
+    RandomSlot = apps.get_model('randomizer', 'RandomSlot')
+    Movie = apps.get_model('movies', 'Movie')
+    GenreMovieMap = apps.get_model('movies', 'GenreMovieMap')
+
+    buckets = {'all': list(Movie.objects.order_by('id').values_list('id', flat=True))}
+    for movie_id, genre_id in GenreMovieMap.objects.order_by('movie_id').values_list('movie_id', 'genre_id'):
+        buckets.setdefault(f'genre:{genre_id}', []).append(movie_id)
+    for key, movie_ids in buckets.items():
+        bucket, _ = RandomBucket.objects.get_or_create(key=key)
+        present = set(RandomSlot.objects.filter(bucket=bucket).values_list('movie_id', flat=True))
+        missing = [movie_id for movie_id in movie_ids if movie_id not in present]
+        RandomSlot.objects.bulk_create([RandomSlot(bucket=bucket, position=bucket.size + i, movie_id=movie_id)
+                                        for i, movie_id in enumerate(missing)], batch_size=1000)
+        bucket.size += len(missing)
+        bucket.save(update_fields=['size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0016_movie_documents'),
+        ('randomizer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='randombucket',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,27 @@
 from django.db import models
+from movies.models import Movie
 
-# Create your models here.
+
+class RandomBucket(models.Model):
+    """
+    Movies of a pool at fixed positions below size, positions of removed movies stay empty until
+    the bucket is compacted into a new generation.
+    """
+    key = models.CharField(max_length=40, unique=True)
+    size = models.PositiveIntegerField(default=0)
+    generation = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.key}: {self.size}'
+
+
+class RandomSlot(models.Model):
+    bucket = models.ForeignKey(RandomBucket, related_name='slots', on_delete=models.CASCADE)
+    position = models.PositiveIntegerField()
+    movie = models.ForeignKey(Movie, related_name='random_slots', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [['bucket', 'position'], ['bucket', 'movie']]
+
+    def __str__(self):
+        return f'{self.bucket.key}[{self.position}]: {self.movie_id}'
@@ -0,0 +1,41 @@
+import random
+
+ROUNDS = 6
+MASK64 = (1 << 64) - 1
+
+
+def _mix(value: int) -> int:
+    # splitmix64 finalizer
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+class Permutation:
+    """
+    Seeded bijection of range(size) computed on demand by a small Feistel network with cycle walking,
+    so the n-th element of a shuffled pool is known from (seed, size, n) without storing the shuffle.
+    """
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        bits += bits % 2
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(64) for _ in range(ROUNDS)]
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix(right ^ key) & self.mask)
+        return (left << self.half) | right
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
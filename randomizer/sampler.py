@@ -0,0 +1,212 @@
+import hashlib
+import json
+import operator
+import random
+from django.core import signing
+from django.db.models import Q
+from movies.models import Movie
+from . import index
+from .models import RandomBucket, RandomSlot
+from .permutation import Permutation
+
+MAX_RATING = 10
+ATTEMPTS = 16
+SCAN_CHUNK = 500
+SCAN_QUERIES = 4
+LOOKAHEAD = 4
+# lookups per batch draw, a selective pool returns a short batch and the cursor moves on in the next call
+MAX_LOOKUPS = 4
+MAX_LOOKUP_POSITIONS = 1000
+PERSONA_FILTERS = {'director', 'writer', 'star'}
+SESSION_SALT = 'randomizer.session'
+
+# query param, movie field, lookup, comparison used when checking an already fetched movie
+FILTERS = (
+    ('year_min', 'year', 'gte', operator.ge),
+    ('year_max', 'year', 'lte', operator.le),
+    ('rating_min', 'rating', 'gte', operator.ge),
+    ('length_min', 'length', 'gte', operator.ge),
+    ('length_max', 'length', 'lte', operator.le),
+)
+
+
+def movie_filters(params: dict, prefix: str = '') -> Q:
+    q = Q()
+    for param, field, lookup, _ in FILTERS:
+        if param in params:
+            q &= Q(**{f'{prefix}{field}__{lookup}': params[param]})
+    return q
+
+
+def matches(movie, params: dict) -> bool:
+    return all(compare(getattr(movie, field), params[param])
+               for param, field, _, compare in FILTERS if param in params)
+
+
+def accept_weight(movie, rng) -> bool:
+    return rng.random() * MAX_RATING < movie.rating
+
+
+def persona_pool(params: dict):
+    """
+    Persona filters narrow the pool to one filmography, small enough to sample directly.
+    Ordered by id, so positions in the pool are the same on every call.
+    """
+    queryset = Movie.objects.filter(movie_filters(params))
+    if 'genre' in params:
+        queryset = queryset.filter(genres=params['genre'])
+    if 'director' in params:
+        queryset = queryset.filter(directors=params['director'])
+    if 'writer' in params:
+        queryset = queryset.filter(writers=params['writer'])
+    if 'star' in params:
+        queryset = queryset.filter(stars=params['star'])
+    return list(queryset.order_by('id').values_list('id', 'rating'))
+
+
+def pick_from_pool(pool: list, weighted: bool, rng):
+    if not pool:
+        return None
+    weights = [float(rating) for _, rating in pool] if weighted else None
+    if weights is not None and not any(weights):
+        weights = None
+    return rng.choices(pool, weights=weights)[0][0]
+
+
+def scan(bucket, params: dict, weighted: bool, rng):
+    """
+    Walk the bucket in the order of a random permutation, SCAN_CHUNK positions per query for at most
+    SCAN_QUERIES queries, and return the first matching movie accepted by weight. The first match of a
+    random order is uniform over the matching movies, wherever they sit and whatever gaps are around them.
+    """
+    slots = RandomSlot.objects.select_related('movie').filter(movie_filters(params, prefix='movie__'), bucket=bucket)
+    permutation = Permutation(bucket.size, rng.getrandbits(32))
+    for start in range(0, min(bucket.size, SCAN_CHUNK * SCAN_QUERIES), SCAN_CHUNK):
+        positions = [permutation[i] for i in range(start, min(start + SCAN_CHUNK, bucket.size))]
+        found = {slot.position: slot.movie for slot in slots.filter(position__in=positions)}
+        for position in positions:
+            movie = found.get(position)
+            if movie is not None and (not weighted or accept_weight(movie, rng)):
+                return movie
+    return None
+
+
+def pick_counted(bucket, params: dict, weighted: bool, rng):
+    """
+    Count the matching movies of the bucket and fetch one at a random offset, for filters too selective
+    to be found by scan. Uniform, at the price of one counted range scan of the bucket.
+    """
+    slots = RandomSlot.objects.select_related('movie').filter(
+        movie_filters(params, prefix='movie__'), bucket=bucket).order_by('position')
+    count = slots.count()
+    movie = None
+    for _ in range(ATTEMPTS if weighted else 1):
+        if not count:
+            break
+        movie = slots[rng.randrange(count)].movie
+        if not weighted or accept_weight(movie, rng):
+            break
+    return movie
+
+
+def pick_movie(params: dict, rng=random):
+    """
+    Pick a random movie matching params without scanning or sorting the movies table.
+
+    Uniform positions are drawn from the precomputed bucket of the genre (or of all movies) and checked
+    against the remaining filters, empty positions are drawn again and rating weighting is applied by rejection.
+    Selective filters fall back to a bounded scan in random order, then to a counted pick.
+
+    :param params: validated RandomPickSerializer data
+    :param rng: random.Random compatible source
+    :return: Movie or None when nothing matches
+    """
+    weighted = params.get('weighted', False)
+    if PERSONA_FILTERS & params.keys():
+        movie_id = pick_from_pool(persona_pool(params), weighted, rng)
+        return Movie.objects.filter(pk=movie_id).first() if movie_id else None
+
+    key = index.genre_key(params['genre']) if 'genre' in params else index.ALL_KEY
+    bucket = RandomBucket.objects.filter(key=key).first()
+    if bucket is None or bucket.size == 0:
+        return None
+
+    for _ in range(ATTEMPTS):
+        slot = RandomSlot.objects.select_related('movie').filter(
+            bucket=bucket, position=rng.randrange(bucket.size)).first()
+        if slot is None:
+            continue
+        if matches(slot.movie, params) and (not weighted or accept_weight(slot.movie, rng)):
+            return slot.movie
+    return scan(bucket, params, weighted, rng) or pick_counted(bucket, params, weighted, rng)
+
+
+def pool_key(params: dict) -> str:
+    return hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def load_session(token, key: str, size: int, generation: int = 0) -> dict:
+    """
+    Restore the draw session from a signed token, starting a new cycle when the token is missing,
+    was issued for other filters or another generation of the bucket, or its cycle is exhausted.
+
+    The session is the whole state: pool key, bucket generation, permutation seed, cursor and pool size
+    at the start of the cycle.
+    """
+    try:
+        session = signing.loads(token, salt=SESSION_SALT) if token else None
+    except signing.BadSignature:
+        session = None
+    if not session or session.get('k') != key or session.get('g', 0) != generation or session['c'] >= session['n']:
+        session = {'k': key, 'g': generation, 's': random.getrandbits(32), 'c': 0, 'n': size}
+    return session
+
+
+def draw_batch(params: dict, count: int, token=None):
+    """
+    Draw up to count distinct movie ids that were not drawn earlier in the session, with at most MAX_LOOKUPS
+    queries. Fewer are returned when they are not found in the positions scanned, the next call goes on from there.
+
+    Pool positions are visited in the order of a seeded permutation, so only the cursor has to be kept
+    between calls. Positions never move within a bucket generation: movies appended after the cycle started
+    are drawn in the next cycle and positions emptied by removed movies are skipped.
+
+    :param params: validated MovieFilterSerializer data
+    :param count: int
+    :param token: session token returned by the previous call
+    :return: (list of movie ids, session token)
+    """
+    generation = 0
+    if PERSONA_FILTERS & params.keys():
+        pool = [movie_id for movie_id, _ in persona_pool(params)]
+        size = len(pool)
+
+        def lookup(positions):
+            return {position: pool[position] for position in positions}
+    else:
+        key = index.genre_key(params['genre']) if 'genre' in params else index.ALL_KEY
+        bucket = RandomBucket.objects.filter(key=key).first()
+        size, generation = (bucket.size, bucket.generation) if bucket else (0, 0)
+        slots = RandomSlot.objects.filter(movie_filters(params, prefix='movie__'), bucket=bucket)
+
+        def lookup(positions):
+            return dict(slots.filter(position__in=positions).values_list('position', 'movie_id'))
+
+    session = load_session(token, pool_key(params), size, generation)
+    permutation = Permutation(session['n'], session['s'])
+    movie_ids, lookahead = [], LOOKAHEAD
+    for _ in range(MAX_LOOKUPS):
+        if len(movie_ids) >= count or session['c'] >= session['n']:
+            break
+        end = min(session['c'] + min((count - len(movie_ids)) * lookahead, MAX_LOOKUP_POSITIONS), session['n'])
+        # misses mean a selective pool, the next lookup looks further ahead
+        lookahead *= LOOKAHEAD
+        positions = [permutation[i] for i in range(session['c'], end)]
+        found = lookup([position for position in positions if position < size])
+        for position in positions:
+            session['c'] += 1
+            if position in found:
+                movie_ids.append(found[position])
+                if len(movie_ids) == count:
+                    break
+    return movie_ids, signing.dumps(session, salt=SESSION_SALT, compress=True)
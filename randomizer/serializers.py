@@ -0,0 +1,11 @@
+from rest_framework import serializers
+from movies.serializers import MovieFilterSerializer
+
+
+class RandomPickSerializer(MovieFilterSerializer):
+    weighted = serializers.BooleanField(required=False, default=False)
+
+
+class RandomBatchSerializer(MovieFilterSerializer):
+    count = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
+    token = serializers.CharField(required=False)
@@ -0,0 +1,102 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from movies import batch
+from movies.models import Movie, Genre, GenreMovieMap
+from movies.signals import movies_imported
+from . import index
+from .models import RandomBucket
+
+
+class IndexChanges:
+    """
+    Movies to add to and remove from buckets, by bucket key.
+    """
+
+    def __init__(self):
+        self.additions, self.removals = {}, {}
+
+    def add(self, key: str, movie_ids):
+        self.additions.setdefault(key, set()).update(movie_ids)
+
+    def remove(self, key: str, movie_ids):
+        self.removals.setdefault(key, set()).update(movie_ids)
+
+
+def flush_index_changes(changes: IndexChanges):
+    """
+    Empty the positions of removed movies in the transaction, append added movies and compact buckets once
+    it commits, so the bucket rows are locked for the append only and not for the whole write.
+    """
+    index.remove_movies(changes.removals)
+    if changes.additions:
+        transaction.on_commit(partial(index.add_movies, changes.additions))
+    if changes.removals:
+        transaction.on_commit(partial(index.compact_sparse, set(changes.removals)))
+
+
+def index_changes(update):
+    """
+    Apply update(changes) at the end of the enclosing batch.deferred() block, or at once outside of one.
+    """
+    pending = batch.pending(flush_index_changes, IndexChanges)
+    if pending is not None:
+        update(pending)
+    else:
+        changes = IndexChanges()
+        update(changes)
+        flush_index_changes(changes)
+
+
+@receiver(post_save, sender=Movie)
+def index_movie(sender, instance, created, **kwargs):
+    if created:
+        index_changes(lambda changes: changes.add(index.ALL_KEY, [instance.id]))
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie(sender, instance, **kwargs):
+    # slots are deleted in cascade with the movie, genre buckets are handled by the deleted genre links
+    index_changes(lambda changes: changes.remove(index.ALL_KEY, [instance.id]))
+
+
+@receiver(movies_imported, sender=Movie)
+def index_imported_movies(sender, movie_ids, **kwargs):
+    def update(changes):
+        changes.add(index.ALL_KEY, movie_ids)
+        for movie_id, genre_id in GenreMovieMap.objects.filter(movie_id__in=movie_ids).values_list(
+                'movie_id', 'genre_id'):
+            changes.add(index.genre_key(genre_id), [movie_id])
+    index_changes(update)
+
+
+@receiver(post_save, sender=GenreMovieMap)
+def index_genre_movie(sender, instance, created, **kwargs):
+    if created:
+        index_changes(lambda changes: changes.add(index.genre_key(instance.genre_id), [instance.movie_id]))
+
+
+@receiver(post_delete, sender=GenreMovieMap)
+def unindex_genre_movie(sender, instance, **kwargs):
+    index_changes(lambda changes: changes.remove(index.genre_key(instance.genre_id), [instance.movie_id]))
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def index_genres_added(sender, instance, action, reverse, pk_set, **kwargs):
+    # bulk adds through the related manager skip post_save, removals go through post_delete
+    if action != 'post_add':
+        return
+
+    def update(changes):
+        if reverse:
+            changes.add(index.genre_key(instance.id), pk_set)
+        else:
+            for genre_id in pk_set:
+                changes.add(index.genre_key(genre_id), [instance.id])
+    index_changes(update)
+
+
+@receiver(pre_delete, sender=Genre)
+def drop_genre_bucket(sender, instance, **kwargs):
+    RandomBucket.objects.filter(key=index.genre_key(instance.id)).delete()
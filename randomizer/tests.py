@@ -1,3 +1,150 @@
+import random
+from collections import Counter
+from decimal import Decimal
+from unittest import mock
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from movies import batch
+from movies.models import Movie, Genre, GenreMovieMap
+from . import index, sampler
+from .models import RandomBucket, RandomSlot
 
-# Create your tests here.
+
+def create_movies(count: int, genre=None, **fields) -> list:
+    movies = []
+    with batch.deferred():
+        for i in range(count):
+            movie = Movie.objects.create(**{'title': f'Movie {i}', 'year': 2000, 'length': 90,
+                                            'rating': Decimal('5.0'), 'trailer': 'http://example.com/t',
+                                            'description': '', **fields})
+            if genre is not None:
+                movie.genres.add(genre)
+            movies.append(movie)
+    return movies
+
+
+class RandomIndexTest(TestCase):
+
+    def setUp(self):
+        self.genre = Genre.objects.create(name='Drama')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies = create_movies(6, genre=self.genre)
+
+    def slots(self, key: str) -> dict:
+        return dict(RandomSlot.objects.filter(bucket__key=key).values_list('position', 'movie_id'))
+
+    def test_movies_are_appended(self):
+        bucket = RandomBucket.objects.get(key=index.ALL_KEY)
+        self.assertEqual(bucket.size, 6)
+        self.assertEqual(self.slots(index.ALL_KEY), {i: movie.id for i, movie in enumerate(self.movies)})
+        self.assertEqual(set(self.slots(index.genre_key(self.genre.id)).values()), {m.id for m in self.movies})
+
+    def test_appended_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            movie, = create_movies(1, title='Late')
+            self.assertNotIn(movie.id, self.slots(index.ALL_KEY).values())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.slots(index.ALL_KEY)[6], movie.id)
+
+    def test_removal_leaves_other_positions(self):
+        before, removed = self.slots(index.ALL_KEY), self.movies[1].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies[1].delete()
+            GenreMovieMap.objects.filter(movie=self.movies[2]).delete()
+        self.assertEqual(self.slots(index.ALL_KEY), {p: m for p, m in before.items() if m != removed})
+        self.assertNotIn(self.movies[2].id, self.slots(index.genre_key(self.genre.id)).values())
+        self.assertEqual(RandomBucket.objects.get(key=index.ALL_KEY).size, 6)
+
+    def test_sparse_bucket_is_compacted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for movie in self.movies[:4]:
+                movie.delete()
+        bucket = RandomBucket.objects.get(key=index.ALL_KEY)
+        self.assertEqual((bucket.size, bucket.generation), (2, 1))
+        self.assertEqual(self.slots(index.ALL_KEY), {0: self.movies[4].id, 1: self.movies[5].id})
+
+    def test_rebuild_matches_incremental_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies[0].delete()
+        live = {key: set(self.slots(key).values()) for key in RandomBucket.objects.values_list('key', flat=True)}
+        index.rebuild()
+        self.assertEqual({key: set(self.slots(key).values()) for key in live}, live)
+        self.assertEqual(RandomBucket.objects.get(key=index.ALL_KEY).generation, 1)
+
+
+class RandomMovieTest(TestCase):
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies = create_movies(10)
+            for movie in self.movies[::2]:
+                movie.delete()
+        self.movies = self.movies[1::2]
+        self.client = APIClient()
+
+    def test_uniform_over_movies_around_gaps(self):
+        rng = random.Random(0)
+        counts = Counter(sampler.pick_movie({}, rng).id for _ in range(1000))
+        self.assertEqual(set(counts), {m.id for m in self.movies})
+        for movie in self.movies:
+            self.assertAlmostEqual(counts[movie.id] / 1000, 0.2, delta=0.05)
+
+    def test_selective_filter_is_uniform(self):
+        Movie.objects.filter(pk__in=[self.movies[0].id, self.movies[3].id]).update(year=1990)
+        rng = random.Random(0)
+        counts = Counter(sampler.pick_movie({'year_max': 1995}, rng).id for _ in range(400))
+        self.assertEqual(set(counts), {self.movies[0].id, self.movies[3].id})
+        self.assertAlmostEqual(counts[self.movies[0].id] / 400, 0.5, delta=0.1)
+
+    def test_endpoint(self):
+        response = self.client.get('/random/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response.data['id'], {m.id for m in self.movies})
+        self.assertEqual(self.client.get('/random/', {'year_min': 2020}).status_code, 404)
+
+
+class RandomBatchTest(TestCase):
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies = create_movies(12)
+        self.client = APIClient()
+
+    def draw(self, token=None, **params):
+        response = self.client.get('/random/batch/', {**params, **({'token': token} if token else {})})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [m['id'] for m in response.data['results']], response.data['token']
+
+    def test_no_repeats_until_pool_runs_out(self):
+        drawn, token = [], None
+        for _ in range(3):
+            movie_ids, token = self.draw(token, count=4)
+            drawn += movie_ids
+        self.assertCountEqual(drawn, [m.id for m in self.movies])
+        movie_ids, _ = self.draw(token, count=4)
+        self.assertEqual(len(movie_ids), 4)
+
+    def test_removed_and_added_movies_keep_the_cycle(self):
+        drawn, token = self.draw(count=4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Movie.objects.get(pk=drawn[0]).delete()
+            late, = create_movies(1, title='Late')
+        for _ in range(2):
+            movie_ids, token = self.draw(token, count=4)
+            drawn += movie_ids
+        self.assertCountEqual(drawn, [m.id for m in self.movies])
+        self.assertNotIn(late.id, drawn)
+
+    def test_selective_pool_is_scanned_in_bounded_steps(self):
+        Movie.objects.filter(pk=self.movies[5].id).update(year=1990)
+        found, token = [], None
+        with mock.patch.object(sampler, 'MAX_LOOKUP_POSITIONS', 1):
+            for _ in range(3):
+                with CaptureQueriesContext(connection) as queries:
+                    movie_ids, token = sampler.draw_batch({'year_max': 1995}, 1, token)
+                self.assertLessEqual(len(queries), 1 + sampler.MAX_LOOKUPS)
+                found += movie_ids
+        self.assertEqual(found, [self.movies[5].id])
@@ -0,0 +1,8 @@
+from django.urls import path
+from movie_random.async_views import async_reads
+from . import views
+
+urlpatterns = [
+    path('', async_reads(views.RandomMovie.as_view())),
+    path('batch/', async_reads(views.RandomBatch.as_view())),
+]
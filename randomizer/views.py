@@ -1,3 +1,35 @@
-from django.shortcuts import render
+from rest_framework import generics, status
+from rest_framework.response import Response
+from movies.fastpath import serialize_movies
+from movies.serializers import MovieSerializer
+from .serializers import RandomPickSerializer, RandomBatchSerializer
+from . import sampler
 
-# Create your views here.
+
+class RandomMovie(generics.GenericAPIView):
+    serializer_class = MovieSerializer
+
+    def get(self, request, *args, **kwargs):
+        filters = RandomPickSerializer(data=request.query_params)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+        movie = sampler.pick_movie(filters.validated_data)
+        if movie is None:
+            return Response({"message": "no movie matches the filters"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(serialize_movies([movie.id])[movie.id], status=status.HTTP_200_OK)
+
+
+class RandomBatch(generics.GenericAPIView):
+    serializer_class = MovieSerializer
+
+    def get(self, request, *args, **kwargs):
+        filters = RandomBatchSerializer(data=request.query_params)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = dict(filters.validated_data)
+        count = params.pop('count')
+        token = params.pop('token', None)
+        movie_ids, token = sampler.draw_batch(params, count, token)
+        movies = serialize_movies(movie_ids)
+        return Response({"token": token, "results": [movies[i] for i in movie_ids if i in movies]},
+                        status=status.HTTP_200_OK)
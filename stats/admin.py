@@ -0,0 +1,19 @@
+from django.contrib import admin
+from .models import GenreStats, PersonaStats, YearStats
+
+
+class GenreStatsAdmin(admin.ModelAdmin):
+    list_display = ('genre', 'movie_count', 'rating_sum')
+
+
+class PersonaStatsAdmin(admin.ModelAdmin):
+    list_display = ('persona', 'director_count', 'writer_count', 'star_count')
+
+
+class YearStatsAdmin(admin.ModelAdmin):
+    list_display = ('year', 'movie_count', 'rating_sum')
+
+
+admin.site.register(GenreStats, GenreStatsAdmin)
+admin.site.register(PersonaStats, PersonaStatsAdmin)
+admin.site.register(YearStats, YearStatsAdmin)
@@ -0,0 +1,191 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from movies import batch
+from movies.models import Movie, Review, GenreMovieMap, Director, Writer, Star
+from .models import MovieStats, GenreStats, PersonaStats, YearStats
+
+# persona through model: (count field, rating sum field)
+ROLE_FIELDS = {
+    Director: ('director_count', 'director_rating_sum'),
+    Writer: ('writer_count', None),
+    Star: ('star_count', None),
+}
+
+
+class CounterChanges:
+    """
+    Counter deltas by summary row in a batch.deferred() block. Deltas by movie rating are kept until the flush
+    looks up the ratings of all their movies at once, or until the movie is saved or deleted with its old rating.
+    """
+
+    def __init__(self):
+        self.deltas, self.ratings, self.unrated = {}, {}, []
+
+    def add(self, model, pk, deltas: dict, rated=None):
+        """
+        :param rated: (movie id, {field: sign}) of fields changed by sign times the rating of the movie
+        """
+        row = self.deltas.setdefault((model, pk), {})
+        for field, delta in deltas.items():
+            row[field] = row.get(field, 0) + delta
+        if rated:
+            movie_id, signs = rated
+            if movie_id in self.ratings:
+                self.add(model, pk, {f: sign * self.ratings[movie_id] for f, sign in signs.items()})
+            else:
+                self.unrated.append((model, pk, movie_id, signs))
+
+    def rate(self, movie_id, old, new):
+        """
+        Apply deltas waiting for the rating of a movie saved or deleted with old rating, later ones use new.
+        """
+        if old is not None:
+            self.resolve({movie_id: old})
+        self.ratings[movie_id] = old if new is None else new
+
+    def resolve(self, ratings: dict = None):
+        """
+        Apply deltas waiting for the movies of ratings, or for all movies looked up at once when ratings is None.
+        """
+        lookup = ratings is None
+        if lookup:
+            movie_ids = {movie_id for _, _, movie_id, _ in self.unrated}
+            ratings = dict(Movie.objects.filter(pk__in=movie_ids).values_list('id', 'rating')) if movie_ids else {}
+        unrated, self.unrated = self.unrated, []
+        for model, pk, movie_id, signs in unrated:
+            if lookup or movie_id in ratings:
+                self.add(model, pk, {f: sign * ratings.get(movie_id, 0) for f, sign in signs.items()})
+            else:
+                self.unrated.append((model, pk, movie_id, signs))
+
+
+def flush_counters(changes: CounterChanges):
+    """
+    Apply the deltas with one UPDATE per summary table and set of equal deltas. Rows are created first for
+    increments and deleted once their counts drop to zero. Decrements never create rows, so a row removed
+    together with its object is not brought back.
+    """
+    changes.resolve()
+    by_model = {}
+    for (model, pk), deltas in changes.deltas.items():
+        deltas = {f: d for f, d in deltas.items() if d}
+        if deltas:
+            by_model.setdefault(model, {})[pk] = deltas
+    for model, rows in by_model.items():
+        created = [pk for pk, deltas in rows.items() if all(d > 0 for d in deltas.values())]
+        if created:
+            model.objects.bulk_create([model(pk=pk) for pk in created], ignore_conflicts=True)
+        groups = {}
+        for pk, deltas in rows.items():
+            groups.setdefault(tuple(sorted(deltas.items())), []).append(pk)
+        for deltas, pks in groups.items():
+            model.objects.filter(pk__in=pks).update(**{f: F(f) + d for f, d in deltas})
+        decremented = [pk for pk, deltas in rows.items() if any(d < 0 for d in deltas.values())]
+        if decremented:
+            model.objects.filter(pk__in=decremented, **{f: 0 for f in model.count_fields}).delete()
+
+
+def _pending():
+    return batch.pending(flush_counters, CounterChanges)
+
+
+def bump(model, pk, rated=None, **deltas):
+    """
+    Add deltas to counters of the summary row, once for all rows when the enclosing batch.deferred() block ends.
+
+    :param rated: (movie id, {field: sign}) of fields changed by sign times the rating of the movie
+    """
+    pending = _pending()
+    if pending is not None:
+        pending.add(model, pk, deltas, rated)
+        return
+    changes = CounterChanges()
+    changes.add(model, pk, deltas, rated)
+    with transaction.atomic():
+        flush_counters(changes)
+
+
+def link_genre(movie_id, genre_id, sign: int, rating=None):
+    if rating is None:
+        bump(GenreStats, genre_id, rated=(movie_id, {'rating_sum': sign}), movie_count=sign)
+    else:
+        bump(GenreStats, genre_id, movie_count=sign, rating_sum=sign * rating)
+
+
+def link_persona(model, movie_id, persona_id, sign: int, rating=None):
+    count_field, rating_field = ROLE_FIELDS[model]
+    deltas, rated = {count_field: sign}, None
+    if rating_field and rating is None:
+        rated = (movie_id, {rating_field: sign})
+    elif rating_field:
+        deltas[rating_field] = sign * rating
+    bump(PersonaStats, persona_id, rated=rated, **deltas)
+
+
+def change_movie(movie_id, old, new):
+    """
+    Move counters of a movie from old (year, rating) to new (year, rating), either may be None.
+    """
+    if old == new:
+        return
+    pending = _pending()
+    if pending is not None:
+        pending.rate(movie_id, old and old[1], new and new[1])
+    if old:
+        bump(YearStats, old[0], movie_count=-1, rating_sum=-old[1])
+    if new:
+        bump(YearStats, new[0], movie_count=1, rating_sum=new[1])
+    if old and new and old[1] != new[1]:
+        delta = new[1] - old[1]
+        for genre_id in GenreMovieMap.objects.filter(movie_id=movie_id).values_list('genre_id', flat=True):
+            bump(GenreStats, genre_id, rating_sum=delta)
+        for persona_id in Director.objects.filter(movie_id=movie_id).values_list('persona_id', flat=True):
+            bump(PersonaStats, persona_id, director_rating_sum=delta)
+
+
+def add_movies(movie_ids):
+    """
+    Count bulk inserted movies and their relations with one grouped query per summary table.
+    """
+    with batch.deferred():
+        for row in Movie.objects.filter(id__in=movie_ids).values('year').annotate(
+                n=Count('id'), s=Sum('rating')).order_by():
+            bump(YearStats, row['year'], movie_count=row['n'], rating_sum=row['s'])
+        for row in GenreMovieMap.objects.filter(movie_id__in=movie_ids).values('genre_id').annotate(
+                n=Count('id'), s=Sum('movie__rating')).order_by():
+            bump(GenreStats, row['genre_id'], movie_count=row['n'], rating_sum=row['s'])
+        for model, (count_field, rating_field) in ROLE_FIELDS.items():
+            for row in model.objects.filter(movie_id__in=movie_ids).values('persona_id').annotate(
+                    n=Count('id'), s=Sum('movie__rating')).order_by():
+                deltas = {count_field: row['n']}
+                if rating_field:
+                    deltas[rating_field] = row['s']
+                bump(PersonaStats, row['persona_id'], **deltas)
+
+
+def rebuild():
+    """
+    Recompute every summary table from the movies tables.
+    """
+    with transaction.atomic():
+        for model in (MovieStats, GenreStats, PersonaStats, YearStats):
+            model.objects.all().delete()
+        MovieStats.objects.bulk_create(
+            [MovieStats(movie_id=row['movie_id'], review_count=row['n'])
+             for row in Review.objects.values('movie_id').annotate(n=Count('id')).order_by()], batch_size=1000)
+        GenreStats.objects.bulk_create(
+            [GenreStats(genre_id=row['genre_id'], movie_count=row['n'], rating_sum=row['s'])
+             for row in GenreMovieMap.objects.values('genre_id').annotate(n=Count('id'), s=Sum('movie__rating'))
+             .order_by()], batch_size=1000)
+        YearStats.objects.bulk_create(
+            [YearStats(year=row['year'], movie_count=row['n'], rating_sum=row['s'])
+             for row in Movie.objects.values('year').annotate(n=Count('id'), s=Sum('rating')).order_by()],
+            batch_size=1000)
+        personas = {}
+        for model, (count_field, rating_field) in ROLE_FIELDS.items():
+            for row in model.objects.values('persona_id').annotate(n=Count('id'), s=Sum('movie__rating')).order_by():
+                stats = personas.setdefault(row['persona_id'], PersonaStats(persona_id=row['persona_id']))
+                setattr(stats, count_field, row['n'])
+                if rating_field:
+                    setattr(stats, rating_field, row['s'])
+        PersonaStats.objects.bulk_create(personas.values(), batch_size=1000)
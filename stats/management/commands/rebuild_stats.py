@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from stats import counters
+from stats.models import MovieStats, GenreStats, PersonaStats, YearStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the summary statistics tables from the movies tables'
+
+    def handle(self, *args, **options):
+        counters.rebuild()
+        for model in (MovieStats, GenreStats, PersonaStats, YearStats):
+            self.stdout.write(f'{model._meta.verbose_name}: {model.objects.count()} rows')
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('movies', '0015_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreStats',
+            fields=[
+                ('genre', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='movies.genre')),
+                ('movie_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MovieStats',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='movies.movie')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PersonaStats',
+            fields=[
+                ('persona', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='movies.persona')),
+                ('director_count', models.PositiveIntegerField(default=0)),
+                ('director_rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ('writer_count', models.PositiveIntegerField(default=0)),
+                ('star_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='YearStats',
+            fields=[
+                ('year', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('movie_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='personastats',
+            index=models.Index(fields=['star_count'], name='stats_perso_star_co_9f285d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personastats',
+            index=models.Index(fields=['director_count'], name='stats_perso_directo_43b9c5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='genrestats',
+            index=models.Index(fields=['movie_count'], name='stats_genre_movie_c_6d0c42_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def backfill_stats(apps, schema_editor):
+    """
+    Compute the summary tables of the existing catalogue, the same way stats.counters.rebuild does.
+    Counters are only kept up to date by signals from then on.
+    """
+    MovieStats = apps.get_model('stats', 'MovieStats')
+    GenreStats = apps.get_model('stats', 'GenreStats')
+    PersonaStats = apps.get_model('stats', 'PersonaStats')
+    YearStats = apps.get_model('stats', 'YearStats')
+    Movie = apps.get_model('movies', 'Movie')
+    Review = apps.get_model('movies', 'Review')
+    GenreMovieMap = apps.get_model('movies', 'GenreMovieMap')
+    roles = (
+        (apps.get_model('movies', 'Director'), 'director_count', 'director_rating_sum'),
+        (apps.get_model('movies', 'Writer'), 'writer_count', None),
+        (apps.get_model('movies', 'Star'), 'star_count', None),
+    )
+
+    for model in (MovieStats, GenreStats, PersonaStats, YearStats):
+        model.objects.all().delete()
+    MovieStats.objects.bulk_create(
+        [MovieStats(movie_id=row['movie_id'], review_count=row['n'])
+         for row in Review.objects.values('movie_id').annotate(n=Count('id')).order_by()], batch_size=1000)
+    GenreStats.objects.bulk_create(
+        [GenreStats(genre_id=row['genre_id'], movie_count=row['n'], rating_sum=row['s'])
+         for row in GenreMovieMap.objects.values('genre_id').annotate(n=Count('id'), s=Sum('movie__rating'))
+         .order_by()], batch_size=1000)
+    YearStats.objects.bulk_create(
+        [YearStats(year=row['year'], movie_count=row['n'], rating_sum=row['s'])
+         for row in Movie.objects.values('year').annotate(n=Count('id'), s=Sum('rating')).order_by()],
+        batch_size=1000)
+    personas = {}
+    for model, count_field, rating_field in roles:
+        for row in model.objects.values('persona_id').annotate(n=Count('id'), s=Sum('movie__rating')).order_by():
+            stats = personas.setdefault(row['persona_id'], PersonaStats(persona_id=row['persona_id']))
+            setattr(stats, count_field, row['n'])
+            if rating_field:
+                setattr(stats, rating_field, row['s'])
+    PersonaStats.objects.bulk_create(personas.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
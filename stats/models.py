@@ -0,0 +1,70 @@
+from decimal import Decimal
+from django.db import models
+from movies.models import Movie, Genre, Persona
+
+
+def average(total, count):
+    return (Decimal(total) / count).quantize(Decimal('0.01')) if count else None
+
+
+class MovieStats(models.Model):
+    movie = models.OneToOneField(Movie, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    review_count = models.PositiveIntegerField(default=0)
+
+    count_fields = ('review_count',)
+
+    def __str__(self):
+        return f'{self.movie_id}: {self.review_count} reviews'
+
+
+class GenreStats(models.Model):
+    genre = models.OneToOneField(Genre, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    movie_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+
+    count_fields = ('movie_count',)
+
+    class Meta:
+        indexes = [models.Index(fields=['movie_count'])]
+
+    def __str__(self):
+        return f'{self.genre_id}: {self.movie_count} movies'
+
+    @property
+    def average_rating(self):
+        return average(self.rating_sum, self.movie_count)
+
+
+class PersonaStats(models.Model):
+    persona = models.OneToOneField(Persona, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    director_count = models.PositiveIntegerField(default=0)
+    director_rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    writer_count = models.PositiveIntegerField(default=0)
+    star_count = models.PositiveIntegerField(default=0)
+
+    count_fields = ('director_count', 'writer_count', 'star_count')
+
+    class Meta:
+        indexes = [models.Index(fields=['star_count']), models.Index(fields=['director_count'])]
+
+    def __str__(self):
+        return f'{self.persona_id}: {self.director_count}/{self.writer_count}/{self.star_count}'
+
+    @property
+    def director_average_rating(self):
+        return average(self.director_rating_sum, self.director_count)
+
+
+class YearStats(models.Model):
+    year = models.PositiveSmallIntegerField(primary_key=True)
+    movie_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+
+    count_fields = ('movie_count',)
+
+    def __str__(self):
+        return f'{self.year}: {self.movie_count} movies'
+
+    @property
+    def average_rating(self):
+        return average(self.rating_sum, self.movie_count)
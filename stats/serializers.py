@@ -0,0 +1,44 @@
+from rest_framework import serializers
+from .models import MovieStats, GenreStats, PersonaStats, YearStats
+
+ROLES = ('director', 'writer', 'star')
+
+
+class MovieStatsSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = MovieStats
+        fields = ['movie_id', 'review_count']
+
+
+class GenreStatsSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='genre.name', read_only=True)
+    average_rating = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = GenreStats
+        fields = ['genre_id', 'name', 'movie_count', 'average_rating']
+
+
+class PersonaStatsSerializer(serializers.ModelSerializer):
+    first_name = serializers.CharField(source='persona.first_name', read_only=True)
+    last_name = serializers.CharField(source='persona.last_name', read_only=True)
+    director_average_rating = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = PersonaStats
+        fields = ['persona_id', 'first_name', 'last_name', 'director_count', 'director_average_rating',
+                  'writer_count', 'star_count']
+
+
+class YearStatsSerializer(serializers.ModelSerializer):
+    average_rating = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = YearStats
+        fields = ['year', 'movie_count', 'average_rating']
+
+
+class TopPersonaQuerySerializer(serializers.Serializer):
+    role = serializers.ChoiceField(choices=ROLES, default='star')
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
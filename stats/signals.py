@@ -0,0 +1,89 @@
+from decimal import Decimal
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from movies.models import Movie, Review, GenreMovieMap, Director, Writer, Star
+from movies.signals import movies_imported
+from . import counters
+from .models import MovieStats
+
+
+def _year_rating(instance) -> tuple:
+    return instance.year, Decimal(str(instance.rating))
+
+
+@receiver(pre_save, sender=Movie)
+def remember_movie_counters(sender, instance, **kwargs):
+    instance._stats_old = None
+    if instance.pk is not None:
+        instance._stats_old = Movie.objects.filter(pk=instance.pk).values_list('year', 'rating').first()
+
+
+@receiver(post_save, sender=Movie)
+def count_saved_movie(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, '_stats_old', None)
+    counters.change_movie(instance.id, old, _year_rating(instance))
+
+
+@receiver(post_delete, sender=Movie)
+def uncount_deleted_movie(sender, instance, **kwargs):
+    # deleted through rows and reviews uncount themselves before the movie row goes
+    counters.change_movie(instance.id, _year_rating(instance), None)
+
+
+@receiver(movies_imported, sender=Movie)
+def count_imported_movies(sender, movie_ids, **kwargs):
+    counters.add_movies(movie_ids)
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(MovieStats, instance.movie_id, review_count=1)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    counters.bump(MovieStats, instance.movie_id, review_count=-1)
+
+
+@receiver(post_save, sender=GenreMovieMap)
+def count_genre_link(sender, instance, created, **kwargs):
+    if created:
+        counters.link_genre(instance.movie_id, instance.genre_id, 1)
+
+
+@receiver(post_delete, sender=GenreMovieMap)
+def uncount_genre_link(sender, instance, **kwargs):
+    counters.link_genre(instance.movie_id, instance.genre_id, -1)
+
+
+@receiver(post_save, sender=Director)
+@receiver(post_save, sender=Writer)
+@receiver(post_save, sender=Star)
+def count_persona_link(sender, instance, created, **kwargs):
+    if created:
+        counters.link_persona(sender, instance.movie_id, instance.persona_id, 1)
+
+
+@receiver(post_delete, sender=Director)
+@receiver(post_delete, sender=Writer)
+@receiver(post_delete, sender=Star)
+def uncount_persona_link(sender, instance, **kwargs):
+    counters.link_persona(sender, instance.movie_id, instance.persona_id, -1)
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+@receiver(m2m_changed, sender=Movie.directors.through)
+@receiver(m2m_changed, sender=Movie.writers.through)
+@receiver(m2m_changed, sender=Movie.stars.through)
+def count_added_links(sender, instance, action, reverse, pk_set, **kwargs):
+    # bulk adds through the related manager skip post_save, removals go through post_delete
+    if action != 'post_add':
+        return
+    pairs = [(movie_id, instance.id) for movie_id in pk_set] if reverse else [(instance.id, i) for i in pk_set]
+    for movie_id, related_id in pairs:
+        rating = None if reverse else _year_rating(instance)[1]
+        if sender is GenreMovieMap:
+            counters.link_genre(movie_id, related_id, 1, rating)
+        else:
+            counters.link_persona(sender, movie_id, related_id, 1, rating)
@@ -0,0 +1,144 @@
+import datetime
+import json
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from accounts.models import Account
+from movies import batch, importer
+from movies.models import Movie, Genre, Persona, GenreMovieMap, Director, Star, Review
+from . import counters
+from .models import MovieStats, GenreStats, PersonaStats, YearStats
+
+
+def snapshot() -> dict:
+    return {model.__name__: sorted(model.objects.values_list(*[f.attname for f in model._meta.concrete_fields]))
+            for model in (MovieStats, GenreStats, PersonaStats, YearStats)}
+
+
+class CounterBatchTest(TestCase):
+
+    def setUp(self):
+        self.genres = [Genre.objects.create(name=name) for name in ('Drama', 'Comedy')]
+        self.personas = [Persona.objects.create(first_name=f'P{i}', last_name='Doe',
+                                                birthdate=datetime.date(1970, 1, 1)) for i in range(3)]
+
+    def create_movie(self, i: int, rating: str) -> Movie:
+        movie = Movie.objects.create(title=f'Movie {i}', year=2000 + i % 2, length=90, rating=Decimal(rating),
+                                     trailer='http://example.com/t', description='')
+        movie.genres.add(*self.genres[:1 + i % 2])
+        Director.objects.create(movie=movie, persona=self.personas[0])
+        movie.stars.add(*self.personas[1:])
+        return movie
+
+    def assertMatchesRebuild(self):
+        counted = snapshot()
+        counters.rebuild()
+        self.assertEqual(counted, snapshot())
+
+    def test_batched_counters_match_rebuild(self):
+        with batch.deferred():
+            movies = [self.create_movie(i, f'{i + 4}.5') for i in range(4)]
+        with batch.deferred():
+            GenreMovieMap.objects.filter(movie=movies[0], genre=self.genres[0]).delete()
+            movies[0].rating = Decimal('9.0')
+            movies[0].save()
+            movies[0].genres.add(self.genres[1])
+            movies[1].delete()
+            Star.objects.filter(movie=movies[2]).delete()
+        self.assertMatchesRebuild()
+
+    def test_unbatched_counters_match_rebuild(self):
+        movies = [self.create_movie(i, '6.0') for i in range(2)]
+        Director.objects.filter(movie=movies[0]).delete()
+        movies[1].delete()
+        self.assertMatchesRebuild()
+
+    def test_counters_flush_once(self):
+        counts = []
+        for numbers in ([0], [2, 4, 6, 8]):
+            with CaptureQueriesContext(connection) as queries, batch.deferred():
+                for i in numbers:
+                    self.create_movie(i, '7.0')
+            counts.append(len([q for q in queries if '"stats_' in q['sql']]))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(PersonaStats.objects.get(pk=self.personas[0].id).director_rating_sum, Decimal('35.0'))
+
+    def test_imported_movies_match_rebuild(self):
+        counts = []
+        for numbers in ([0, 1], range(2, 12)):
+            lines = [{'title': f'Imported {i}', 'year': 2000 + i % 3, 'length': 90, 'rating': f'{i % 5 + 4}.5',
+                      'trailer': 'http://example.com/t', 'description': 'Plot', 'genres': ['Drama', f'Genre {i % 2}'],
+                      'directors': [{'first_name': 'P0', 'last_name': 'Doe', 'birthdate': '1970-01-01'}],
+                      'stars': [{'first_name': f'S{i}', 'last_name': 'Roe', 'birthdate': '1980-01-01'}]}
+                     for i in numbers]
+            with CaptureQueriesContext(connection) as queries:
+                list(importer.import_lines([json.dumps(line) for line in lines]))
+            counts.append(len([q for q in queries if '"stats_' in q['sql']]))
+        self.assertEqual(counts[0], counts[1])
+        self.assertMatchesRebuild()
+
+
+class StatsEndpointTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.drama, self.comedy, self.empty = [Genre.objects.create(name=n) for n in ('Drama', 'Comedy', 'Empty')]
+        self.jane, self.john = [Persona.objects.create(first_name=name, last_name='Doe',
+                                                       birthdate=datetime.date(1970, 1, 1))
+                                for name in ('Jane', 'John')]
+        with batch.deferred():
+            self.movies = []
+            for i, (year, rating) in enumerate(((2000, '6.0'), (2000, '8.0'), (2001, '7.0'))):
+                movie = Movie.objects.create(title=f'Movie {i}', year=year, length=90, rating=Decimal(rating),
+                                             trailer='http://example.com/t', description='Plot')
+                movie.genres.add(self.drama, *([self.comedy] if i else []))
+                movie.directors.add(self.jane if i < 2 else self.john)
+                movie.stars.add(self.john)
+                self.movies.append(movie)
+
+    def get(self, url: str, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_genres(self):
+        rows = self.get('/stats/genres/')['results']
+        self.assertEqual([(r['name'], r['movie_count'], r['average_rating']) for r in rows],
+                         [('Drama', 3, '7.00'), ('Comedy', 2, '7.50')])
+        self.assertEqual(self.get(f'/stats/genres/{self.empty.id}/')['movie_count'], 0)
+        self.assertEqual(self.client.get('/stats/genres/0/').status_code, 404)
+
+    def test_years_and_rating_changes(self):
+        self.movies[2].year, self.movies[2].rating = 2000, Decimal('10.0')
+        self.movies[2].save()
+        rows = self.get('/stats/years/')['results']
+        self.assertEqual([(r['year'], r['movie_count'], r['average_rating']) for r in rows], [(2000, 3, '8.00')])
+        self.assertEqual(self.get(f'/stats/personas/{self.john.id}/')['director_average_rating'], '10.00')
+        self.assertEqual(self.get(f'/stats/genres/{self.comedy.id}/')['average_rating'], '9.00')
+
+    def test_top_personas(self):
+        self.assertEqual([r['first_name'] for r in self.get('/stats/personas/top/', role='director')],
+                         ['Jane', 'John'])
+        self.assertEqual([(r['first_name'], r['star_count']) for r in self.get('/stats/personas/top/')],
+                         [('John', 3)])
+        self.assertEqual(self.get(f'/stats/personas/{self.jane.id}/')['director_average_rating'], '7.00')
+        self.assertEqual(self.client.get('/stats/personas/top/', {'role': 'producer'}).status_code, 400)
+
+    def test_reviews(self):
+        account = Account.objects.create_user('user', 'user@example.com', 'password')
+        review = Review.objects.create(movie=self.movies[0], account=account, title='Good', review='Good')
+        self.assertEqual(self.get(f'/stats/movies/{self.movies[0].id}/')['review_count'], 1)
+        review.delete()
+        self.assertEqual(self.get(f'/stats/movies/{self.movies[0].id}/')['review_count'], 0)
+
+    def test_rebuild_command(self):
+        counted = snapshot()
+        YearStats.objects.all().delete()
+        stdout = StringIO()
+        call_command('rebuild_stats', stdout=stdout)
+        self.assertEqual(snapshot(), counted)
+        self.assertIn('year stats: 2 rows', stdout.getvalue())
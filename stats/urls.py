@@ -0,0 +1,11 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('movies/<int:pk>/', views.MovieStatsDetail.as_view()),
+    path('genres/', views.GenreStatsList.as_view()),
+    path('genres/<int:pk>/', views.GenreStatsDetail.as_view()),
+    path('personas/top/', views.TopPersonaStats.as_view()),
+    path('personas/<int:pk>/', views.PersonaStatsDetail.as_view()),
+    path('years/', views.YearStatsList.as_view()),
+]
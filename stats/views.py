@@ -0,0 +1,67 @@
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, status
+from rest_framework.response import Response
+from movies.models import Movie, Genre, Persona
+from .models import MovieStats, GenreStats, PersonaStats, YearStats
+from .serializers import (MovieStatsSerializer, GenreStatsSerializer, PersonaStatsSerializer, YearStatsSerializer,
+                          TopPersonaQuerySerializer)
+
+
+class StatsDetail(generics.RetrieveAPIView):
+    """
+    Summary row of an object looked up by primary key, objects without a row yet get zero counters.
+    """
+    owner_model = None
+
+    def get_object(self):
+        try:
+            return self.get_queryset().get(pk=self.kwargs['pk'])
+        except self.get_queryset().model.DoesNotExist:
+            owner = get_object_or_404(self.owner_model.objects.all(), pk=self.kwargs['pk'])
+            return self.get_queryset().model(pk=owner.pk, **{self.owner_field: owner})
+
+    @property
+    def owner_field(self) -> str:
+        return self.owner_model._meta.model_name
+
+
+class MovieStatsDetail(StatsDetail):
+    queryset = MovieStats.objects.all()
+    serializer_class = MovieStatsSerializer
+    owner_model = Movie
+
+
+class GenreStatsList(generics.ListAPIView):
+    queryset = GenreStats.objects.select_related('genre').order_by('-movie_count')
+    serializer_class = GenreStatsSerializer
+
+
+class GenreStatsDetail(StatsDetail):
+    queryset = GenreStats.objects.select_related('genre')
+    serializer_class = GenreStatsSerializer
+    owner_model = Genre
+
+
+class PersonaStatsDetail(StatsDetail):
+    queryset = PersonaStats.objects.select_related('persona')
+    serializer_class = PersonaStatsSerializer
+    owner_model = Persona
+
+
+class TopPersonaStats(generics.GenericAPIView):
+    queryset = PersonaStats.objects.select_related('persona')
+    serializer_class = PersonaStatsSerializer
+
+    def get(self, request, *args, **kwargs):
+        query = TopPersonaQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        count_field = f"{query.validated_data['role']}_count"
+        personas = self.get_queryset().filter(**{f'{count_field}__gt': 0}).order_by(f'-{count_field}', 'pk')
+        serializer = self.get_serializer(personas[:query.validated_data['limit']], many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class YearStatsList(generics.ListAPIView):
+    queryset = YearStats.objects.order_by('year')
+    serializer_class = YearStatsSerializer